@@ -88,3 +88,60 @@ ALTER TABLE lectureStudentSetting DROP FOREIGN KEY lectureStudentSetting_ibfk_3;
 CREATE TABLE student_collationbup LIKE student;
 INSERT INTO student_collationbup SELECT * FROM student;
 ALTER TABLE student CONVERT TO CHARACTER SET utf8 COLLATE utf8_bin;
+
+-- 2026-10-18
+
+CREATE INDEX ix_answer_lectureId_studentId_timeEnd ON answer (lectureId, studentId, timeEnd);
+ALTER TABLE subscription ADD registered BOOL NOT NULL DEFAULT FALSE;
+UPDATE subscription SET registered = TRUE WHERE plonePath LIKE '/%/schools-and-classes/%';
+CREATE INDEX ix_subscription_studentId_registered ON subscription (studentId, registered);
+ALTER TABLE question ADD difficultyBucket INT NULL;
+UPDATE question SET difficultyBucket = ROUND(50.0 * timesCorrect / timesAnswered) WHERE timesAnswered > 0;
+-- Throw away any duplicate answers before adding unique index, as sync.answers.removeDuplicateAnswers()
+-- NB: Use @@quizdb-rebuild-answersummary afterwards to fix the affected answerSummary rows
+DELETE a1 FROM answer a1 JOIN answer a2
+    ON a1.studentId = a2.studentId AND a1.lectureId = a2.lectureId
+    AND a1.questionId = a2.questionId AND a1.timeEnd = a2.timeEnd
+    AND a1.answerId > a2.answerId;
+CREATE UNIQUE INDEX ix_answer_studentId_lectureId_questionId_timeEnd ON answer (studentId, lectureId, questionId, timeEnd);
+CREATE TABLE `tutorial` (
+  `tutorialId` int(11) NOT NULL AUTO_INCREMENT,
+  `hostId` int(11) NOT NULL,
+  `plonePath` varchar(128) NOT NULL,
+  PRIMARY KEY (`tutorialId`),
+  UNIQUE KEY `hostId` (`hostId`,`plonePath`),
+  CONSTRAINT `tutorial_ibfk_1` FOREIGN KEY (`hostId`) REFERENCES `host` (`hostId`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+INSERT INTO tutorial (hostId, plonePath)
+    SELECT DISTINCT hostId, LEFT(plonePath, LENGTH(plonePath) - LENGTH(SUBSTRING_INDEX(plonePath, '/', -1)) - 1)
+    FROM lecture
+    WHERE plonePath NOT LIKE '/deleted-%';
+ALTER TABLE lecture ADD COLUMN tutorialId INT(11) NULL DEFAULT NULL AFTER plonePath;
+ALTER TABLE lecture ADD COLUMN ordinal INT(11) NULL DEFAULT NULL AFTER tutorialId;
+ALTER TABLE lecture ADD CONSTRAINT `lecture_tutorialId` FOREIGN KEY (`tutorialId`) REFERENCES `tutorial` (`tutorialId`);
+CREATE INDEX ix_lecture_tutorialId_ordinal ON lecture (tutorialId, ordinal);
+UPDATE lecture l JOIN tutorial t
+    ON t.hostId = l.hostId
+    AND t.plonePath = LEFT(l.plonePath, LENGTH(l.plonePath) - LENGTH(SUBSTRING_INDEX(l.plonePath, '/', -1)) - 1)
+    SET l.tutorialId = t.tutorialId
+    WHERE l.plonePath NOT LIKE '/deleted-%';
+UPDATE lecture l JOIN (
+    SELECT l1.lectureId, COUNT(*) - 1 AS ordinal
+    FROM lecture l1 JOIN lecture l2 ON l2.tutorialId = l1.tutorialId AND l2.plonePath <= l1.plonePath
+    GROUP BY l1.lectureId
+) o ON o.lectureId = l.lectureId
+    SET l.ordinal = o.ordinal;
+CREATE TABLE `tutorialSummary` (
+  `studentId` int(11) NOT NULL,
+  `tutorialId` int(11) NOT NULL,
+  `lecturesAced` int(11) NOT NULL,
+  PRIMARY KEY (`studentId`,`tutorialId`),
+  CONSTRAINT `tutorialSummary_ibfk_1` FOREIGN KEY (`studentId`) REFERENCES `student` (`studentId`),
+  CONSTRAINT `tutorialSummary_ibfk_2` FOREIGN KEY (`tutorialId`) REFERENCES `tutorial` (`tutorialId`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+INSERT INTO tutorialSummary (studentId, tutorialId, lecturesAced)
+    SELECT s.studentId, l.tutorialId, COUNT(*)
+    FROM answerSummary s JOIN lecture l ON l.lectureId = s.lectureId
+    WHERE s.gradeHighWaterMark >= 9.750
+    AND l.tutorialId IS NOT NULL
+    GROUP BY 1, 2;
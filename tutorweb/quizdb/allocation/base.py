@@ -21,9 +21,10 @@ def allocation_module(mod_name):
 
 class Allocation(object):
     @classmethod
-    def allocFor(cls, student, dbLec, urlBase="/"):
+    def allocFor(cls, student, dbLec, urlBase="/", settings=None):
         """Return the correct Allocation Method instance for this lecture"""
-        settings = getStudentSettings(dbLec, student)
+        if settings is None:
+            settings = getStudentSettings(dbLec, student)
         alloc_method = settings.get('allocation_method', 'original')
 
         return allocation_module(alloc_method)(
@@ -58,6 +59,8 @@ class Allocation(object):
         self.urlBase = urlBase
         self.targetDifficulty = None
         self.reAllocQuestions = False
+        self.answerQueueCursor = None
+        self.answerQueueDelta = False
 
     def getQuestion(self, uri, **kwargs):
         qns = list(self.getQuestions(uris=[uri], **kwargs))
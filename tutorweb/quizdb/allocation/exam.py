@@ -2,10 +2,8 @@ import re
 import urllib
 import urllib2
 
-from z3c.saconfig import Session
-
-from tutorweb.quizdb import db
 from .base import Allocation as BaseAllocation
+from .questionbank import getQuestionBank, fetchQuestions
 
 
 class ExamAllocation(BaseAllocation):
@@ -28,25 +26,18 @@ class ExamAllocation(BaseAllocation):
         return None
 
     def getQuestions(self, uris=None, lockForUpdate=False, isAdmin=False, active=True):
-        query = Session.query(db.Question).order_by(db.Question.plonePath)
-        query = query.filter(db.Question.lectures.contains(self.dbLec))
+        bank = getQuestionBank(self.dbLec)
         # TODO: If you've already answered a question, not allowed to answer it again
         # TODO: Restrict right down to only returning the next question?
 
         if uris is not None:
-            query = query.filter(db.Question.plonePath.in_(
+            qnIds = bank.selectPaths(sorted(
                 self.dbLec.plonePath + '/' + self._decomposeUrl(u)['questionId'] for u in uris
-            ))
+            ), active=active)
         else:
-            query = query.filter(db.Question.onlineOnly == False)
-
-        if lockForUpdate:
-            query = query.with_lockmode('update')
-
-        if active is not None:
-            query = query.filter(db.Question.active == active)
+            qnIds = bank.select(onlineOnly=False, active=active)
 
-        for dbQn in query:
+        for dbQn in fetchQuestions(qnIds, lockForUpdate=lockForUpdate, active=active):
             yield (self._questionUrl(dbQn), dbQn)
 
     def updateAllocation(self, settings, question_cap=0):
@@ -2,11 +2,12 @@ import datetime
 import random
 import re
 
-from sqlalchemy.sql import func
 from z3c.saconfig import Session
 
 from tutorweb.quizdb import db
 from .base import Allocation as BaseAllocation, DEFAULT_QUESTION_CAP
+from .questionbank import getQuestionBank, fetchQuestions
+from .sampling import sampleIds
 
 
 def parse_uri(uri):
@@ -94,6 +95,22 @@ class OriginalAllocation(BaseAllocation):
             for (dbQn, dbAlloc) in query:
                 yield (self._questionUrl(dbAlloc.publicId), dbQn)
 
+    def _nearestDifficulty(self, questionIds, limit):
+        """
+        Return up to limit of questionIds closest to targetDifficulty. A
+        lecture's questions are few enough to fetch by primary key & sort here
+        """
+        if not questionIds:
+            return []
+        target = int(round(self.targetDifficulty * 50))
+        candidates = (Session.query(db.Question.questionId, db.Question.difficultyBucket)
+            .filter(db.Question.questionId.in_(questionIds))
+            .all())
+
+        # NB: Unanswered questions have a NULL bucket, and go first. Random order otherwise
+        candidates.sort(key=lambda c: (-1 if c[1] is None else abs(target - c[1]), random.random()))
+        return [c[0] for c in candidates[:limit]]
+
     def updateAllocation(self, settings, question_cap=DEFAULT_QUESTION_CAP):
         # Get all existing allocations from the DB and their questions
         allocsByType = dict()
@@ -141,29 +158,38 @@ class OriginalAllocation(BaseAllocation):
 
             # Assign required questions randomly
             if len(allocs) < questionCap:
-                query = Session.query(db.Question).filter_by(qnType='tw_questiontemplate' if allocType == 'template' else 'tw_latexquestion').filter_by(active=True)
+                qnType = 'tw_questiontemplate' if allocType == 'template' else 'tw_latexquestion'
                 if allocType == 'historical':
                     # Get questions from lectures "before" the current one
-                    targetQuestions = (Session.query(db.LectureQuestion.questionId)
-                        .join(db.Lecture)
-                        .filter(db.Lecture.plonePath.startswith(re.sub(r'/[^/]+/?$', '/', self.dbLec.plonePath)))
-                        .filter(db.Lecture.plonePath < self.dbLec.plonePath)
-                        .subquery())
-                    query = query.filter(db.Question.questionId.in_(targetQuestions))
+                    sourceLecs = (Session.query(db.Lecture)
+                        .filter(db.Lecture.tutorialId == self.dbLec.tutorialId)
+                        .filter(db.Lecture.ordinal < self.dbLec.ordinal)
+                        .all()) if self.dbLec.tutorialId is not None else []
                 else:
                     # Git questions from current lecture
-                    query = query.filter(db.Question.lectures.contains(self.dbLec))
-
-                # Filter out anything already allocated
+                    sourceLecs = [self.dbLec]
                 allocIds = [a['alloc'].questionId for a in allocs]
-                if len(allocIds) > 0:
-                    query = query.filter(~db.Question.questionId.in_(allocIds))
 
-                # Give a target difficulty
-                if self.targetDifficulty is not None:
-                    query = query.order_by(func.abs(round(self.targetDifficulty * 50) - func.round((50.0 * db.Question.timesCorrect) / db.Question.timesAnswered)))
+                if not sourceLecs:
+                    qnIds = []
+                elif self.targetDifficulty is not None:
+                    # Give a target difficulty, choosing from question banks
+                    qnIds = self._nearestDifficulty(
+                        list(set(id for l in sourceLecs for id in getQuestionBank(l).select(qnType=qnType)).difference(allocIds)),
+                        max(questionCap - len(allocs), 0),
+                    )
+                else:
+                    # Choose from question banks, ignoring anything already allocated
+                    qnIds = sampleIds(
+                        (id for l in sourceLecs for id in getQuestionBank(l).select(qnType=qnType)),
+                        max(questionCap - len(allocs), 0),
+                        exclude=allocIds,
+                    )
+
+                # Fetch chosen questions, keeping the order we chose them in
+                dbQns = fetchQuestions(qnIds, active=True)
 
-                for dbQn in query.order_by(func.random()).limit(max(questionCap - len(allocs), 0)):
+                for dbQn in dbQns:
                     dbAlloc = db.Allocation(
                         studentId=self.student.studentId,
                         questionId=dbQn.questionId,
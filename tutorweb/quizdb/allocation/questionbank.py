@@ -0,0 +1,90 @@
+"""
+In-process copy of each lecture's questions, so allocation can choose from
+them without asking the database each time
+"""
+import array
+
+from z3c.saconfig import Session
+
+from tutorweb.quizdb import db
+from tutorweb.quizdb.cache import LRUCache
+
+# (lectureId, lastUpdate) -> QuestionBank
+bankCache = LRUCache(maxSize=1000)
+
+
+class QuestionBank(object):
+    """All questions in a lecture, in plonePath order, as compact arrays"""
+
+    def __init__(self, rows):
+        """rows: iterable of (questionId, qnType, active, plonePath)"""
+        self.questionIds = array.array('l')
+        self.qnTypes = []
+        self.active = array.array('b')
+        self.plonePaths = []
+        for (questionId, qnType, active, plonePath) in sorted(rows, key=lambda r: r[3]):
+            self.questionIds.append(questionId)
+            self.qnTypes.append(intern(str(qnType)))
+            self.active.append(1 if active else 0)
+            self.plonePaths.append(plonePath)
+        self._pathIndex = dict((p, i) for (i, p) in enumerate(self.plonePaths))
+
+    def __len__(self):
+        return len(self.questionIds)
+
+    def select(self, qnType=None, onlineOnly=None, active=True):
+        """Return list of questionIds that match all given criteria"""
+        return [
+            self.questionIds[i]
+            for i in xrange(len(self.questionIds))
+            if (qnType is None or self.qnTypes[i] == qnType)
+            and (onlineOnly is None or (self.qnTypes[i] == 'tw_questiontemplate') == onlineOnly)
+            and (active is None or bool(self.active[i]) == active)
+        ]
+
+    def selectPaths(self, plonePaths, active=True):
+        """Return list of questionIds for any plonePaths in the bank"""
+        out = []
+        for p in plonePaths:
+            i = self._pathIndex.get(p, None)
+            if i is not None and (active is None or bool(self.active[i]) == active):
+                out.append(self.questionIds[i])
+        return out
+
+
+def getQuestionBank(dbLec):
+    """Fetch QuestionBank for dbLec, cached until the lecture is next updated"""
+    cacheKey = (dbLec.lectureId, dbLec.lastUpdate)
+    out = bankCache.get(cacheKey, None)
+    if out is None:
+        out = QuestionBank(Session.query(
+                db.Question.questionId,
+                db.Question.qnType,
+                db.Question.active,
+                db.Question.plonePath,
+            )
+            .join(db.LectureQuestion, db.Question.questionId == db.LectureQuestion.questionId)
+            .filter(db.LectureQuestion.lectureId == dbLec.lectureId))
+        bankCache.set(cacheKey, out)
+    return out
+
+
+def invalidateQuestionBank(lectureId=None):
+    """Forget cached QuestionBank for a lecture, or everything"""
+    bankCache.invalidate(None if lectureId is None else lambda k: k[0] == lectureId)
+
+
+def fetchQuestions(questionIds, lockForUpdate=False, active=None):
+    """
+    Return list of db.Question objects for questionIds, in the same order.
+    If active isn't None, drop questions that don't match, the bank may be stale
+    """
+    if not questionIds:
+        return []
+    query = Session.query(db.Question).filter(db.Question.questionId.in_(questionIds))
+    if active is not None:
+        query = query.filter(db.Question.active == active)
+    if lockForUpdate:
+        query = query.with_lockmode('update')
+    dbQns = dict((dbQn.questionId, dbQn) for dbQn in query)
+    return [dbQns[id] for id in questionIds if id in dbQns]
@@ -0,0 +1,10 @@
+"""
+Random selection of questions, without asking the database to sort them
+"""
+import random
+
+
+def sampleIds(ids, k, exclude=()):
+    """Return up to k of ids in random order, ignoring duplicates and anything in exclude"""
+    candidates = list(set(ids).difference(exclude))
+    return random.sample(candidates, min(k, len(candidates)))
@@ -1,6 +1,8 @@
+import collections
 import json
 import logging
 import re
+import sys
 
 from AccessControl import Unauthorized
 from App.config import getConfiguration
@@ -21,6 +23,59 @@ from tutorweb.quizdb.lzstring.lzstring import LZString
 from tutorweb.quizdb.utils import getDbHost, getDbStudent, getDbLecture
 
 
+# Collect streamed JSON into chunks of about this size before writing
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+class _StreamAborted(Exception):
+    """Streaming a response failed after some of it was written, holds original exc_info"""
+    def __init__(self, excInfo):
+        super(_StreamAborted, self).__init__(str(excInfo[1]))
+        self.excInfo = excInfo
+
+
+def _hasContainers(values):
+    return any(isinstance(v, (dict, list, tuple, collections.Iterator)) for v in values)
+
+
+def iterJson(obj):
+    """
+    Yield obj encoded as JSON in pieces, as json.dumps() would. Any iterators
+    (e.g. generators) are encoded as lists as they are consumed, so they never
+    have to be in memory all at once
+    """
+    if isinstance(obj, collections.Iterator):
+        yield '['
+        sep = ''
+        for x in obj:
+            yield sep
+            for chunk in iterJson(x):
+                yield chunk
+            sep = ', '
+        yield ']'
+    elif isinstance(obj, dict) and _hasContainers(obj.itervalues()):
+        yield '{'
+        sep = ''
+        for (k, v) in obj.iteritems():
+            # NB: json.dumps() turns non-string keys into strings
+            yield sep + json.dumps(k if isinstance(k, basestring) else json.dumps(k)) + ': '
+            for chunk in iterJson(v):
+                yield chunk
+            sep = ', '
+        yield '}'
+    elif isinstance(obj, (list, tuple)) and _hasContainers(obj):
+        yield '['
+        sep = ''
+        for x in obj:
+            yield sep
+            for chunk in iterJson(x):
+                yield chunk
+            sep = ', '
+        yield ']'
+    else:
+        yield json.dumps(obj)
+
+
 class BrowserViewHelpers(object):
     @view.memoize
     def getDbHost(self):
@@ -96,6 +151,22 @@ class JSONBrowserView(BrowserView, BrowserViewHelpers):
         """Return dict to be turned into JSON"""
         raise NotImplementedError
 
+    def asJson(self, data):
+        """Return JSON string, override if you can do better than asDict"""
+        return json.dumps(self.asDict(data))
+
+    def asJsonChunks(self, data):
+        """Yield JSON string in pieces, used instead of asJson() when stream_json is set"""
+        return iterJson(self.asDict(data))
+
+    def getETag(self, data):
+        """Return ETag for the response, or None if it can't be worked out cheaply"""
+        return None
+
+    def parseBody(self, body):
+        """Turn request body string into data for asDict()"""
+        return json.loads(body)
+
     def __call__(self):
         try:
             # Is there a request body?
@@ -103,17 +174,55 @@ class JSONBrowserView(BrowserView, BrowserViewHelpers):
                 # NB: Should be checking self.request.getHeader('Content-Type') ==
                 # 'application/json' but zope.testbrowser cannae do that.
                 self.request.stdin.seek(0)
-                data = json.loads(self.request.stdin.read())
+                data = self.parseBody(self.request.stdin.read())
             else:
                 data = self.request.form
 
-            out = self.asDict(data)
+            # If the client's copy is still current, don't bother generating it again
+            etag = self.getETag(data)
+            if etag is not None:
+                self.request.response.setHeader("ETag", etag)
+                ifNoneMatch = [x.strip() for x in (self.request.get_header('If-None-Match') or '').split(',')]
+                if etag in ifNoneMatch or '*' in ifNoneMatch:
+                    self.request.response.setStatus(304)
+                    return ''
+
+            if getattr(self, 'stream_json', False) and not getattr(self, 'compress_utf16', False):
+                # Write JSON out as it's generated, rather than building one big string
+                response = self.request.response
+                response.setStatus(200)
+                response.setHeader("Content-type", "application/json")
+                buf = []
+                bufLen = 0
+                written = False
+                try:
+                    for chunk in self.asJsonChunks(data):
+                        buf.append(chunk)
+                        bufLen += len(chunk)
+                        if bufLen >= STREAM_CHUNK_SIZE:
+                            written = True
+                            response.write(''.join(buf))
+                            buf = []
+                            bufLen = 0
+                    written = True
+                    response.write(''.join(buf))
+                except Exception:
+                    if not written:
+                        raise
+                    # Too late for an error response, don't append one to a 200
+                    raise _StreamAborted(sys.exc_info())
+                return ""
+
+            out = self.asJson(data)
             self.request.response.setStatus(200)
             if getattr(self, 'compress_utf16', False):
                 self.request.response.setHeader("Content-type", "application/binary; charset=utf-16")
-                return LZString.compressToUTF16(json.dumps(out))
+                return LZString.compressToUTF16(out)
             self.request.response.setHeader("Content-type", "application/json")
-            return json.dumps(out)
+            return out
+        except _StreamAborted, ex:
+            logging.error("Failed streaming call: " + self.request['URL'])
+            raise ex.excInfo[0], ex.excInfo[1], ex.excInfo[2]
         except Unauthorized, ex:
             self.request.response.setStatus(403)
             self.request.response.setHeader("Content-type", "application/json")
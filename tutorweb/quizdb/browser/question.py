@@ -1,4 +1,5 @@
 import base64
+import hashlib
 import json
 import logging
 import urlparse
@@ -21,6 +22,7 @@ from tutorweb.quizdb import db
 from tutorweb.quizdb.allocation.base import Allocation
 from .base import JSONBrowserView
 
+from ..sync.questions import questionCacheKey, questionJsonCache
 from ..sync.student import getStudentSettings
 
 # logging.getLogger('sqlalchemy.engine').setLevel(logging.DEBUG)
@@ -29,8 +31,14 @@ from ..sync.student import getStudentSettings
 class QuestionView(JSONBrowserView):
     """Base class: fetches questions and obsfucates"""
 
+    def obsfucateAnswer(self, out):
+        """Encode answer in question dict, so it's not immediately obvious"""
+        if 'answer' in out:
+            out['answer'] = base64.b64encode(json.dumps(out['answer']))
+        return out
+
     def ugQuestionToJson(self, ugQn):
-        """Turn a db.ugQuestion object into a JSON representation"""
+        """Turn a db.ugQuestion object into a JSON representation, obsfucating the answer"""
 
         qnUri = self.request.getURL()
         if '?' in qnUri:
@@ -57,25 +65,15 @@ class QuestionView(JSONBrowserView):
                 out['shuffle'].append(i)  # Shuffle everything
             if corr:
                 out['answer']['correct'].append(i)
-        return out
+        return self.obsfucateAnswer(out)
 
     def getQuestionData(self, dbQn, dbLec):
         """Fetch dict for question, obsfucating the answer"""
         out = None
 
-        def getQuestionDict(plonePath):
-            if '?' in plonePath:
-                (plonePath, querystring) = plonePath.split('?', 1)
-                querystring = urlparse.parse_qs(querystring)
-            else:
-                querystring = {}
-
-            try:
-                #NB: Unrestricted so we can see this even when direct access is banned
-                dataView = self.portalObject().unrestrictedTraverse(str(plonePath) + '/@@data')
-            except KeyError:
-                raise NotFound(self, str(plonePath), self.request)
-            return dataView.asDict(querystring)
+        def getQuestionDict():
+            # NB: Decoded from the shared JSON, so answer is already obsfucated
+            return json.loads(self.getQuestionDataJson(dbQn))
 
         # Is the student requesting a particular question they've done before?
         if not out and dbQn.qnType == 'tw_questiontemplate' and 'question_id' in self.request.form and 'author_qn' not in self.request.form:
@@ -135,14 +133,15 @@ class QuestionView(JSONBrowserView):
                     )))
 
                 ugAnswerQuery = aliased(db.UserGeneratedAnswer, ugAnswerQuery.subquery())
-                ugQn = (Session.query(db.UserGeneratedQuestion)
+                ugQnQuery = (Session.query(db.UserGeneratedQuestion)
                     .outerjoin(ugAnswerQuery)
                     .filter(ugAnswerQuery.ugQuestionGuid == None)
                     .filter(db.UserGeneratedQuestion.questionId == dbQn.questionId)
                     .filter(db.UserGeneratedQuestion.studentId != student.studentId)
-                    .filter(db.UserGeneratedQuestion.superseded == None)
-                    .order_by(func.random())
-                    .first())
+                    .filter(db.UserGeneratedQuestion.superseded == None))
+                # Pick one at a random offset, rather than sorting them all randomly
+                ugQnCount = ugQnQuery.count()
+                ugQn = ugQnQuery.offset(random.randrange(ugQnCount)).first() if ugQnCount > 0 else None
                 if ugQn is not None:
                     # Found one, should return it
                     out = self.ugQuestionToJson(ugQn)
@@ -151,7 +150,7 @@ class QuestionView(JSONBrowserView):
                     raise BadRequest("No questions for student to review")
             else:
                 # Author a question
-                out = getQuestionDict(dbQn.plonePath)
+                out = getQuestionDict()
                 qnUri = self.request.getURL()
                 if '?' in qnUri:
                     qnUri = qnUri.split('?')[0]
@@ -180,13 +179,32 @@ class QuestionView(JSONBrowserView):
 
         # No custom techniques, fetch question @@data
         if not out:
-            out = getQuestionDict(dbQn.plonePath)
+            out = getQuestionDict()
+        return out
 
-        # Obsfucate answer
-        if 'answer' in out:
-            out['answer'] = base64.b64encode(json.dumps(out['answer']))
+    def getQuestionDataJson(self, dbQn):
+        """Question @@data as JSON with answer obsfucated, shared between students"""
+        # Rendering is expensive, re-use it until the question changes
+        cacheKey = questionCacheKey(dbQn)
+        out = questionJsonCache.get(cacheKey, None)
+        if out is None:
+            (plonePath, querystring) = cacheKey[0:2]
+            try:
+                #NB: Unrestricted so we can see this even when direct access is banned
+                dataView = self.portalObject().unrestrictedTraverse(str(plonePath) + '/@@data')
+            except KeyError:
+                raise NotFound(self, str(plonePath), self.request)
+            out = json.dumps(self.obsfucateAnswer(dataView.asDict(urlparse.parse_qs(querystring))))
+            questionJsonCache.set(cacheKey, out)
         return out
 
+    def getQuestionJson(self, dbQn, dbLec):
+        """getQuestionData() as JSON, shared between students where possible"""
+        if dbQn.qnType == 'tw_questiontemplate':
+            # Depends on the student / request, so can't share
+            return json.dumps(self.getQuestionData(dbQn, dbLec))
+        return self.getQuestionDataJson(dbQn)
+
 
 class GetQuestionView(QuestionView):
     """Fetched the named allocated question"""
@@ -238,18 +256,38 @@ class GetLectureQuestionsView(QuestionView):
     """Fetch all questions for a lecture"""
     compress_utf16 = True
 
-    def asDict(self, data):
+    def allQuestions(self):
+        """List of (questionUri, dbQn) for the current student, caching it"""
+        if getattr(self, '_allQuestions', None) is None:
+            alloc = Allocation.allocFor(
+                student=self.getCurrentStudent(),
+                dbLec=self.getDbLecture(),
+                urlBase=self.portalObject().absolute_url(),
+            )
+            self._allQuestions = list(alloc.getAllQuestions())
+        return self._allQuestions
+
+    def getETag(self, data):
+        """
+        Hash of question URIs (as getAllQuestionPath) and when they last changed,
+        None if there are template questions, since they vary per-request
+        """
+        if any(dbQn.qnType == 'tw_questiontemplate' for (questionUri, dbQn) in self.allQuestions()):
+            return None
+        h = hashlib.sha1()
+        for (questionUri, dbQn) in sorted(self.allQuestions(), key=lambda x: x[0]):
+            h.update(questionUri.encode('utf8'))
+            h.update(str(dbQn.lastUpdate))
+        return '"%s"' % h.hexdigest()
+
+    def asJson(self, data):
         dbLec = self.getDbLecture()
-        alloc = Allocation.allocFor(
-            student=self.getCurrentStudent(),
-            dbLec=dbLec,
-            urlBase=self.portalObject().absolute_url(),
-        )
 
-        out = {}
-        for questionUri, dbQn in alloc.getAllQuestions():
+        # Stitch together pre-serialised questions, rather than encoding a dict
+        out = []
+        for questionUri, dbQn in self.allQuestions():
             try:
-                out[questionUri] = self.getQuestionData(dbQn, dbLec)
+                out.append(json.dumps(questionUri) + ': ' + self.getQuestionJson(dbQn, dbLec))
             except NotFound:
                 pass
-        return out
+        return '{' + ', '.join(out) + '}'
@@ -1,22 +1,35 @@
 import datetime
 
-from ..replication.dump import dumpData
-from ..replication.ingest import ingestData, updateHost
-from .base import JSONBrowserView
+from ..replication.dump import dumpData, iterDumpData
+from ..replication.ingest import ingestData, loadDump, updateHost
+from ..sync.answers import rebuildAnswerSummaries
+from .base import JSONBrowserView, iterJson
 
 class ReplicationDumpView(JSONBrowserView):
     """Dump out the data from given dates"""
+    stream_json = True
 
-    def asDict(self, data={}):
+    def checkLocal(self):
         if 'HTTP_X_FORWARDED_FOR' in self.request.environ or \
                 self.request.environ['REMOTE_ADDR'] != '127.0.0.1':
             raise ValueError("Only for use in scripts")  # TODO: 403?
 
+    def asDict(self, data={}):
+        self.checkLocal()
         return dumpData(data)
 
+    def asJsonChunks(self, data={}):
+        # Fetch rows as they get written out, instead of all up front
+        self.checkLocal()
+        return iterJson(iterDumpData(data))
+
 class ReplicationIngestView(JSONBrowserView):
     """Dump out the data from given dates"""
 
+    def parseBody(self, body):
+        # Accept gzipped dumps, as written by the replication script
+        return loadDump(body)
+
     def asDict(self, data={}):
         if 'HTTP_X_FORWARDED_FOR' in self.request.environ or \
                 self.request.environ['REMOTE_ADDR'] != '127.0.0.1':
@@ -33,3 +46,11 @@ class ReplicationUpdateHostView(JSONBrowserView):
         if 'hostKey' not in data:
             raise ValueError("fqdn missing, should be a UUID")
         return updateHost(data['fqdn'], data['hostKey'])
+
+class RebuildAnswerSummaryView(JSONBrowserView):
+    """Recalculate any answerSummary rows that have drifted from the answer table"""
+
+    def asDict(self, data={}):
+        return dict(
+            repaired=rebuildAnswerSummaries(),
+        )
@@ -6,6 +6,7 @@ from z3c.saconfig import Session
 from tutorweb.quizdb import db
 
 from .base import JSONBrowserView
+from ..sync.student import invalidateStudentSettings
 
 
 def toArray(o):
@@ -36,6 +37,7 @@ class SubscriptionView(JSONBrowserView):
                     plonePath=ploneTutPath,
                 ))
             Session.flush()
+            invalidateStudentSettings(studentId=student.studentId)
 
         # Fish out all subscribed tutorials/classes, organised by tutorial
         del_lec = toArray(data.get('del_lec', []))
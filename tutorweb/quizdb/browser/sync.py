@@ -1,21 +1,75 @@
-import re
-
 from AccessControl import Unauthorized
 from z3c.saconfig import Session
 
 from tutorweb.quizdb import db
+from tutorweb.quizdb.utils import getDbLecture
 
 from .base import JSONBrowserView
 
 from ..allocation.base import Allocation
 from ..sync.questions import getQuestionAllocation, getAllQuestionPath
-from ..sync.answers import parseAnswerQueue
-from ..sync.student import getStudentSettings, SERVERSIDE_SETTINGS
+from ..sync.answers import parseAnswerQueue, getAnswerQueues
+from ..sync.student import getAllStudentSettings, getStudentSettings, SERVERSIDE_SETTINGS
 
 # logging.getLogger('sqlalchemy.engine').setLevel(logging.DEBUG)
 
-class SyncTutorialView(JSONBrowserView):
+class SyncViewBase(JSONBrowserView):
+    def checkLectureUser(self, lecture, student):
+        """Check we're the right user, given the data"""
+        if lecture.get('user', None) and lecture['user'] != student.userName:
+            raise Unauthorized('This drill is for user ' + lecture['user'] + ', not ' + student.userName)
+
+    def lectureDict(self, lectureObj, dbLec, student, lecture, nextLec, settings=None, allocObj=None, answerQueue=None):
+        """Build lecture dict, doing any parts not already done for us"""
+        # Get settings for student
+        if settings is None:
+            settings = getStudentSettings(dbLec, student)
+
+        if allocObj is None:
+            allocObj = Allocation.allocFor(
+                student=student,
+                dbLec=dbLec,
+                urlBase=self.portalObject().absolute_url(),
+                settings=settings,
+            )
+
+        # Parse answer queue first to update question counts
+        if answerQueue is None:
+            answerQueue = parseAnswerQueue(
+                allocObj,
+                lecture.get('answerQueue', []),
+                settings,
+                studentSettings=lecture.get('settings', []),
+                answerQueueCursor=lecture.get('answerQueueCursor', None),
+            )
+
+        # ... then fetch question lists
+        questions = list(getQuestionAllocation(
+            allocObj,
+            settings,
+        ))
+
+        # Build lecture dict
+        return dict(
+            uri=self.lectureObjToUrl(lectureObj),
+            next_uri=self.lectureObjToUrl(nextLec) if nextLec else None,
+            user=student.userName,
+            question_uri=self.lectureObjToUrl(lectureObj, getAllQuestionPath(questions)),
+            slide_uri=self.lectureObjToUrl(lectureObj, 'slide-html'),
+            review_uri=self.lectureObjToUrl(lectureObj, 'quizdb-review-ugqn'),
+            title=lectureObj.title,
+            settings=dict((k, v) for k, v in settings.items() if k not in SERVERSIDE_SETTINGS),
+            answerQueue=answerQueue,
+            answerQueueCursor=allocObj.answerQueueCursor,
+            answerQueueDelta=allocObj.answerQueueDelta,
+            questions=questions,
+        )
+
+
+class SyncTutorialView(SyncViewBase):
     def asDict(self, data):
+        student = self.getCurrentStudent()
+
         # If there's a incoming tutorial, break up lectures so each can be updated
         tutorial = data or dict()
         lectureDict = dict(
@@ -25,78 +79,87 @@ class SyncTutorialView(JSONBrowserView):
         )
 
         # Fetch a list of all lectures
-        lectureUrls = (
-            l.id + '/quizdb-sync'
+        lectureObjs = [
+            l.getObject()
             for l
             in self.context.restrictedTraverse('@@folderListing')(
                 portal_type='tw_lecture',
                 sort_on='id',
             )
+        ]
+        lectures = [lectureDict.get(l.id + '/quizdb-sync', None) or dict() for l in lectureObjs]
+        for lecture in lectures:
+            self.checkLectureUser(lecture, student)
+
+        # Fetch all DB lectures within the tutorial, in order
+        dbTutLecs = (Session.query(db.Lecture)
+            .join(db.Tutorial)
+            .filter(db.Tutorial.hostId == self.getDbHost().hostId)
+            .filter(db.Tutorial.plonePath == '/'.join(self.context.getPhysicalPath()))
+            .order_by(db.Lecture.ordinal)
+            .all())
+        dbTutLecsByPath = dict((l.plonePath, l) for l in dbTutLecs)
+        dbTutLecsIndex = dict((l.lectureId, i) for (i, l) in enumerate(dbTutLecs))
+        dbLecs = [
+            dbTutLecsByPath.get('/'.join(l.getPhysicalPath()), None) or getDbLecture('/'.join(l.getPhysicalPath()))
+            for l in lectureObjs
+        ]
+
+        # Fetch settings and allocation objects for every lecture
+        allSettings = getAllStudentSettings(dbLecs, student)
+        allocObjs = [Allocation.allocFor(
+            student=student,
+            dbLec=dbLec,
+            urlBase=self.portalObject().absolute_url(),
+            settings=settings,
+        ) for (dbLec, settings) in zip(dbLecs, allSettings)]
+
+        # Lectures with new answers need parsing, fetch the rest in one go
+        answerQueues = getAnswerQueues(
+            [a for (a, l) in zip(allocObjs, lectures) if not any(not x.get('synced', False) for x in l.get('answerQueue', []))],
+            answerQueueCursors=dict(
+                (dbLec.lectureId, l['answerQueueCursor'])
+                for (dbLec, l) in zip(dbLecs, lectures)
+                if l.get('answerQueueCursor', None) is not None
+            ),
         )
 
+        out = []
+        for (lectureObj, dbLec, lecture, settings, allocObj) in zip(lectureObjs, dbLecs, lectures, allSettings, allocObjs):
+            # Next lecture is the next one along in the tutorial
+            i = dbTutLecsIndex.get(dbLec.lectureId, len(dbTutLecs))
+            out.append(self.lectureDict(
+                lectureObj,
+                dbLec,
+                student,
+                lecture,
+                dbTutLecs[i + 1] if i + 1 < len(dbTutLecs) else None,
+                settings=settings,
+                allocObj=allocObj,
+                answerQueue=answerQueues.get(dbLec.lectureId, None),
+            ))
+
         return dict(
             uri=self.lectureObjToUrl(self.context),
             title=self.context.title,
-            lectures=[
-                self.context.restrictedTraverse(url).asDict(lectureDict.get(url, None))
-                for url
-                in lectureUrls
-            ],
+            lectures=out,
         )
 
 
-class SyncLectureView(JSONBrowserView):
+class SyncLectureView(SyncViewBase):
     def asDict(self, data):
         student = self.getCurrentStudent()
-        portalObj = self.portalObject()
         dbLec = self.getDbLecture()
 
         # Check we're the right user, given the data
         lecture = data or dict()
-        if lecture.get('user', None) and lecture['user'] != student.userName:
-            raise Unauthorized('This drill is for user ' + lecture['user'] + ', not ' + student.userName)
-
-        # Get settings for student
-        settings = getStudentSettings(dbLec, student)
-
-        allocObj = Allocation.allocFor(
-            student=student,
-            dbLec=dbLec,
-            urlBase=self.context.portal_url.getPortalObject().absolute_url(),
-        )
-
-        # Parse answer queue first to update question counts
-        answerQueue = parseAnswerQueue(
-            allocObj,
-            lecture.get('answerQueue', []),
-            settings,
-            studentSettings=lecture.get('settings', []),
-        )
-
-        # ... then fetch question lists
-        questions = list(getQuestionAllocation(
-            allocObj,
-            settings,
-        ))
+        self.checkLectureUser(lecture, student)
 
         # Find any next lecure
         nextLec = (Session.query(db.Lecture)
-            .filter(db.Lecture.hostId == dbLec.hostId)
-            .filter(db.Lecture.plonePath.startswith(re.sub(r'/[^/]+/?$', '/', dbLec.plonePath)))
-            .filter(db.Lecture.plonePath > dbLec.plonePath)
-            .order_by(db.Lecture.plonePath)
-            .first())
+            .filter(db.Lecture.tutorialId == dbLec.tutorialId)
+            .filter(db.Lecture.ordinal > dbLec.ordinal)
+            .order_by(db.Lecture.ordinal)
+            .first()) if dbLec.tutorialId is not None else None
 
-        # Build lecture dict
-        return dict(
-            uri=self.lectureObjToUrl(self.context),
-            next_uri=self.lectureObjToUrl(nextLec) if nextLec else None,
-            user=student.userName,
-            question_uri=self.lectureObjToUrl(self.context, getAllQuestionPath(questions)),
-            slide_uri=self.lectureObjToUrl(self.context, 'slide-html'),
-            review_uri=self.lectureObjToUrl(self.context, 'quizdb-review-ugqn'),
-            title=self.context.title,
-            settings=dict((k, v) for k, v in settings.items() if k not in SERVERSIDE_SETTINGS),
-            answerQueue=answerQueue,
-            questions=questions,
-        )
+        return self.lectureDict(self.context, dbLec, student, lecture, nextLec)
@@ -0,0 +1,75 @@
+"""
+In-process caches, shared between threads of a Zope instance
+"""
+import collections
+import threading
+import time
+
+import transaction
+
+
+class LRUCache(object):
+    """
+    Dict-like cache that throws away least-recently-used entries, and
+    optionally anything older than maxAge seconds
+    """
+    _time = staticmethod(time.time)
+
+    def __init__(self, maxSize=1000, maxAge=None):
+        self.maxSize = maxSize
+        self.maxAge = maxAge
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                (value, expires) = self._entries.pop(key)
+            except KeyError:
+                return default
+            if expires is not None and expires < self._time():
+                return default
+            self._entries[key] = (value, expires)  # NB: Move to most-recently-used end
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, None if self.maxAge is None else self._time() + self.maxAge)
+            while len(self._entries) > self.maxSize:
+                self._entries.popitem(last=False)
+
+    def setAfterCommit(self, key, value):
+        """
+        Set value once the current transaction commits. Use this if value
+        depends on anything written in the transaction, so we never cache
+        something that was rolled back.
+        """
+        def hook(success):
+            if success:
+                self.set(key, value)
+        transaction.get().addAfterCommitHook(hook)
+
+    def invalidateAfterCommit(self, match=None):
+        """
+        Invalidate now, and again once the current transaction commits, so
+        anything cached by other threads from the old state in the meantime
+        is thrown away too
+        """
+        self.invalidate(match)
+        def hook(success):
+            if success:
+                self.invalidate(match)
+        transaction.get().addAfterCommitHook(hook)
+
+    def invalidate(self, match=None):
+        """Remove all entries, or those where match(key) is true"""
+        with self._lock:
+            if match is None:
+                self._entries.clear()
+                return
+            for key in [k for k in self._entries.keys() if match(k)]:
+                del self._entries[key]
+
+    def __len__(self):
+        return len(self._entries)
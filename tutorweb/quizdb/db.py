@@ -1,9 +1,10 @@
 import random
+import re
 from uuid import uuid4
 from hashlib import md5
 from datetime import datetime
 
-from sqlalchemy import Table, UniqueConstraint, ForeignKeyConstraint
+from sqlalchemy import Table, Index, UniqueConstraint, ForeignKeyConstraint
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import relationship
 import sqlalchemy.event
@@ -264,6 +265,7 @@ class Subscription(ORMBase):
     """Student <-> Lecture subscriptions"""
     __tablename__ = 'subscription'
     __table_args__ = (
+        Index('ix_subscription_studentId_registered', 'studentId', 'registered'),
         dict(
             mysql_engine='InnoDB',
             mysql_charset='utf8',
@@ -285,6 +287,45 @@ class Subscription(ORMBase):
         nullable=False,
         default=False,
     )
+    registered = sqlalchemy.schema.Column(
+        # i.e. plonePath is a class, so the student is "registered"
+        sqlalchemy.types.Boolean(),
+        nullable=False,
+        default=False,
+    )
+
+
+@sqlalchemy.event.listens_for(Subscription, "before_insert")
+def setSubscriptionRegistered(mapper, connection, instance):
+    """Note if this subscription is to a class"""
+    instance.registered = bool(re.match(r'/.*/schools-and-classes/', instance.plonePath))
+
+
+class Tutorial(ORMBase):
+    """Tutorial table: The tutorials lectures belong to"""
+    __tablename__ = 'tutorial'
+    __table_args__ = (
+        UniqueConstraint('hostId', 'plonePath'),
+        dict(
+            mysql_engine='InnoDB',
+            mysql_charset='utf8',
+        )
+    )
+
+    tutorialId = sqlalchemy.schema.Column(
+        sqlalchemy.types.Integer(),
+        autoincrement=True,
+        primary_key=True,
+    )
+    hostId = sqlalchemy.schema.Column(
+        sqlalchemy.types.Integer(),
+        sqlalchemy.schema.ForeignKey('host.hostId'),
+        nullable=False,
+    )
+    plonePath = sqlalchemy.schema.Column(
+        sqlalchemy.types.String(128),
+        nullable=False,
+    )
 
 
 class Lecture(ORMBase):
@@ -292,6 +333,7 @@ class Lecture(ORMBase):
     __tablename__ = 'lecture'
     __table_args__ = (
         UniqueConstraint('hostId', 'plonePath'),
+        Index('ix_lecture_tutorialId_ordinal', 'tutorialId', 'ordinal'),
         dict(
             mysql_engine='InnoDB',
             mysql_charset='utf8',
@@ -323,6 +365,18 @@ class Lecture(ORMBase):
         default=0,  # NB: Should ~always jump to 1 when populated
         nullable=False,
     )
+    tutorialId = sqlalchemy.schema.Column(
+        # Tutorial this lecture is in, NULL if removed
+        sqlalchemy.types.Integer(),
+        sqlalchemy.schema.ForeignKey('tutorial.tutorialId'),
+        nullable=True,
+    )
+    tutorial = relationship("Tutorial", backref="lectures")
+    ordinal = sqlalchemy.schema.Column(
+        # Position within tutorial, in plonePath order
+        sqlalchemy.types.Integer(),
+        nullable=True,
+    )
     questions = relationship("Question",
         secondary=LectureQuestion.__table__,
         backref="lectures")
@@ -521,6 +575,11 @@ class Question(ORMBase):
         nullable=False,
         default=0,
     )
+    difficultyBucket = sqlalchemy.schema.Column(
+        # round(50 * timesCorrect / timesAnswered), or NULL if never answered
+        sqlalchemy.types.Integer(),
+        nullable=True,
+    )
     lastUpdate = sqlalchemy.schema.Column(
         sqlalchemy.types.DateTime(),
         nullable=False,
@@ -542,6 +601,16 @@ class Question(ORMBase):
         return 'template' if self.qnType == 'tw_questiontemplate' else 'regular'
 
 
+@sqlalchemy.event.listens_for(Question, "before_insert")
+@sqlalchemy.event.listens_for(Question, "before_update")
+def setDifficultyBucket(mapper, connection, instance):
+    """Keep difficultyBucket in step with timesAnswered / timesCorrect"""
+    if instance.timesAnswered:
+        instance.difficultyBucket = int(round(50.0 * (instance.timesCorrect or 0) / instance.timesAnswered))
+    else:
+        instance.difficultyBucket = None
+
+
 class Student(ORMBase):
     """Student table: Students of quizzes"""
     __tablename__ = 'student'
@@ -602,6 +671,10 @@ class Answer(ORMBase):
         ForeignKeyConstraint(
             [lectureId, lectureVersion],
             [LectureGlobalSetting.lectureId, LectureGlobalSetting.lectureVersion]),
+        # Fetch latest answer for a lecture/student without scanning history
+        Index('ix_answer_lectureId_studentId_timeEnd', 'lectureId', 'studentId', 'timeEnd'),
+        # A student can only answer a question once at any one time
+        Index('ix_answer_studentId_lectureId_questionId_timeEnd', 'studentId', 'lectureId', 'questionId', 'timeEnd', unique=True),
         __table_args__,
     )
     studentId = sqlalchemy.schema.Column(
@@ -704,6 +777,34 @@ class AnswerSummary(ORMBase):
     )
 
 
+class TutorialSummary(ORMBase):
+    """Tutorial summary table: Per-student rollup of lectures aced within a tutorial"""
+    __tablename__ = 'tutorialSummary'
+    __table_args__ = dict(
+        mysql_engine='InnoDB',
+        mysql_charset='utf8',
+    )
+
+    studentId = sqlalchemy.schema.Column(
+        sqlalchemy.types.Integer(),
+        sqlalchemy.schema.ForeignKey('student.studentId'),
+        primary_key=True,
+        nullable=False,
+    )
+    tutorialId = sqlalchemy.schema.Column(
+        sqlalchemy.types.Integer(),
+        sqlalchemy.schema.ForeignKey('tutorial.tutorialId'),
+        primary_key=True,
+        nullable=False,
+    )
+    lecturesAced = sqlalchemy.schema.Column(
+        # Number of lectures where gradeHighWaterMark crossed 9.750
+        sqlalchemy.types.Integer(),
+        nullable=False,
+        default=0,
+    )
+
+
 class DeprecatedLectureSetting(ORMBase):
     """
     Settings given to a student when answering questions
@@ -0,0 +1,49 @@
+"""
+Compare original bit-at-a-time compressor with _compressFast, on a
+quizdb-all-questions-like JSON payload.
+
+    python benchmark.py [questions] [repeats]
+"""
+import json
+import random
+import sys
+import timeit
+
+from lzstring import _compress, _compressFast
+
+try:
+    unichr
+except NameError:
+    unichr = chr
+
+
+def fakeQuestions(count):
+    """JSON roughly shaped like a lecture's worth of questions"""
+    random.seed(0)
+    words = ['sample', 'mean', 'variance', 'estimate', '$x_i$', '\\\\frac{1}{n}', 'distribution', 'the', 'of', 'is']
+    def sentence(n):
+        return " ".join(random.choice(words) for i in range(n))
+    return json.dumps(dict(
+        ('http://tutor-web.net/quizdb-get-question/%040x' % random.getrandbits(160), dict(
+            title=sentence(4),
+            text='<div class="parse-as-tex">%s</div>' % sentence(40),
+            choices=['<div class="parse-as-tex">%s</div>' % sentence(6) for i in range(4)],
+            shuffle=[0, 1, 2, 3],
+            answer='eyJjb3JyZWN0IjogWzJdLCAiZXhwbGFuYXRpb24iOiAiIn0=',
+        )) for q in range(count)
+    ))
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    payload = fakeQuestions(count)
+    utf16 = lambda a: unichr(a + 32)
+
+    print('Payload: %d questions, %d bytes' % (count, len(payload)))
+    print('Identical output: %s' % (_compress(payload, 15, utf16) == _compressFast(payload, 15, utf16)))
+    results = {}
+    for (name, fn) in [('_compress', _compress), ('_compressFast', _compressFast)]:
+        results[name] = min(timeit.repeat(lambda: fn(payload, 15, utf16), number=1, repeat=repeats))
+        print('%-14s %8.3fs' % (name, results[name]))
+    print('Speedup:       %8.1fx' % (results['_compress'] / results['_compressFast']))
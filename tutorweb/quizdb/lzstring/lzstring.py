@@ -6,6 +6,7 @@ terms of the Do What The Fuck You Want To Public License, Version 2,
 as published by Sam Hocevar. See the COPYING file for more details.
 """
 
+import itertools
 import math
 try:
     # NB: unichr() is only available in Python2
@@ -17,6 +18,7 @@ except NameError:
 keyStrBase64 = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/="
 keyStrUriSafe = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+-$"
 baseReverseDic = {};
+reverseTables = {}
 
 class Object(object):
     def __init__(self, **kwargs):
@@ -217,6 +219,101 @@ def _compress(uncompressed, bitsPerChar, getCharFromInt):
     return "".join(context_data)
 
 
+def _reverseTable(bitsPerChar):
+    """List mapping every bitsPerChar-bit integer to its bit-reversed self"""
+    if bitsPerChar not in reverseTables:
+        reverseTables[bitsPerChar] = [
+            int(bin(i)[2:].zfill(bitsPerChar)[::-1], 2)
+            for i in range(1 << bitsPerChar)
+        ]
+    return reverseTables[bitsPerChar]
+
+
+def _compressFast(uncompressed, bitsPerChar, getCharFromInt):
+    """
+    Same output as _compress, but first works out the list of
+    (value, numBits) codes to write, then packs them into characters with
+    integer operations instead of shuffling one bit at a time.
+    """
+    if (uncompressed is None):
+        return ""
+
+    dictionary = {}
+    dictionaryToCreate = set()
+    enlargeIn = 2 # Compensate for the first entry which should not count
+    dictSize = 3
+    numBits = 2
+    codes = []
+    emit = codes.append
+    w = ""
+
+    # NB: None on the end marks the end of the input, and outputs the code for w
+    for c in itertools.chain(uncompressed, (None,)):
+        if c is not None:
+            if c not in dictionary:
+                dictionary[c] = dictSize
+                dictSize += 1
+                dictionaryToCreate.add(c)
+
+            wc = w + c
+            if wc in dictionary:
+                w = wc
+                continue
+
+        if w != "":
+            if w in dictionaryToCreate:
+                value = ord(w[0])
+                if value < 256:
+                    emit((0, numBits))
+                    emit((value, 8))
+                else:
+                    emit((1, numBits))
+                    emit((value, 16))
+                enlargeIn -= 1
+                if enlargeIn == 0:
+                    enlargeIn = 1 << numBits
+                    numBits += 1
+                dictionaryToCreate.remove(w)
+            else:
+                emit((dictionary[w], numBits))
+
+        enlargeIn -= 1
+        if enlargeIn == 0:
+            enlargeIn = 1 << numBits
+            numBits += 1
+
+        if c is None:
+            break
+
+        # Add wc to the dictionary.
+        dictionary[wc] = dictSize
+        dictSize += 1
+        w = c
+
+    # Mark the end of the stream
+    emit((2, numBits))
+
+    # Each code is written least-significant bit first, characters are filled
+    # most-significant bit first. So stack codes up in an integer from the
+    # bottom, and reverse each character's worth as it's taken off.
+    reverse = _reverseTable(bitsPerChar)
+    mask = (1 << bitsPerChar) - 1
+    data = []
+    data_val = 0
+    data_bits = 0
+    for (value, n) in codes:
+        data_val |= value << data_bits
+        data_bits += n
+        while data_bits >= bitsPerChar:
+            data.append(getCharFromInt(reverse[data_val & mask]))
+            data_val >>= bitsPerChar
+            data_bits -= bitsPerChar
+
+    # Flush the last char, always output even if there's nothing left
+    data.append(getCharFromInt(reverse[data_val & mask]))
+    return "".join(data)
+
+
 def _decompress(length, resetValue, getNextValue):
     dictionary = {}
     enlargeIn = 4
@@ -371,19 +468,19 @@ def _decompress(length, resetValue, getNextValue):
 class LZString(object):
     @staticmethod
     def compress(uncompressed):
-        return _compress(uncompressed, 16, chr)
+        return _compressFast(uncompressed, 16, chr)
 
     @staticmethod
     def compressToUTF16(uncompressed):
         if uncompressed is None:
             return ""
-        return _compress(uncompressed, 15, lambda a: unichr(a+32)) + " "
+        return _compressFast(uncompressed, 15, lambda a: unichr(a+32)) + " "
 
     @staticmethod
     def compressToBase64(uncompressed):
         if uncompressed is None:
             return ""
-        res = _compress(uncompressed, 6, lambda a: keyStrBase64[a])
+        res = _compressFast(uncompressed, 6, lambda a: keyStrBase64[a])
         # To produce valid Base64
         end = len(res) % 4
         print (end)
@@ -395,7 +492,7 @@ class LZString(object):
     def compressToEncodedURIComponent(uncompressed):
         if uncompressed is None:
             return ""
-        return _compress(uncompressed, 6, lambda a: keyStrUriSafe[a])
+        return _compressFast(uncompressed, 6, lambda a: keyStrUriSafe[a])
 
     @staticmethod
     def decompress(compressed):
@@ -0,0 +1,79 @@
+"""
+Compare size and write/read speed of JSON and columnar replication dumps,
+on a made-up dump of answers.
+
+    python -m tutorweb.quizdb.replication.benchmark [answers] [repeats]
+"""
+import collections
+import gzip
+import random
+import StringIO
+import sys
+import timeit
+
+from .dump import writeDump
+from .ingest import readDumpSections
+
+
+def fakeDump(count):
+    """OrderedDict shaped like iterDumpData() output, with count answers"""
+    random.seed(0)
+    return collections.OrderedDict([
+        ('state', dict(answerId=count + 1, coinAwardId=0)),
+        ('host', [dict(hostId=1, fqdn='tutor-web.net', hostKey='0' * 32, comment=None)]),
+        ('answer', [dict(
+            answerId=i + 1,
+            lectureId=random.randint(1, 20),
+            lectureVersion=1,
+            studentId=random.randint(1, 500),
+            questionId=random.randint(1, 2000),
+            chosenAnswer=random.randint(0, 3),
+            correct=random.random() > 0.5,
+            timeStart=1400000000 + i * 30,
+            timeEnd=1400000000 + i * 30 + random.randint(5, 60),
+            grade=round(random.uniform(-0.5, 10), 3),
+            practice=False,
+            coinsAwarded=0,
+            ugQuestionGuid=None,
+        ) for i in range(count)]),
+    ])
+
+
+def writeOut(dump, format, compress):
+    """Write dump to a string, return it"""
+    out = StringIO.StringIO()
+    f = gzip.GzipFile(fileobj=out, mode='wb') if compress else out
+    writeDump(dump, f, format=format)
+    if compress:
+        f.close()
+    return out.getvalue()
+
+
+def readIn(data, compress):
+    """Read every row of dump in data"""
+    f = StringIO.StringIO(data)
+    if compress:
+        f = gzip.GzipFile(fileobj=f, mode='rb')
+    for (section, rows) in readDumpSections(f):
+        if section != 'state':
+            for r in rows:
+                pass
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    dump = fakeDump(count)
+
+    print('Dump: %d answers' % count)
+    print('%-16s %10s %10s %10s' % ('format', 'bytes', 'write', 'read'))
+    for (format, compress) in [('json', False), ('json', True), ('columnar', False), ('columnar', True)]:
+        data = writeOut(dump, format, compress)
+        write = min(timeit.repeat(lambda: writeOut(dump, format, compress), number=1, repeat=repeats))
+        read = min(timeit.repeat(lambda: readIn(data, compress), number=1, repeat=repeats))
+        print('%-16s %10d %9.3fs %9.3fs' % (
+            format + ('+gzip' if compress else ''),
+            len(data),
+            write,
+            read,
+        ))
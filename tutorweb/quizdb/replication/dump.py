@@ -1,6 +1,7 @@
 import calendar
 import collections
 import datetime
+import json
 import uuid
 import logging
 
@@ -14,7 +15,14 @@ if getConfiguration().debug_mode:
     logging.getLogger('sqlalchemy.engine').setLevel(logging.INFO)
 
 
-def objDict(x):
+# Rows to fetch from the database at a time
+DUMP_BATCH_SIZE = 1000
+
+# Formats writeDump can write, columnar uses rowsToColumns() for each table
+DUMP_FORMATS = ['json', 'columnar']
+
+
+def objDict(x, ignoreCols=[]):
     """Turn SQLAlchemy row object into a dict"""
     def enc(o):
         if isinstance(o, datetime.datetime):
@@ -26,22 +34,56 @@ def objDict(x):
     return dict(
         (c.name, enc(getattr(x, c.name)))
         for c in x.__table__.columns
+        if c.name not in ignoreCols
     )
 
 
-def dumpIsEmpty(dump):
-    """Return true iff dump has no new interesting data"""
-    for k in dump.keys():
-        if k in ['state', 'host']:
-            # These will always contain something
-            continue
-        if len(dump[k]) > 0:
-            return False
-    return True
+def _iterRows(query, fn=objDict):
+    """Generate fn(row) for each query row, fetching DUMP_BATCH_SIZE at a time"""
+    for r in query.yield_per(DUMP_BATCH_SIZE):
+        yield fn(r)
+
+
+def rowsToColumns(rows, blockSize=DUMP_BATCH_SIZE):
+    """
+    Generate blocks of up to blockSize rows, each a dict of column -> list of
+    values, so column names aren't repeated for every row
+    """
+    cols = None
+    block = None
+    for row in rows:
+        keys = sorted(row.keys())
+        if block is None or keys != cols or len(block[cols[0]]) >= blockSize:
+            if block is not None:
+                yield block
+            cols = keys
+            block = dict((k, []) for k in cols)
+        for k in cols:
+            block[k].append(row[k])
+    if block is not None:
+        yield block
 
 
-def dumpData(stateIn={}):
+def dumpData(stateIn={}, format='json'):
     """
+    As iterDumpData, but with every table as a list. If format is 'columnar',
+    each table is a list of rowsToColumns() blocks instead of rows
+    """
+    out = dict(
+        (k, v if k == 'state' else list(v if format == 'json' else rowsToColumns(v)))
+        for (k, v) in iterDumpData(stateIn).items()
+    )
+    if format != 'json':
+        out['format'] = format
+    return out
+
+
+def iterDumpData(stateIn={}):
+    """
+    Return OrderedDict of table name -> generator of rows, plus the new 'state'.
+    Rows are fetched as each generator is consumed, consume one table
+    at a time.
+
     stateIn is a Dict of the last-seen IDs we continue from
     NB: id Wrapping *shouldn't* be a problem after all:-
      * MySQL won't wrap autonum, it'll die.
@@ -81,45 +123,88 @@ def dumpData(stateIn={}):
         .distinct()
         .subquery())
 
-    return dict(
-        host=[objDict(r) for r in Session.query(db.Host)],
-        student=[objDict(r) for r in Session.query(db.Student)
+    # NB: Work out new state up front, before anything starts streaming
+    newState = dict(
+        answerId=Session.query(func.max(db.Answer.answerId) + 1).filter(answerFilter).one()[0] or state['answerId'],
+        coinAwardId=Session.query(func.max(db.CoinAward.coinAwardId) + 1).filter(coinAwardFilter).one()[0] or state['coinAwardId'],
+    )
+
+    # NB: Ordered so dumps can be ingested a section at a time, state first so
+    # it can be read without reading the rest
+    return collections.OrderedDict([
+        ('state', newState),
+        ('host', _iterRows(Session.query(db.Host))),
+        ('student', _iterRows(Session.query(db.Student)
             .join(matchingStudents, matchingStudents.c.studentId == db.Student.studentId)
             .order_by(db.Student.studentId)
-            .distinct()],
-        question=[dict(questionId=r.questionId, plonePath=r.plonePath) for r in Session.query(db.Question)
+            .distinct())),
+        ('question', _iterRows(Session.query(db.Question)
             .join(matchingQuestions, matchingQuestions.c.questionId == db.Question.questionId)
             .order_by(db.Question.questionId)
-            .distinct()],
-        lecture=[objDict(r) for r in Session.query(db.Lecture)
+            .distinct(), lambda r: dict(questionId=r.questionId, plonePath=r.plonePath))),
+        # NB: Tutorial membership is worked out locally from plonePath
+        ('lecture', _iterRows(Session.query(db.Lecture)
             .join(matchingLectures, matchingLectures.c.lectureId == db.Lecture.lectureId)
-            .order_by(db.Lecture.lectureId)],
-        answer=[objDict(r) for r in Session.query(db.Answer)
-            .filter(answerFilter)
-            .order_by(db.Answer.lectureId, db.Answer.studentId, db.Answer.timeEnd)],
+            .order_by(db.Lecture.lectureId), lambda r: objDict(r, ignoreCols=['tutorialId', 'ordinal']))),
         # NB: Return data for all relevant lectures, regardless of host
-        lecture_global_setting=[objDict(r) for r in Session.query(db.LectureGlobalSetting)
+        ('lecture_global_setting', _iterRows(Session.query(db.LectureGlobalSetting)
             .join(matchingAnswers, and_(
                 matchingAnswers.c.lectureId == db.LectureGlobalSetting.lectureId,
              ))
-            .order_by(db.LectureGlobalSetting.lectureId, db.LectureGlobalSetting.lectureVersion, db.LectureGlobalSetting.key)],
-        lecture_student_setting=[objDict(r) for r in Session.query(db.LectureStudentSetting)
+            .order_by(db.LectureGlobalSetting.lectureId, db.LectureGlobalSetting.lectureVersion, db.LectureGlobalSetting.key))),
+        ('lecture_student_setting', _iterRows(Session.query(db.LectureStudentSetting)
             .join(matchingAnswers, and_(
                 matchingAnswers.c.lectureId == db.LectureStudentSetting.lectureId,
                 matchingAnswers.c.studentId == db.LectureStudentSetting.studentId,
              ))
-            .order_by(db.LectureStudentSetting.lectureId, db.LectureStudentSetting.lectureVersion, db.LectureStudentSetting.studentId, db.LectureStudentSetting.key)],
-        coin_award=[objDict(r) for r in Session.query(db.CoinAward)
-            .filter(coinAwardFilter)
-            .order_by(db.CoinAward.studentId, db.CoinAward.awardTime)],
-        ug_question=[objDict(r) for r in Session.query(db.UserGeneratedQuestion)
+            .order_by(db.LectureStudentSetting.lectureId, db.LectureStudentSetting.lectureVersion, db.LectureStudentSetting.studentId, db.LectureStudentSetting.key))),
+        ('ug_question', _iterRows(Session.query(db.UserGeneratedQuestion)
             .join(matchingUgQuestions, matchingUgQuestions.c.ugQuestionGuid == db.UserGeneratedQuestion.ugQuestionGuid)
-            .order_by(db.UserGeneratedQuestion.studentId, db.UserGeneratedQuestion.ugQuestionGuid)],
-        ug_answer=[objDict(r) for r in Session.query(db.UserGeneratedAnswer)
+            .order_by(db.UserGeneratedQuestion.studentId, db.UserGeneratedQuestion.ugQuestionGuid))),
+        ('ug_answer', _iterRows(Session.query(db.UserGeneratedAnswer)
             .join(matchingUgQuestions, matchingUgQuestions.c.ugQuestionGuid == db.UserGeneratedAnswer.ugQuestionGuid)
-            .order_by(db.UserGeneratedAnswer.studentId, db.UserGeneratedAnswer.ugQuestionGuid)],
-        state=dict(
-            answerId=Session.query(func.max(db.Answer.answerId) + 1).filter(answerFilter).one()[0] or state['answerId'],
-            coinAwardId=Session.query(func.max(db.CoinAward.coinAwardId) + 1).filter(coinAwardFilter).one()[0] or state['coinAwardId'],
-        )
-    )
+            .order_by(db.UserGeneratedAnswer.studentId, db.UserGeneratedAnswer.ugQuestionGuid))),
+        ('answer', _iterRows(Session.query(db.Answer)
+            .filter(answerFilter)
+            .order_by(db.Answer.lectureId, db.Answer.studentId, db.Answer.timeEnd))),
+        ('coin_award', _iterRows(Session.query(db.CoinAward)
+            .filter(coinAwardFilter)
+            .order_by(db.CoinAward.studentId, db.CoinAward.awardTime))),
+    ])
+
+
+def writeDump(dump, f, format='json'):
+    """
+    Write output of iterDumpData to file f as JSON, a row at a time.
+    If format is 'columnar', write each table as rowsToColumns() blocks, and
+    a "format" entry after the state so readers know to expect them.
+    Returns the number of rows written, not counting hosts, i.e. 0 if the
+    dump has no new interesting data
+    """
+    if format not in DUMP_FORMATS:
+        raise ValueError("Unknown dump format %s" % format)
+
+    rowCount = [0]
+    def countRows(rows):
+        for row in rows:
+            rowCount[0] += 1
+            yield row
+
+    f.write('{')
+    for (i, (k, rows)) in enumerate(dump.items()):
+        f.write('%s%s: ' % (', ' if i > 0 else '', json.dumps(k)))
+        if k == 'state':
+            f.write(json.dumps(rows))
+            if format != 'json':
+                f.write(', "format": %s' % json.dumps(format))
+            continue
+        if k != 'host':
+            rows = countRows(rows)
+        if format == 'columnar':
+            rows = rowsToColumns(rows)
+        f.write('[')
+        for (j, row) in enumerate(rows):
+            f.write('%s%s' % (', ' if j > 0 else '', json.dumps(row)))
+        f.write(']')
+    f.write('}')
+    return rowCount[0]
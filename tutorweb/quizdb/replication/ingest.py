@@ -1,5 +1,10 @@
 import collections
 import datetime
+import gzip
+import itertools
+import json
+import re
+import StringIO
 import uuid
 import logging
 
@@ -7,11 +12,22 @@ from sqlalchemy.orm.exc import NoResultFound
 from z3c.saconfig import Session
 
 from tutorweb.quizdb import db
+from tutorweb.quizdb.sync.answers import rebuildAnswerSummaries, rebuildTutorialSummariesForLectures
+from tutorweb.quizdb.utils import getDbTutorial, renumberTutorial
 
 from App.config import getConfiguration
 if getConfiguration().debug_mode:
     logging.getLogger('sqlalchemy.engine').setLevel(logging.INFO)
 
+# Rows to ingest before committing, when streaming
+INGEST_CHUNK_SIZE = 1000
+
+# Maximum values to look up with one IN (...) query
+INGEST_IN_SIZE = 500
+
+# First bytes of a gzipped dump
+GZIP_MAGIC = '\x1f\x8b'
+
 
 def updateHost(fqdn, hostKey):
     """Insert/update a host entry"""
@@ -31,26 +47,31 @@ def updateHost(fqdn, hostKey):
     )
 
 
+def _translateRow(d, idMap, ignoreCols=[]):
+    """Translate dict to use local ids, datetime objects"""
+    def tlate(k, v):
+        if k in idMap:
+            # NB: We don't worry about missing values for ug_question cases,
+            # when students are reviewing the questions the source student
+            # won't be in the map. However, the question will be already inserted
+            # so won't cause a problem.
+            return (k, idMap[k].get(v, None))
+        elif k in ['timeStart', 'timeEnd', 'awardTime']:
+            return (k, datetime.datetime.utcfromtimestamp(v))
+        elif k in ['ugQuestionGuid'] and v:
+            return (k, uuid.UUID(v))
+        else:
+            return (k, v)
+
+    return dict(tlate(k, v) for (k, v) in d.items() if k not in ignoreCols)
+
+
 def findMissingEntries(dataRawEntries, dbQuery, sortCols=[], ignoreCols=[], idMap={}, returnUpdates=False):
     """Hunt for entries in dataEntries that aren't in dbEntries"""
     def translateData(entries):
         """Translate dict to use local ids, datetime objects, resort"""
-        def tlate(k, v):
-            if k in idMap:
-                # NB: We don't worry about missing values for ug_question cases,
-                # when students are reviewing the questions the source student
-                # won't be in the map. However, the question will be already inserted
-                # so won't cause a problem.
-                return (k, idMap[k].get(v, None))
-            elif k in ['timeStart', 'timeEnd', 'awardTime']:
-                return (k, datetime.datetime.utcfromtimestamp(v))
-            elif k in ['ugQuestionGuid'] and v:
-                return (k, uuid.UUID(v))
-            else:
-                return (k, v)
-
         return sorted([
-            dict(tlate(k, v) for (k, v) in d.items() if k not in ignoreCols)
+            _translateRow(d, idMap, ignoreCols)
             for d in entries
         ], key=lambda k: tuple(k.get(c) for c in sortCols))
 
@@ -93,144 +114,197 @@ def findMissingEntries(dataRawEntries, dbQuery, sortCols=[], ignoreCols=[], idMa
         pass
 
 
-def ingestData(data):
-    idMap = collections.defaultdict(dict)
-    inserts = {}
+def _lookupIds(model, idCol, keyCols, keys):
+    """
+    Return dict of key -> idCol for each of keys (tuples of keyCols values)
+    found in model's table. Keys are grouped by all but the last column,
+    and the last column looked up with IN (...), INGEST_IN_SIZE at a time
+    """
+    groups = collections.defaultdict(set)
+    for k in keys:
+        groups[k[:-1]].add(k[-1])
 
-    # Check all host keys match our stored versions, and map to our IDs
-    for host in data['host']:
-        try:
-            dbHost = Session.query(db.Host).filter_by(
-                hostKey=host['hostKey'],
-                fqdn=host['fqdn'],
-            ).one()
-        except NoResultFound:
-            raise ValueError("Unknown host %s:%s, cannot import results" % (host['hostKey'], host['fqdn']))
-        idMap['hostId'][host['hostId']] = dbHost.hostId
-
-    # Map students to our IDs
-    inserts['student'] = 0
-    for student in data['student']:
-        try:
-            dbStudent = (Session.query(db.Student)
-                .filter(db.Student.hostId == idMap['hostId'][student['hostId']])
-                .filter(db.Student.userName == student['userName'])
-                .one())
-            dbStudent.userName = student['userName']
-            dbStudent.email = student['eMail']
-        except NoResultFound:
-            dbStudent = db.Student(
-                hostId=idMap['hostId'][student['hostId']],
-                userName=student['userName'],
-                eMail=student['eMail'],
-            )
-            Session.add(dbStudent)
-            Session.flush()
-            inserts['student'] += 1
-        idMap['studentId'][student['studentId']] = dbStudent.studentId
-    Session.flush()
+    out = {}
+    cols = [getattr(model, c) for c in keyCols]
+    for (prefix, values) in groups.items():
+        for chunk in _chunks(sorted(values), INGEST_IN_SIZE):
+            query = Session.query(getattr(model, idCol), *cols)
+            for (col, v) in zip(cols, prefix):
+                query = query.filter(col == v)
+            for r in query.filter(cols[-1].in_(chunk)):
+                out[tuple(r[1:])] = r[0]
+    return out
 
-    # Map questions to our IDs
-    for question in data['question']:
-        try:
-            dbQuestionId = (Session.query(db.Question.questionId)
-                .filter(db.Question.plonePath == question['plonePath'])
-                .one())
-        except NoResultFound:
-            raise ValueError("Missing question at %s" % question['plonePath'])
-        idMap['questionId'][question['questionId']] = dbQuestionId[0]
-    Session.flush()
 
-    # Map lectures to our IDs
-    inserts['lecture'] = 0
-    for lecture in data['lecture']:
-        try:
-            dbLecture = (Session.query(db.Lecture)
-                .filter(db.Lecture.hostId == idMap['hostId'][lecture['hostId']])
-                .filter(db.Lecture.plonePath == lecture['plonePath'])
-                .one())
-            dbLecture.plonePath = lecture['plonePath']
-        except NoResultFound:
-            dbLecture = db.Lecture(
-                hostId=idMap['hostId'][lecture['hostId']],
-                plonePath=lecture['plonePath'],
-            )
-            Session.add(dbLecture)
-            Session.flush()
-            inserts['lecture'] += 1
-        idMap['lectureId'][lecture['lectureId']] = dbLecture.lectureId
-    Session.flush()
+def _mapIds(rows, idMap, model, idCol, keyCols, newRow=None):
+    """
+    Add local IDs for rows to idMap[idCol], matching on keyCols (translated
+    with idMap where needed). If newRow is given, rows we don't have are
+    bulk-inserted as newRow(row) first. Returns list of rows that weren't
+    found locally, in the order they appeared.
+    """
+    keys = collections.OrderedDict()
+    for row in rows:
+        keys[row[idCol]] = tuple(
+            idMap[c][row[c]] if c in idMap else row[c]
+            for c in keyCols
+        )
+    localIds = _lookupIds(model, idCol, keyCols, keys.values())
 
-    # Any answer entries we fetch should be at least as new as the oldest incoming entry
-    minVal = None
-    for a in data['answer']:
-        if minVal is None or a['timeEnd'] < minVal:
-            minVal = a['timeEnd']
-    answerFilter = db.Answer.timeEnd.__ge__(datetime.datetime.utcfromtimestamp(minVal or 0))
-    minVal = None
-    for a in data['coin_award']:
-        if minVal is None or a['awardTime'] < minVal:
-            minVal = a['awardTime']
-    coinAwardFilter = db.CoinAward.awardTime.__ge__(datetime.datetime.utcfromtimestamp(minVal or 0))
-
-    if 'lecture_global_setting' in data:
-        inserts['lecture_global_setting'] = 0
-        for (dataEntry, dbEntry) in findMissingEntries(
-                data['lecture_global_setting'],
-                Session.query(db.LectureGlobalSetting)
-                    .filter(db.LectureGlobalSetting.lectureId.in_(idMap['lectureId'].values()))
-                    .order_by(
-                        db.LectureGlobalSetting.lectureId,
-                        db.LectureGlobalSetting.lectureVersion,
-                        db.LectureGlobalSetting.key,
-                    ),
-                sortCols=['lectureId', 'lectureVersion', 'key'],
-                idMap=idMap):
-            dataEntry['creationDate'] = datetime.datetime.utcfromtimestamp(dataEntry['creationDate'])
-            Session.add(db.LectureGlobalSetting(**dataEntry))
-            inserts['lecture_global_setting'] += 1
+    missing = collections.OrderedDict()
+    for row in rows:
+        if keys[row[idCol]] not in localIds:
+            missing.setdefault(keys[row[idCol]], row)
+    if newRow and len(missing) > 0:
         Session.flush()
+        Session.execute(model.__table__.insert(), [newRow(r) for r in missing.values()])
+        localIds.update(_lookupIds(model, idCol, keyCols, missing.keys()))
+
+    for (remoteId, k) in keys.items():
+        if k in localIds:
+            idMap[idCol][remoteId] = localIds[k]
+    return missing.values()
+
+
+def findNewEntries(dataRawEntries, model, idCol, keyCols, idMap={}):
+    """
+    Generate translated entries in dataEntries that aren't in model's table,
+    looking up just their keyCols instead of scanning the whole table
+    """
+    dataEntries = [_translateRow(d, idMap, ignoreCols=[idCol]) for d in dataRawEntries]
+    if len(dataEntries) == 0:
+        return # Nothing to do
+    existing = set(_lookupIds(model, idCol, keyCols, [
+        tuple(e[c] for c in keyCols)
+        for e in dataEntries
+    ]))
+
+    for dataEntry in dataEntries:
+        k = tuple(dataEntry[c] for c in keyCols)
+        if k not in existing:
+            existing.add(k)
+            yield dataEntry
+
+
+def _ingestHosts(rows, idMap, inserts):
+    """Check all host keys match our stored versions, and map to our IDs"""
+    missing = _mapIds(rows, idMap, db.Host, 'hostId', ['hostKey', 'fqdn'])
+    if len(missing) > 0:
+        raise ValueError("Unknown host %s:%s, cannot import results" % (missing[0]['hostKey'], missing[0]['fqdn']))
 
-    if 'lecture_student_setting' in data:
-        inserts['lecture_student_setting'] = 0
-        for (dataEntry, dbEntry) in findMissingEntries(
-                data['lecture_student_setting'],
-                Session.query(db.LectureStudentSetting)
-                    .filter(db.LectureStudentSetting.lectureId.in_(idMap['lectureId'].values()))
-                    .filter(db.LectureStudentSetting.studentId.in_(idMap['studentId'].values()))
-                    .order_by(
-                        db.LectureStudentSetting.lectureId,
-                        db.LectureStudentSetting.lectureVersion,
-                        db.LectureStudentSetting.studentId,
-                        db.LectureStudentSetting.key,
-                    ),
-                sortCols=['lectureId', 'lectureVersion', 'studentId', 'key'],
-                idMap=idMap):
-            dataEntry['creationDate'] = datetime.datetime.utcfromtimestamp(dataEntry['creationDate'])
-            Session.add(db.LectureStudentSetting(**dataEntry))
-            inserts['lecture_student_setting'] += 1
-        Session.flush()
 
-    inserts['ug_question'] = 0
+def _ingestStudents(rows, idMap, inserts):
+    """Map students to our IDs, adding any we don't have"""
+    inserts['student'] = inserts.get('student', 0)
+    inserts['student'] += len(_mapIds(rows, idMap, db.Student, 'studentId', ['hostId', 'userName'], lambda r: dict(
+        hostId=idMap['hostId'][r['hostId']],
+        userName=r['userName'],
+        eMail=r['eMail'],
+    )))
+
+
+def _ingestQuestions(rows, idMap, inserts):
+    """Map questions to our IDs"""
+    missing = _mapIds(rows, idMap, db.Question, 'questionId', ['plonePath'])
+    if len(missing) > 0:
+        raise ValueError("Missing question at %s" % missing[0]['plonePath'])
+
+
+def _placeLectures(lectureIds):
+    """
+    Put lectures that aren't in a tutorial into the one their path says, as
+    sync.plone does for our own. Lectures removed upstream stay out.
+    """
+    tutorials = {}
+    placedIds = []
+    for chunk in _chunks(lectureIds, INGEST_IN_SIZE):
+        for dbLec in (Session.query(db.Lecture)
+                .filter(db.Lecture.lectureId.in_(chunk))
+                .filter(db.Lecture.tutorialId == None)):
+            if dbLec.plonePath.startswith('/deleted-'):
+                continue
+            k = (dbLec.hostId, dbLec.plonePath.rsplit('/', 1)[0])
+            if k not in tutorials:
+                tutorials[k] = getDbTutorial(k[1], hostId=k[0])
+            dbLec.tutorial = tutorials[k]
+            placedIds.append(dbLec.lectureId)
+    Session.flush()
+    for dbTut in tutorials.values():
+        renumberTutorial(dbTut.tutorialId)
+    for chunk in _chunks(placedIds, INGEST_IN_SIZE):
+        rebuildTutorialSummariesForLectures(chunk, [dbTut.tutorialId for dbTut in tutorials.values()])
+
+
+def _ingestLectures(rows, idMap, inserts):
+    """Map lectures to our IDs, adding any we don't have"""
+    inserts['lecture'] = inserts.get('lecture', 0)
+    inserts['lecture'] += len(_mapIds(rows, idMap, db.Lecture, 'lectureId', ['hostId', 'plonePath'], lambda r: dict(
+        hostId=idMap['hostId'][r['hostId']],
+        plonePath=r['plonePath'],
+    )))
+    _placeLectures([idMap['lectureId'][r['lectureId']] for r in rows])
+
+
+def _ingestLectureGlobalSettings(rows, idMap, inserts):
+    inserts['lecture_global_setting'] = inserts.get('lecture_global_setting', 0)
+    for (dataEntry, dbEntry) in findMissingEntries(
+            rows,
+            Session.query(db.LectureGlobalSetting)
+                .filter(db.LectureGlobalSetting.lectureId.in_(idMap['lectureId'].values()))
+                .order_by(
+                    db.LectureGlobalSetting.lectureId,
+                    db.LectureGlobalSetting.lectureVersion,
+                    db.LectureGlobalSetting.key,
+                ),
+            sortCols=['lectureId', 'lectureVersion', 'key'],
+            idMap=idMap):
+        dataEntry['creationDate'] = datetime.datetime.utcfromtimestamp(dataEntry['creationDate'])
+        Session.add(db.LectureGlobalSetting(**dataEntry))
+        inserts['lecture_global_setting'] += 1
+    Session.flush()
+
+
+def _ingestLectureStudentSettings(rows, idMap, inserts):
+    inserts['lecture_student_setting'] = inserts.get('lecture_student_setting', 0)
     for (dataEntry, dbEntry) in findMissingEntries(
-            data['ug_question'],
-            Session.query(db.UserGeneratedQuestion)
-                .order_by(db.UserGeneratedQuestion.ugQuestionGuid),
-            sortCols=['ugQuestionGuid'],
-            ignoreCols=['ugQuestionId'],
+            rows,
+            Session.query(db.LectureStudentSetting)
+                .filter(db.LectureStudentSetting.lectureId.in_(idMap['lectureId'].values()))
+                .filter(db.LectureStudentSetting.studentId.in_(idMap['studentId'].values()))
+                .order_by(
+                    db.LectureStudentSetting.lectureId,
+                    db.LectureStudentSetting.lectureVersion,
+                    db.LectureStudentSetting.studentId,
+                    db.LectureStudentSetting.key,
+                ),
+            sortCols=['lectureId', 'lectureVersion', 'studentId', 'key'],
+            idMap=idMap):
+        dataEntry['creationDate'] = datetime.datetime.utcfromtimestamp(dataEntry['creationDate'])
+        Session.add(db.LectureStudentSetting(**dataEntry))
+        inserts['lecture_student_setting'] += 1
+    Session.flush()
+
+
+def _ingestUgQuestions(rows, idMap, inserts):
+    inserts['ug_question'] = inserts.get('ug_question', 0)
+    for dataEntry in findNewEntries(
+            rows,
+            db.UserGeneratedQuestion,
+            'ugQuestionId',
+            ['ugQuestionGuid'],
             idMap=idMap):
         Session.add(db.UserGeneratedQuestion(**dataEntry))
         inserts['ug_question'] += 1
     Session.flush()
 
-    inserts['ug_answer'] = 0
-    for (dataEntry, dbEntry) in findMissingEntries(
-            data['ug_answer'],
-            Session.query(db.UserGeneratedAnswer)
-                .filter(db.UserGeneratedAnswer.studentId.in_(idMap['studentId'].values()))
-                .order_by(db.UserGeneratedAnswer.studentId, db.UserGeneratedAnswer.ugQuestionGuid),
-            sortCols=['studentId', 'ugQuestionGuid'],
-            ignoreCols=['ugAnswerId'],
+
+def _ingestUgAnswers(rows, idMap, inserts):
+    inserts['ug_answer'] = inserts.get('ug_answer', 0)
+    for dataEntry in findNewEntries(
+            rows,
+            db.UserGeneratedAnswer,
+            'ugAnswerId',
+            ['studentId', 'ugQuestionGuid'],
             idMap=idMap):
         if dataEntry['studentId'] is not None:
             Session.add(db.UserGeneratedAnswer(**dataEntry))
@@ -241,10 +315,20 @@ def ingestData(data):
             continue
     Session.flush()
 
+
+def _ingestAnswers(rows, idMap, inserts):
+    # Any answer entries we fetch should be at least as new as the oldest incoming entry
+    minVal = None
+    for a in rows:
+        if minVal is None or a['timeEnd'] < minVal:
+            minVal = a['timeEnd']
+    answerFilter = db.Answer.timeEnd.__ge__(datetime.datetime.utcfromtimestamp(minVal or 0))
+
     # Filter out answer student/question/timeEnd combinations already stored in DB
-    inserts['answer'] = 0
+    inserts['answer'] = inserts.get('answer', 0)
+    newAnswers = []
     for (dataEntry, dbEntry) in findMissingEntries(
-            data['answer'],
+            rows,
             Session.query(db.Answer)
                 .filter(db.Answer.lectureId.in_(idMap['lectureId'].values()))
                 .filter(db.Answer.studentId.in_(idMap['studentId'].values()))
@@ -258,37 +342,281 @@ def ingestData(data):
             # Coins awarded might have been updated afer the fact
             dbEntry.coinsAwarded = dataEntry['coinsAwarded']
         else:
-            Session.add(db.Answer(**dataEntry))
-            inserts['answer'] += 1
+            newAnswers.append(dataEntry)
+    if len(newAnswers) == 0:
+        Session.flush()
+        return
+
+    # Lock answerSummary rows before inserting, as parseAnswerQueue does. Otherwise
+    # a client could be handed a later answerId as its answerQueueCursor before
+    # ours commit, and never be sent ours.
+    summariesAffected = (
+        list(set(a['lectureId'] for a in newAnswers)),
+        list(set(a['studentId'] for a in newAnswers)),
+    )
+    (Session.query(db.AnswerSummary.lectureId)
+        .filter(db.AnswerSummary.lectureId.in_(summariesAffected[0]))
+        .filter(db.AnswerSummary.studentId.in_(summariesAffected[1]))
+        .order_by(db.AnswerSummary.lectureId, db.AnswerSummary.studentId)
+        .with_lockmode('update')
+        .all())
+    for dataEntry in newAnswers:
+        Session.add(db.Answer(**dataEntry))
+    inserts['answer'] += len(newAnswers)
     Session.flush()
 
-    if 'lecture_setting' in data:
-        inserts['lecture_setting'] = 0
-        for (dataEntry, dbEntry) in findMissingEntries(
-                data['lecture_setting'],
-                Session.query(db.DeprecatedLectureSetting)
-                    .filter(db.DeprecatedLectureSetting.lectureId.in_(idMap['lectureId'].values()))
-                    .filter(db.DeprecatedLectureSetting.studentId.in_(idMap['studentId'].values()))
-                    .order_by(db.DeprecatedLectureSetting.lectureId, db.DeprecatedLectureSetting.studentId, db.DeprecatedLectureSetting.key),
-                sortCols=['lectureId', 'studentId', 'key'],
-                idMap=idMap):
-            Session.add(db.DeprecatedLectureSetting(**dataEntry))
-            inserts['lecture_setting'] += 1
-        Session.flush()
+    # answerSummary is only updated incrementally by sync, so recalculate affected rows
+    rebuildAnswerSummaries(
+        lectureIds=summariesAffected[0],
+        studentIds=summariesAffected[1],
+    )
 
-    inserts['coin_award'] = 0
+
+def _ingestDeprecatedLectureSettings(rows, idMap, inserts):
+    inserts['lecture_setting'] = inserts.get('lecture_setting', 0)
     for (dataEntry, dbEntry) in findMissingEntries(
-            data['coin_award'],
-            Session.query(db.CoinAward)
-                .filter(db.CoinAward.studentId.in_(idMap['studentId'].values()))
-                .filter(coinAwardFilter)
-                .order_by(db.CoinAward.studentId, db.CoinAward.awardTime),
-            sortCols=['studentId', 'awardTime'],
-            ignoreCols=['coinAwardId'],
+            rows,
+            Session.query(db.DeprecatedLectureSetting)
+                .filter(db.DeprecatedLectureSetting.lectureId.in_(idMap['lectureId'].values()))
+                .filter(db.DeprecatedLectureSetting.studentId.in_(idMap['studentId'].values()))
+                .order_by(db.DeprecatedLectureSetting.lectureId, db.DeprecatedLectureSetting.studentId, db.DeprecatedLectureSetting.key),
+            sortCols=['lectureId', 'studentId', 'key'],
+            idMap=idMap):
+        Session.add(db.DeprecatedLectureSetting(**dataEntry))
+        inserts['lecture_setting'] += 1
+    Session.flush()
+
+
+def _ingestCoinAwards(rows, idMap, inserts):
+    inserts['coin_award'] = inserts.get('coin_award', 0)
+    for dataEntry in findNewEntries(
+            rows,
+            db.CoinAward,
+            'coinAwardId',
+            ['studentId', 'awardTime'],
             idMap=idMap):
         Session.add(db.CoinAward(**dataEntry))
         inserts['coin_award'] += 1
     Session.flush()
 
+
+# (section, function to ingest rows, can skip over section when resuming), in
+# the order they need ingesting. Sections that build the idMap always get re-read.
+INGEST_SECTIONS = [
+    ('host', _ingestHosts, False),
+    ('student', _ingestStudents, False),
+    ('question', _ingestQuestions, False),
+    ('lecture', _ingestLectures, False),
+    ('lecture_global_setting', _ingestLectureGlobalSettings, True),
+    ('lecture_student_setting', _ingestLectureStudentSettings, True),
+    ('ug_question', _ingestUgQuestions, True),
+    ('ug_answer', _ingestUgAnswers, True),
+    ('answer', _ingestAnswers, True),
+    ('lecture_setting', _ingestDeprecatedLectureSettings, True),
+    ('coin_award', _ingestCoinAwards, True),
+]
+
+
+def ingestData(data):
+    idMap = collections.defaultdict(dict)
+    inserts = {}
+    columnar = data.get('format', 'json') == 'columnar'
+
+    for (section, fn, resumable) in INGEST_SECTIONS:
+        if section in data:
+            fn(list(columnsToRows(data[section])) if columnar else data[section], idMap, inserts)
+
     Session.flush()
     return inserts
+
+
+def ingestDataStream(sections, chunkSize=INGEST_CHUNK_SIZE, checkpoint=None, commit=None):
+    """
+    Ingest (section, rows) pairs, as generated by readDumpSections(), in
+    chunks of chunkSize rows. Sections have to be in INGEST_SECTIONS order.
+
+    After each chunk, commit(checkpoint) is called. Pass the last checkpoint
+    back in to skip over what was already ingested.
+    """
+    idMap = collections.defaultdict(dict)
+    inserts = {}
+    order = [x[0] for x in INGEST_SECTIONS]
+    cpIndex = order.index(checkpoint['section']) if checkpoint else -1
+
+    lastIndex = -1
+    for (section, rows) in sections:
+        if section not in order:
+            # e.g. state, nothing to ingest
+            continue
+        (section, fn, resumable) = INGEST_SECTIONS[order.index(section)]
+        if order.index(section) < lastIndex:
+            raise ValueError("Section %s out of order" % section)
+        lastIndex = order.index(section)
+
+        # Work out how many rows were done before
+        if not resumable or lastIndex > cpIndex:
+            skip = 0
+        elif lastIndex == cpIndex:
+            skip = checkpoint['rows']
+        else:
+            continue
+
+        rowsDone = 0
+        for chunk in _chunks(rows, chunkSize):
+            chunkStart = rowsDone
+            rowsDone += len(chunk)
+            if rowsDone <= skip:
+                continue
+            # NB: The checkpoint can land mid-chunk, only ingest what's after it
+            fn(chunk[max(skip - chunkStart, 0):], idMap, inserts)
+            Session.flush()
+            if resumable:
+                checkpoint = dict(section=section, rows=rowsDone)
+            if commit:
+                commit(checkpoint)
+        if rowsDone == 0:
+            # Empty section, still want an entry in inserts
+            fn([], idMap, inserts)
+
+    Session.flush()
+    return inserts
+
+
+def columnsToRows(blocks):
+    """Turn rowsToColumns() blocks back into a generator of row dicts"""
+    for block in blocks:
+        cols = block.keys()
+        for vals in itertools.izip(*(block[k] for k in cols)):
+            yield dict(itertools.izip(cols, vals))
+
+
+def _chunks(rows, chunkSize):
+    """Split iterable rows up into lists of chunkSize"""
+    chunk = []
+    for r in rows:
+        chunk.append(r)
+        if len(chunk) >= chunkSize:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+
+class _DumpReader(object):
+    """Read JSON values from a file, a bit at a time"""
+    whitespace = re.compile(r'\s*')
+
+    def __init__(self, f, bufSize):
+        self.f = f
+        self.bufSize = bufSize
+        self.buf = ''
+        self.pos = 0
+        self.decoder = json.JSONDecoder()
+
+    def fill(self):
+        """Read more of the file into the buffer, False if there isn't any"""
+        data = self.f.read(self.bufSize)
+        if not data:
+            return False
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Skip whitespace, return next character or '' at the end of the file"""
+        while True:
+            self.pos = self.whitespace.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, chars):
+        """Consume the next character, which should be one of chars"""
+        c = self.peek()
+        if c == '' or c not in chars:
+            raise ValueError("Expected one of '%s', not '%s'" % (chars, c))
+        self.pos += 1
+        return c
+
+    def value(self):
+        """Decode the next complete JSON value"""
+        self.peek()
+        while True:
+            try:
+                (out, end) = self.decoder.raw_decode(self.buf, self.pos)
+            except ValueError:
+                # Probably not all in buffer yet
+                if self.fill():
+                    continue
+                raise
+            if end >= len(self.buf) and self.fill():
+                # Might not have the end of a number yet
+                continue
+            self.pos = end
+            return out
+
+    def items(self):
+        """Generate each item of a list, once its opening '[' is consumed"""
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.expect(',]') == ']':
+                return
+
+
+def readDumpSections(f, bufSize=64 * 1024):
+    """
+    Parse the JSON object in file f a bit at a time, generating (key, value)
+    for each entry as it's found. Lists are generated as generators of
+    their items, which get skipped over if not consumed before moving on.
+
+    If the dump has a "format": "columnar" entry, following lists are turned
+    back into rows, and the format entry itself isn't generated.
+    """
+    columnar = False
+    r = _DumpReader(f, bufSize)
+    r.expect('{')
+    if r.peek() == '}':
+        return
+    while True:
+        key = r.value()
+        r.expect(':')
+        if r.peek() == '[':
+            r.pos += 1
+            items = r.items()
+            yield (key, columnsToRows(items) if columnar else items)
+            for x in items:
+                pass
+        elif key == 'format':
+            columnar = r.value() == 'columnar'
+        else:
+            yield (key, r.value())
+        if r.expect(',}') == '}':
+            return
+
+
+def openDump(path):
+    """Open dump at path for reading, decompressing it if it's gzipped"""
+    with open(path, 'rb') as f:
+        magic = f.read(len(GZIP_MAGIC))
+    if magic == GZIP_MAGIC:
+        return gzip.open(path, 'rb')
+    return open(path, 'r')
+
+
+def loadDump(body):
+    """Parse dump in string body, decompressing it if it's gzipped"""
+    if body.startswith(GZIP_MAGIC):
+        body = gzip.GzipFile(fileobj=StringIO.StringIO(body), mode='rb').read()
+    return json.loads(body)
+
+
+def readDumpState(f):
+    """Return 'state' from dump in f, without keeping the rest in memory"""
+    for (section, value) in readDumpSections(f):
+        if section == 'state':
+            return value
+    raise ValueError("No state in dump")
@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 import argparse
 import calendar
+import gzip
+import itertools
 import json
 import logging
 import os
@@ -9,13 +11,16 @@ import urlparse
 import socket
 import time
 
-from ..replication.dump import dumpData, dumpIsEmpty
-from ..replication.ingest import ingestData
+from ..replication.dump import DUMP_FORMATS, iterDumpData, writeDump
+from ..replication.ingest import ingestData, ingestDataStream, openDump, readDumpSections, readDumpState
 
 logger = logging.getLogger(__package__)
 logger.addHandler(logging.StreamHandler())
 logger.setLevel(logging.INFO)
 
+# Extensions of dump files, columnar dumps are gzipped
+DUMP_EXTENSIONS = ('.json', '.json.gz')
+
 
 def getApplication(configFile):
     """Start Zope/Plone based on a config, return root app"""
@@ -51,14 +56,43 @@ def replicateIngest():
     import transaction
 
     for fileName in sorted(os.listdir(args.work_dir)):
-        if not fileName.endswith('.json'):
+        if not fileName.endswith(DUMP_EXTENSIONS):
             continue
         logger.info("Ingesting dump %s", fileName)
+        checkpointPath = os.path.join(args.work_dir, fileName + '.checkpoint')
+
+        # Carry on from where we got to last time
+        checkpoint = None
+        if os.path.exists(checkpointPath):
+            with open(checkpointPath, 'r') as f:
+                checkpoint = json.load(f)
+            logger.info("Resuming after %d %s rows", checkpoint['rows'], checkpoint['section'])
+
+        def commit(checkpoint):
+            transaction.commit()
+            if checkpoint is not None:
+                with open(checkpointPath + '.writing', 'w') as f:
+                    json.dump(checkpoint, f)
+                os.rename(checkpointPath + '.writing', checkpointPath)
 
         # Open dump and ingest
-        with open(os.path.join(args.work_dir, fileName), 'r') as f:
-            ingestData(json.load(f))
+        with openDump(os.path.join(args.work_dir, fileName)) as f:
+            sections = readDumpSections(f)
+            firstSection = next(sections, (None, None))
+            if firstSection[0] == 'state':
+                # Written by writeDump, can ingest a chunk at a time
+                ingestDataStream(
+                    itertools.chain([firstSection], sections),
+                    checkpoint=checkpoint,
+                    commit=commit,
+                )
+            else:
+                # Sections in any old order, have to read it all in
+                f.seek(0)
+                ingestData(json.load(f))
         transaction.commit()
+        if os.path.exists(checkpointPath):
+            os.remove(checkpointPath)
 
         # Worked, move this file to archive
         os.renames(
@@ -89,6 +123,12 @@ def replicateDump():
         default=None,
         help='Maximum answers to export, to constrain file size',
     )
+    parser.add_argument(
+        '--format',
+        choices=DUMP_FORMATS,
+        default='json',
+        help='Dump format, columnar dumps are smaller but need a newer replicate_ingest',
+    )
     args = parser.parse_args()
     if args.debug:
         sqllog = logging.getLogger('sqlalchemy.engine')
@@ -105,7 +145,7 @@ def replicateDump():
         if not os.path.exists(dir):
             continue
         for fileName in os.listdir(dir):
-            if not fileName.endswith('.json'):
+            if not fileName.endswith(DUMP_EXTENSIONS):
                 continue
             fullPath = os.path.join(dir, fileName)
             if os.path.getctime(fullPath) > newestFile['time']:
@@ -115,8 +155,8 @@ def replicateDump():
     # Open work_dir, get most recent state
     if newestFile['path']:
         logger.info("Reading statefile %s", newestFile['path'])
-        with open(newestFile['path'], 'r') as f:
-            state = json.load(f)['state']
+        with openDump(newestFile['path']) as f:
+            state = readDumpState(f)
     else:
         logger.info("No statefile, starting afresh")
         state = {}
@@ -126,17 +166,19 @@ def replicateDump():
     app = getApplication(args.zope_conf)
     if args.max_values:
         state['maxVals'] = args.max_values
-    out = dumpData(state)
-    if dumpIsEmpty(out):
-        logger.info("Nothing new to write out")
-        return 0
+    out = iterDumpData(state)
 
-    # Write dump out to new file, try to be atomic
-    newFile = os.path.join(args.work_dir, 'dump-%s-%d.json' % (
+    # Write dump out to new file as it's fetched, try to be atomic
+    newFile = os.path.join(args.work_dir, 'dump-%s-%d%s' % (
         socket.getfqdn(),
         calendar.timegm(time.gmtime()),
+        '.json' if args.format == 'json' else '.json.gz',
     ))
     logger.info("Writing dump %s", newFile)
-    with open(newFile + '.writing', 'w') as f:
-        json.dump(out, f)
+    with (open if args.format == 'json' else gzip.open)(newFile + '.writing', 'wb') as f:
+        rowCount = writeDump(out, f, format=args.format)
+    if rowCount == 0:
+        logger.info("Nothing new to write out")
+        os.remove(newFile + '.writing')
+        return 0
     os.rename(newFile + '.writing', newFile)
@@ -6,8 +6,10 @@ import random
 import re
 import time
 import urlparse
+import uuid
 
-from sqlalchemy import func
+from sqlalchemy import func, and_, or_
+from sqlalchemy.orm import aliased
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.sql import expression
 
@@ -21,8 +23,35 @@ from tutorweb.quizdb.allocation.base import Allocation
 logger = logging.getLogger(__package__)
 
 
+def _answerSummaryQuery(*cols):
+    """Query aggregating answer table into answerSummary counters"""
+    return Session.query(*(cols + (
+        func.count(),
+        func.ifnull(func.sum(db.Answer.correct), 0),
+        func.ifnull(func.sum(db.Answer.practice), 0),
+        func.ifnull(func.sum(expression.case([(db.Answer.practice & db.Answer.correct, 1)], else_=0)), 0),
+    )))
+
+
+def _setSummaryCounts(dbAnsSummary, lecAnswered, lecCorrect, practiceAnswered, practiceCorrect):
+    """Copy aggregated counters into dbAnsSummary, return True iff anything changed"""
+    changed = False
+    for (k, v) in [
+            ('lecAnswered', lecAnswered),
+            ('lecCorrect', lecCorrect),
+            ('practiceAnswered', practiceAnswered),
+            ('practiceCorrect', practiceCorrect)]:
+        if getattr(dbAnsSummary, k) != int(v):
+            setattr(dbAnsSummary, k, int(v))
+            changed = True
+    return changed
+
+
 def getAnswerSummary(lectureId, student):
-    """Fetch answerSummary row for student"""
+    """
+    Fetch answerSummary row for student. Counters are maintained incrementally
+    by parseAnswerQueue, only a new row is populated from the answer table.
+    """
     try:
         dbAnsSummary = (Session.query(db.AnswerSummary)
             .with_lockmode('update')
@@ -34,34 +63,139 @@ def getAnswerSummary(lectureId, student):
             lectureId=lectureId,
             studentId=student.studentId,
             grade=0,
+            lecAnswered=0,
+            lecCorrect=0,
+            practiceAnswered=0,
+            practiceCorrect=0,
         )
         Session.add(dbAnsSummary)
 
-    # Update based on answer table
-    (
-        dbAnsSummary.lecAnswered,
-        dbAnsSummary.lecCorrect,
-        dbAnsSummary.practiceAnswered,
-        dbAnsSummary.practiceCorrect,
-        maxTimeEnd,
-    ) = Session.query(
-        func.count(),
-        func.ifnull(func.sum(db.Answer.correct), 0),
-        func.ifnull(func.sum(db.Answer.practice), 0),
-        func.ifnull(func.sum(expression.case([(db.Answer.practice & db.Answer.correct, 1)], else_=0)), 0),
-        func.max(db.Answer.timeEnd),
-    ).filter(db.Answer.lectureId == lectureId).filter(db.Answer.studentId == student.studentId).one()
+        # New row (or table was lost), so start from what's in the answer table
+        _setSummaryCounts(dbAnsSummary, *(_answerSummaryQuery()
+            .filter(db.Answer.lectureId == lectureId)
+            .filter(db.Answer.studentId == student.studentId)
+            .one()))
 
-    dbAnsSummary.lecAnswered = int(dbAnsSummary.lecAnswered)
-    dbAnsSummary.lecCorrect = int(dbAnsSummary.lecCorrect)
-    dbAnsSummary.practiceAnswered = int(dbAnsSummary.practiceAnswered)
-    dbAnsSummary.practiceCorrect = int(dbAnsSummary.practiceCorrect)
+    # NB: Uses ix_answer_lectureId_studentId_timeEnd, doesn't scan history
+    maxTimeEnd = (Session.query(func.max(db.Answer.timeEnd))
+        .filter(db.Answer.lectureId == lectureId)
+        .filter(db.Answer.studentId == student.studentId)
+        .one())[0]
     if not maxTimeEnd:
         maxTimeEnd = datetime.datetime.utcfromtimestamp(0)
 
     return (dbAnsSummary, maxTimeEnd)
 
 
+def rebuildAnswerSummaries(lectureIds=None, studentIds=None):
+    """
+    Recalculate answerSummary counters from the answer table, creating any
+    missing rows. Returns the number of rows that had drifted and were fixed.
+    """
+    if lectureIds is not None and len(lectureIds) == 0:
+        return 0
+    if studentIds is not None and len(studentIds) == 0:
+        return 0
+
+    summaryQuery = Session.query(db.AnswerSummary).with_lockmode('update')
+    answerQuery = (_answerSummaryQuery(db.Answer.lectureId, db.Answer.studentId)
+        .group_by(db.Answer.lectureId, db.Answer.studentId))
+    if lectureIds is not None:
+        summaryQuery = summaryQuery.filter(db.AnswerSummary.lectureId.in_(lectureIds))
+        answerQuery = answerQuery.filter(db.Answer.lectureId.in_(lectureIds))
+    if studentIds is not None:
+        summaryQuery = summaryQuery.filter(db.AnswerSummary.studentId.in_(studentIds))
+        answerQuery = answerQuery.filter(db.Answer.studentId.in_(studentIds))
+
+    dbAnsSummaries = dict(
+        ((s.lectureId, s.studentId), s)
+        for s in summaryQuery
+    )
+    repaired = 0
+    for row in answerQuery:
+        dbAnsSummary = dbAnsSummaries.get((row[0], row[1]), None)
+        if dbAnsSummary is None:
+            dbAnsSummary = db.AnswerSummary(
+                lectureId=row[0],
+                studentId=row[1],
+                grade=0,
+                gradeHighWaterMark=0,
+                lecAnswered=0,
+                lecCorrect=0,
+                practiceAnswered=0,
+                practiceCorrect=0,
+            )
+            Session.add(dbAnsSummary)
+        if _setSummaryCounts(dbAnsSummary, *row[2:]):
+            repaired += 1
+    Session.flush()
+
+    return repaired
+
+
+def rebuildTutorialSummaries(tutorialId, studentIds=None, acedLectureId=None):
+    """
+    Recount tutorialSummary.lecturesAced for studentIds (or everyone with a row
+    or an aced lecture) from answerSummary, over the lectures currently in
+    tutorialId. acedLectureId counts as aced, even if its answerSummary
+    gradeHighWaterMark isn't up to date yet. Returns dict of studentId -> lecturesAced.
+    """
+    if studentIds is not None and len(studentIds) == 0:
+        return {}
+
+    acedQuery = (Session.query(db.AnswerSummary.studentId, func.count())
+        .join(db.Lecture, db.Lecture.lectureId == db.AnswerSummary.lectureId)
+        .filter(db.Lecture.tutorialId == tutorialId)
+        .filter(or_(
+            db.AnswerSummary.gradeHighWaterMark >= 9.750,
+            db.AnswerSummary.lectureId == acedLectureId,
+        ))
+        .group_by(db.AnswerSummary.studentId))
+    summaryQuery = (Session.query(db.TutorialSummary)
+        .filter(db.TutorialSummary.tutorialId == tutorialId))
+    if studentIds is not None:
+        acedQuery = acedQuery.filter(db.AnswerSummary.studentId.in_(studentIds))
+        summaryQuery = summaryQuery.filter(db.TutorialSummary.studentId.in_(studentIds))
+    lecturesAced = dict(acedQuery)
+
+    if studentIds is None:
+        studentIds = set(lecturesAced.keys()) | set(
+            s.studentId for s in summaryQuery.with_entities(db.TutorialSummary.studentId))
+        if len(studentIds) == 0:
+            return {}
+        summaryQuery = summaryQuery.filter(db.TutorialSummary.studentId.in_(studentIds))
+
+    # NB: Create rows first, so concurrent first aces don't both insert
+    Session.execute(db.TutorialSummary.__table__.insert()
+        .prefix_with('IGNORE', dialect='mysql')
+        .prefix_with('OR IGNORE', dialect='sqlite'), [dict(
+            studentId=id,
+            tutorialId=tutorialId,
+            lecturesAced=0,
+        ) for id in studentIds])
+    for dbTutSummary in summaryQuery.with_lockmode('update').populate_existing():
+        dbTutSummary.lecturesAced = lecturesAced.get(dbTutSummary.studentId, 0)
+    Session.flush()
+
+    return dict((id, lecturesAced.get(id, 0)) for id in studentIds)
+
+
+def rebuildTutorialSummariesForLectures(lectureIds, tutorialIds):
+    """
+    lectureIds have joined or left tutorialIds, recount lecturesAced in them
+    for anyone that aced one of the lectures
+    """
+    if len(lectureIds) == 0:
+        return
+    studentIds = [x[0] for x in (Session.query(db.AnswerSummary.studentId)
+        .filter(db.AnswerSummary.lectureId.in_(lectureIds))
+        .filter(db.AnswerSummary.gradeHighWaterMark >= 9.750)
+        .distinct())]
+    for tutorialId in sorted(set(tutorialIds)):
+        if tutorialId is not None:
+            rebuildTutorialSummaries(tutorialId, studentIds)
+
+
 def getCoinAward(dbLec, student, dbAnsSummary, dbQn, a, settings):
     """How many coins does this earn a student?"""
     def crossedGradeBoundary(boundary):
@@ -95,19 +229,14 @@ def getCoinAward(dbLec, student, dbAnsSummary, dbQn, a, settings):
         out += get_award_setting('lecture_aced', "10000")
 
         # Is every other lecture aced?
-        # TODO: Bit ugly relying on plonePath structure here
-        siblingLectures = [x[0] for x in Session.query(db.Lecture.lectureId)
-            .filter(db.Lecture.hostId == dbLec.hostId)
-            .filter(db.Lecture.lectureId != dbLec.lectureId)
-            .filter(db.Lecture.plonePath.startswith(re.sub(r'/[^/]+/?$', '/', dbLec.plonePath)))
-            .all()]
-
-        if (Session.query(db.AnswerSummary)
-                .join(db.Lecture)
-                .filter(db.Lecture.lectureId.in_(siblingLectures))
-                .filter(db.AnswerSummary.studentId == student.studentId)
-                .filter(db.AnswerSummary.gradeHighWaterMark >= 9.750)
-                .count() >= len(siblingLectures)):
+        if dbLec.tutorialId is not None and rebuildTutorialSummaries(
+                dbLec.tutorialId,
+                [student.studentId],
+                acedLectureId=dbLec.lectureId,
+        )[student.studentId] >= (
+                Session.query(func.count(db.Lecture.lectureId))
+                .filter(db.Lecture.tutorialId == dbLec.tutorialId)
+                .one())[0]:
             out += get_award_setting('tutorial_aced', "100000")
 
     # Is this a review of a template question?
@@ -149,7 +278,72 @@ def getCoinAward(dbLec, student, dbAnsSummary, dbQn, a, settings):
     return out
 
 
-def parseAnswerQueue(alloc, rawAnswerQueue, settings, studentSettings={}):
+def removeDuplicateAnswers():
+    """
+    Remove answers repeated for the same student/lecture/question/timeEnd,
+    keeping the first one stored, and fix the answerSummary rows affected.
+    The same as db_upgrades.sql does before creating the unique index.
+    Returns the number of answers removed.
+    """
+    firstAnswer = aliased(db.Answer)
+    dupes = (Session.query(db.Answer.answerId, db.Answer.lectureId, db.Answer.studentId)
+        .join(firstAnswer, and_(
+            firstAnswer.studentId == db.Answer.studentId,
+            firstAnswer.lectureId == db.Answer.lectureId,
+            firstAnswer.questionId == db.Answer.questionId,
+            firstAnswer.timeEnd == db.Answer.timeEnd,
+            firstAnswer.answerId < db.Answer.answerId,
+        ))
+        .distinct()
+        .all())
+    if len(dupes) == 0:
+        return 0
+
+    (Session.query(db.Answer)
+        .filter(db.Answer.answerId.in_([d[0] for d in dupes]))
+        .delete(synchronize_session=False))
+    rebuildAnswerSummaries(
+        lectureIds=list(set(d[1] for d in dupes)),
+        studentIds=list(set(d[2] for d in dupes)),
+    )
+    return len(dupes)
+
+
+def incrementQuestionCounts(qnCounts):
+    """
+    Add to question counters, given dict of questionId -> (answered, correct).
+    Uses atomic UPDATEs, so question rows don't need locking beforehand.
+    """
+    if len(qnCounts) == 0:
+        return
+    qnTable = db.Question.__table__
+
+    # NB: Always update in the same order, so concurrent syncs can't deadlock
+    for questionId in sorted(qnCounts.keys()):
+        (answered, correct) = qnCounts[questionId]
+        Session.execute(qnTable.update()
+            .where(qnTable.c.questionId == questionId)
+            .values(
+                timesAnswered=qnTable.c.timesAnswered + answered,
+                timesCorrect=qnTable.c.timesCorrect + correct,
+            ))
+
+    # NB: Separate statement, MySQL would see updated counts in the same SET but SQLite wouldn't
+    Session.execute(qnTable.update()
+        .where(qnTable.c.questionId.in_(qnCounts.keys()))
+        .where(qnTable.c.timesAnswered > 0)
+        .values(difficultyBucket=func.round(50.0 * qnTable.c.timesCorrect / qnTable.c.timesAnswered)))
+
+
+def parseAnswerQueue(alloc, rawAnswerQueue, settings, studentSettings={}, answerQueueCursor=None):
+    """
+    Store new answers from rawAnswerQueue, return the answers stored in the DB.
+    If answerQueueCursor (the answerQueueCursor from a previous sync) is given,
+    only return answers stored since then.
+
+    NB: The cursor is an answerId, so anything writing answers has to hold the
+    answerSummary row lock until it commits, so IDs are committed in order.
+    """
     dbLec = alloc.dbLec
     student = alloc.student
 
@@ -165,30 +359,30 @@ def parseAnswerQueue(alloc, rawAnswerQueue, settings, studentSettings={}):
             continue
         answerQueue.append(a)
 
-    # Lock answers for this lecture/student, to stop any concurrent updates
-    answerRows = {}
-    for questionId, timeEnd in (Session.query(db.Answer.questionId, db.Answer.timeEnd)
-            .filter(db.Answer.studentId == student.studentId)
-            .filter(db.Answer.lectureId == dbLec.lectureId)
-            .with_lockmode('update')):  # NB: FOR UPDATE gets us a fresh view of the data, SELECT doesn't necessarily? Who knows.
-        answerRows['%d:%d' % (questionId, calendar.timegm(timeEnd.timetuple()))] = True
-
+    # Find any of the incoming answers that are already stored
+    # NB: Times are stored to the second, so compare as ints throughout
+    answerRows = set()
+    if len(answerQueue) > 0:
+        # NB: Locking the summary row stops concurrent syncs for this lecture/student
+        (dbAnsSummary, maxTimeEnd) = getAnswerSummary(dbLec.lectureId, student)
+        for questionId, timeEnd in (Session.query(db.Answer.questionId, db.Answer.timeEnd)
+                .filter(db.Answer.studentId == student.studentId)
+                .filter(db.Answer.lectureId == dbLec.lectureId)
+                .filter(db.Answer.timeEnd.in_(set(
+                    datetime.datetime.utcfromtimestamp(int(a['answer_time'])) for a in answerQueue
+                )))
+                .with_lockmode('update')):  # NB: FOR UPDATE gets us a fresh view of the data, SELECT doesn't necessarily? Who knows.
+            answerRows.add((questionId, calendar.timegm(timeEnd.timetuple())))
+
+    # NB: Questions aren't locked, counters are updated atomically by incrementQuestionCounts()
     dbQns = dict(alloc.getQuestions(
         uris=[a['uri'] for a in answerQueue],
-        lockForUpdate=True,
         active=None,  # NB: Might be writing historical answers
     ))
 
-    rowsAdded = 0
+    newAnswers = []
+    qnCounts = {}  # questionId -> [timesAnswered, timesCorrect] to add
     for a in answerQueue:
-        # We have work to do, so get/create the summary
-        # NB: On intial sync we do lots of lectures at once, creating the entry at this
-        # point is wasted effort, and a cause of deadlocks as we try to sync whole tutorial
-        try:
-            dbAnsSummary
-        except NameError:
-            (dbAnsSummary, maxTimeEnd) = getAnswerSummary(dbLec.lectureId, student)
-
         # Extract querystring if there is one
         questionUri = a['uri']
         parts = questionUri.split('?', 1)
@@ -204,14 +398,15 @@ def parseAnswerQueue(alloc, rawAnswerQueue, settings, studentSettings={}):
             continue
 
         # Does this answer already exist in DB? if so, ignore it.
-        if '%d:%d' % (dbQn.questionId, a['answer_time']) in answerRows:
+        answerTime = int(a['answer_time'])
+        if (dbQn.questionId, answerTime) in answerRows:
             logger.debug("Ignoring answer for question %d at time %d --- already got one",
                 dbQn.questionId,
-                a['answer_time'],
+                answerTime,
             )
             continue
         else:
-            answerRows['%d:%d' % (dbQn.questionId, a['answer_time'])] = True
+            answerRows.add((dbQn.questionId, answerTime))
 
         if dbQn.qnType == 'tw_questiontemplate' and a.get('question_type', '') == 'usergenerated':
             # Evaluated a user-generated question, write it to the DB
@@ -248,6 +443,7 @@ def parseAnswerQueue(alloc, rawAnswerQueue, settings, studentSettings={}):
             if a.get('student_answer', None) and a['student_answer'].get('text', None):
                 # Write question to database
                 ugQn = db.UserGeneratedQuestion(
+                    ugQuestionGuid=uuid.uuid4(),  # NB: Choose now, so we don't need to flush
                     studentId=student.studentId,
                     questionId=dbQn.questionId,
                     text=a['student_answer']['text'],
@@ -259,7 +455,6 @@ def parseAnswerQueue(alloc, rawAnswerQueue, settings, studentSettings={}):
                 Session.add(ugQn)
 
                 # student_answer should contain the ID of our answer
-                Session.flush()
                 a['student_answer'] = dict(question_id=ugQn.ugQuestionGuid)
 
                 # If this replaces an old question, note this in DB
@@ -295,9 +490,11 @@ def parseAnswerQueue(alloc, rawAnswerQueue, settings, studentSettings={}):
                 continue
             else:
                 a['correct'] = a['student_answer'] in json.loads(dbQn.correctChoices)
-                if a['correct']:
-                    dbQn.timesCorrect += 1
-            dbQn.timesAnswered += 1  # NB: Do this once we know question is valid
+            # NB: Do this once we know question is valid
+            counts = qnCounts.setdefault(dbQn.questionId, [0, 0])
+            counts[0] += 1
+            if a['correct']:
+                counts[1] += 1
 
         # Update student summary rows
         dbAnsSummary.lecAnswered += 1  # NB: Including practice questions is intentional
@@ -315,13 +512,13 @@ def parseAnswerQueue(alloc, rawAnswerQueue, settings, studentSettings={}):
         # NB: We're ignoring practice grades because a bug elsewhere is causing students to have 0
         # grades after returning to tutorweb after ~24hours and taking a practice question.
         if not(a.get('practice', False)) and a.get('grade_after', None) is not None:
-            if datetime.datetime.utcfromtimestamp(a['answer_time']) > maxTimeEnd:
+            if datetime.datetime.utcfromtimestamp(answerTime) > maxTimeEnd:
                 dbAnsSummary.grade = a['grade_after']
             if a['grade_after'] > dbAnsSummary.gradeHighWaterMark:
                 dbAnsSummary.gradeHighWaterMark = a['grade_after']
 
-        # Update database with this answer
-        Session.add(db.Answer(
+        # Queue up answer to be written
+        newAnswers.append(dict(
             lectureId=dbLec.lectureId,
             lectureVersion=int(studentSettings['lecture_version']) if 'lecture_version' in studentSettings else None,
             studentId=student.studentId,
@@ -329,39 +526,125 @@ def parseAnswerQueue(alloc, rawAnswerQueue, settings, studentSettings={}):
             chosenAnswer=-1 if isinstance(a['student_answer'], dict) else a['student_answer'],
             correct=a.get('correct', None),
             grade=a.get('grade_after', None),
-            timeStart=datetime.datetime.utcfromtimestamp(a['quiz_time']),
-            timeEnd=datetime.datetime.utcfromtimestamp(a['answer_time']),
+            timeStart=datetime.datetime.utcfromtimestamp(int(a['quiz_time'])),
+            timeEnd=datetime.datetime.utcfromtimestamp(answerTime),
             practice=a.get('practice', False),
             coinsAwarded=coinsAwarded,
             ugQuestionGuid=a['student_answer'].get('question_id', None) if isinstance(a['student_answer'], dict) else None,
         ))
-        rowsAdded += 1
         a['synced'] = True
     Session.flush()
 
-    # Get all previous real answers and send them back.
-    dbAnswers = (Session.query(db.Answer)
-        .filter(db.Answer.lectureId == dbLec.lectureId)
-        .filter(db.Answer.studentId == student.studentId)
-        .order_by(db.Answer.timeEnd.desc())
-        .with_lockmode('update')  # NB: Use FOR UPDATE, as otherwise we might get the table state at the start of the transaction
-        .all())
-    out = [dict(  # NB: Not fully recreating what JS creates, but shouldn't be a problem
-        correct=dbAns.correct,
-        quiz_time=calendar.timegm(dbAns.timeStart.timetuple()),
-        answer_time=calendar.timegm(dbAns.timeEnd.timetuple()),
-        student_answer=dict(question_id=str(dbAns.ugQuestionGuid)) if dbAns.ugQuestionGuid
-                  else dbAns.chosenAnswer,
-        grade_after=dbAns.grade,
-        coins_awarded=dbAns.coinsAwarded,
-        practice=dbAns.practice,
-        synced=True,
-    ) for dbAns in reversed(dbAnswers)]
-
-    if len(out) > 8:
-        # Configure a target difficulty
-        alloc.targetDifficulty = out[-1].get('grade_after', None)
-        # If we've crossed over to the next 10, allocate some different questions
-        alloc.reAllocQuestions= len(out) // 10 > (len(out) - rowsAdded) // 10
+    # Update question counters, once per question
+    incrementQuestionCounts(qnCounts)
+    for dbQn in dbQns.values():
+        if dbQn.questionId in qnCounts:
+            Session.expire(dbQn, ['timesAnswered', 'timesCorrect', 'difficultyBucket'])
+
+    # Write all answers in one go. Summaries, counters and coins already assume
+    # they're all new, so if the unique index finds a duplicate we want to fail.
+    if len(newAnswers) > 0:
+        Session.execute(db.Answer.__table__.insert(), newAnswers)
+    Session.flush()
+
+    return getAnswerQueues(
+        [alloc],
+        answerQueueCursors={dbLec.lectureId: answerQueueCursor},
+        rowsAdded={dbLec.lectureId: len(newAnswers)},
+    )[dbLec.lectureId]
+
+
+def getAnswerQueues(allocs, answerQueueCursors={}, rowsAdded={}):
+    """
+    Fetch stored answers for several lectures of the same student at once,
+    returning a dict of lectureId -> answerQueue. answerQueueCursors / rowsAdded
+    are dicts of lectureId -> value, see parseAnswerQueue.
+    """
+    if len(allocs) == 0:
+        return {}
+    student = allocs[0].student
+    lectureIds = [alloc.dbLec.lectureId for alloc in allocs]
+
+    # Parse client's cursors, check they're one of our answers. If not, replay everything
+    cursors = {}
+    for (lectureId, cursor) in answerQueueCursors.items():
+        try:
+            cursors[lectureId] = int(cursor)
+        except (TypeError, ValueError):
+            pass
+    if len(cursors) > 0:
+        validCursors = set(Session.query(db.Answer.lectureId, db.Answer.answerId)
+            .filter(db.Answer.answerId.in_(cursors.values()))
+            .filter(db.Answer.studentId == student.studentId))
+        for (lectureId, cursor) in cursors.items():
+            if (lectureId, cursor) not in validCursors:
+                logger.debug("Unknown answerQueueCursor %d, returning all answers", cursor)
+                del cursors[lectureId]
+
+    # Get all previous real answers (or those since the cursor) and send them back.
+    out = dict((lectureId, []) for lectureId in lectureIds)
+    dbAnswerIds = dict((lectureId, []) for lectureId in lectureIds)
+    for dbAns in (Session.query(db.Answer)
+            .filter(or_(*[
+                and_(db.Answer.lectureId == lectureId, db.Answer.answerId > cursors[lectureId])
+                if lectureId in cursors else db.Answer.lectureId == lectureId
+                for lectureId in lectureIds
+            ]))
+            .filter(db.Answer.studentId == student.studentId)
+            .order_by(db.Answer.lectureId, db.Answer.timeEnd, db.Answer.answerId)
+            .with_lockmode('update')):  # NB: Use FOR UPDATE, as otherwise we might get the table state at the start of the transaction
+        out[dbAns.lectureId].append(dict(  # NB: Not fully recreating what JS creates, but shouldn't be a problem
+            correct=dbAns.correct,
+            quiz_time=calendar.timegm(dbAns.timeStart.timetuple()),
+            answer_time=calendar.timegm(dbAns.timeEnd.timetuple()),
+            student_answer=dict(question_id=str(dbAns.ugQuestionGuid)) if dbAns.ugQuestionGuid
+                      else dbAns.chosenAnswer,
+            grade_after=dbAns.grade,
+            coins_awarded=dbAns.coinsAwarded,
+            practice=dbAns.practice,
+            synced=True,
+        ))
+        dbAnswerIds[dbAns.lectureId].append(dbAns.answerId)
+
+    # Don't have the full history for delta lectures, so use the summary & latest answer
+    answerCounts = {}
+    lastGrades = {}
+    if len(cursors) > 0:
+        for dbAnsSummary in (Session.query(db.AnswerSummary)
+                .filter(db.AnswerSummary.lectureId.in_(cursors.keys()))
+                .filter(db.AnswerSummary.studentId == student.studentId)):
+            answerCounts[dbAnsSummary.lectureId] = dbAnsSummary.lecAnswered
+        latestAnswers = (Session.query(db.Answer.lectureId, func.max(db.Answer.timeEnd).label('timeEnd'))
+            .filter(db.Answer.lectureId.in_(cursors.keys()))
+            .filter(db.Answer.studentId == student.studentId)
+            .group_by(db.Answer.lectureId)
+            .subquery())
+        # NB: Several answers can share the latest timeEnd, the last one written wins
+        for (lectureId, grade) in (Session.query(db.Answer.lectureId, db.Answer.grade)
+                .join(latestAnswers, and_(
+                    latestAnswers.c.lectureId == db.Answer.lectureId,
+                    latestAnswers.c.timeEnd == db.Answer.timeEnd,
+                ))
+                .filter(db.Answer.studentId == student.studentId)
+                .order_by(db.Answer.answerId)):
+            lastGrades[lectureId] = grade
+
+    for alloc in allocs:
+        lectureId = alloc.dbLec.lectureId
+        alloc.answerQueueDelta = lectureId in cursors
+        alloc.answerQueueCursor = max(dbAnswerIds[lectureId] + [cursors.get(lectureId, 0)]) or None
+
+        if alloc.answerQueueDelta:
+            answerCount = answerCounts.get(lectureId, 0)
+            lastGrade = lastGrades.get(lectureId, None)
+        else:
+            answerCount = len(out[lectureId])
+            lastGrade = out[lectureId][-1].get('grade_after', None) if out[lectureId] else None
+
+        if answerCount > 8:
+            # Configure a target difficulty
+            alloc.targetDifficulty = lastGrade
+            # If we've crossed over to the next 10, allocate some different questions
+            alloc.reAllocQuestions= answerCount // 10 > (answerCount - rowsAdded.get(lectureId, 0)) // 10
 
     return out
@@ -13,7 +13,11 @@ from Products.statusmessages.interfaces import IStatusMessage
 
 from tutorweb.content.schema import IQuestion
 from tutorweb.quizdb import db
-from tutorweb.quizdb.utils import getDbHost, getDbStudent
+from tutorweb.quizdb.allocation.questionbank import invalidateQuestionBank
+from tutorweb.quizdb.sync.answers import rebuildTutorialSummariesForLectures
+from tutorweb.quizdb.sync.questions import invalidateQuestionData
+from tutorweb.quizdb.sync.student import invalidateStudentSettings, provisionStudentSettings
+from tutorweb.quizdb.utils import getDbHost, getDbStudent, getDbTutorial, renumberTutorial
 
 logger = logging.getLogger(__package__)
 
@@ -26,6 +30,7 @@ def syncClassSubscriptions(classObj):
     mtool = getToolByName(classObj, 'portal_membership')
     messages = IStatusMessage(getattr(classObj, "REQUEST"))
 
+    studentIds = []
     for s in (classObj.students or []):
         mb = mtool.getMemberById(s)
         if mb is None:
@@ -33,6 +38,7 @@ def syncClassSubscriptions(classObj):
             messages.add("Student %s doesn't exist, not adding to MySQL" % s, type="warn")
             continue
         dbStudent = getDbStudent(mb.getUserName(), mb.getProperty('email'))
+        studentIds.append(dbStudent.studentId)
 
         try:
             dbSub = (Session.query(db.Subscription)
@@ -44,8 +50,21 @@ def syncClassSubscriptions(classObj):
                 student=dbStudent,
                 plonePath=ploneClassPath,
             ))
+            invalidateStudentSettings(studentId=dbStudent.studentId)
         Session.flush()
 
+    # Choose settings for the whole class up front
+    lecturePaths = [
+        '/'.join(l.to_object.getPhysicalPath())
+        for l in (getattr(classObj, 'lectures', None) or [])
+        if getattr(l, 'to_object', None) is not None
+    ]
+    if studentIds and lecturePaths:
+        for dbLec in (Session.query(db.Lecture)
+                      .filter(db.Lecture.hostId == getDbHost().hostId)
+                      .filter(db.Lecture.plonePath.in_(lecturePaths))):
+            provisionStudentSettings(dbLec, studentIds)
+
 
 def removeClassSubscriptions(ploneClassPath):
     """
@@ -55,6 +74,53 @@ def removeClassSubscriptions(ploneClassPath):
              .filter_by(plonePath=ploneClassPath)
              .delete())
     Session.flush()
+    invalidateStudentSettings()
+
+
+def _placeLecture(dbLec, renumber=False):
+    """Make sure dbLec is in the tutorial its path says, and has an ordinal"""
+    tutorialPath = dbLec.plonePath.rsplit('/', 1)[0]
+    oldTutorialId = dbLec.tutorialId
+    if dbLec.tutorial is None or dbLec.tutorial.plonePath != tutorialPath:
+        dbLec.tutorial = getDbTutorial(tutorialPath, hostId=dbLec.hostId)
+        Session.flush()
+        renumber = True
+    if renumber or dbLec.ordinal is None:
+        renumberTutorial(dbLec.tutorialId)
+        if oldTutorialId is not None and oldTutorialId != dbLec.tutorialId:
+            renumberTutorial(oldTutorialId)
+    if oldTutorialId != dbLec.tutorialId:
+        rebuildTutorialSummariesForLectures([dbLec.lectureId], [oldTutorialId, dbLec.tutorialId])
+
+
+def _lectureSubscribers(lectureObj):
+    """
+    Return studentIds of everyone subscribed to lectureObj, either via. its
+    tutorial or a class that includes it
+    """
+    plonePath = '/'.join(lectureObj.getPhysicalPath())
+    subPaths = [plonePath.rsplit('/', 1)[0]]
+
+    # Class subscriptions are registered, look for classes that include this lecture
+    for (classPath,) in (Session.query(db.Subscription.plonePath)
+            .filter_by(registered=True)
+            .filter_by(hidden=False)
+            .distinct()):
+        try:
+            classObj = lectureObj.unrestrictedTraverse(str(classPath))
+        except KeyError:
+            continue
+        if getattr(classObj, 'portal_type', None) != 'tw_class':
+            continue
+        if any(
+                getattr(l, 'to_object', None) is not None and '/'.join(l.to_object.getPhysicalPath()) == plonePath
+                for l in (getattr(classObj, 'lectures', None) or [])):
+            subPaths.append(classPath)
+
+    return [x[0] for x in (Session.query(db.Subscription.studentId)
+        .filter(db.Subscription.plonePath.in_(subPaths))
+        .filter_by(hidden=False)
+        .distinct())]
 
 
 def syncPloneLecture(lectureObj):
@@ -103,6 +169,7 @@ def syncPloneLecture(lectureObj):
         )
         Session.add(dbLec)
         Session.flush()
+    _placeLecture(dbLec)
 
     # Fetch current settings object
     globalSettings = lectureObj.unrestrictedTraverse('@@drill-settings').asDict()
@@ -110,6 +177,7 @@ def syncPloneLecture(lectureObj):
     # If the settings don't match, bump the version and repopulate
     if not compareLgs(dbLec, globalSettings):
         dbLec.currentVersion += 1
+        invalidateStudentSettings(lectureId=dbLec.lectureId)
         for (key, values) in globalSettings.iteritems():
             # Split key & variant
             (key, variant) = key.split(":", 2) if ":" in key else (key, "")
@@ -122,6 +190,9 @@ def syncPloneLecture(lectureObj):
             Session.add(dbLgs)
         Session.flush()
 
+        # Choose new settings for everyone subscribed to the tutorial or a class with the lecture
+        provisionStudentSettings(dbLec, _lectureSubscribers(lectureObj))
+
     return dbLec
 
 
@@ -136,6 +207,7 @@ def movePloneLecture(oldPath, newPath):
         return
     dbLec.plonePath = newPath
     Session.flush()
+    _placeLecture(dbLec, renumber=True)
 
 
 def removePloneLecture(lectureObj):
@@ -152,7 +224,13 @@ def removePloneLecture(lectureObj):
         datetime.datetime.utcnow().strftime('/deleted-%Y-%m-%d--%H:%M:%S'),
         dbLec.plonePath,
     ))
+    oldTutorialId = dbLec.tutorialId
+    dbLec.tutorialId = None
+    dbLec.ordinal = None
     Session.flush()
+    if oldTutorialId is not None:
+        renumberTutorial(oldTutorialId)
+        rebuildTutorialSummariesForLectures([dbLec.lectureId], [oldTutorialId])
 
 def _toUTCDateTime(t):
     """Convert Zope DateTime into UTC datetime object"""
@@ -218,7 +296,9 @@ def syncPloneQuestions(dbLec, lectureObj):
     ploneQns = _ploneQuestionDict(listing)
 
     # Get all questions currently in the database
+    syncedPaths = []
     for dbQn in (Session.query(db.Question).filter(db.Question.lectures.contains(dbLec))):
+        syncedPaths.append(dbQn.plonePath)
         qn = ploneQns.get(dbQn.plonePath, None)
         if qn is not None:
             # Question still there (or returned), update
@@ -242,6 +322,8 @@ def syncPloneQuestions(dbLec, lectureObj):
             dbQn.lastUpdate = datetime.datetime.utcnow()
         elif dbQn.active:
             # Remove question from all lectures and mark as inactive
+            for l in dbQn.lectures:
+                invalidateQuestionBank(l.lectureId)
             dbQn.lectures = []
             dbQn.active = False
             dbQn.lastUpdate = datetime.datetime.utcnow()
@@ -271,4 +353,6 @@ def syncPloneQuestions(dbLec, lectureObj):
 
     dbLec.lastUpdate = datetime.datetime.utcnow()
     Session.flush()
+    invalidateQuestionBank(dbLec.lectureId)
+    invalidateQuestionData(syncedPaths)
     return True
@@ -3,10 +3,15 @@ import logging
 import pytz
 
 from tutorweb.quizdb.allocation.base import Allocation
+from tutorweb.quizdb.cache import LRUCache
 
 # logging.getLogger('sqlalchemy.engine').setLevel(logging.DEBUG)
 logger = logging.getLogger(__package__)
 
+# (plonePath, querystring, Question.lastUpdate) -> @@data JSON string sent to students.
+# NB: Only keep the one representation, base64 images make these big
+questionJsonCache = LRUCache(maxSize=5000)
+
 
 def getQuestionAllocation(alloc, settings):
     # Return all active questions
@@ -25,3 +30,21 @@ def getAllQuestionPath(questions):
     return 'quizdb-all-questions?%s' % (
         hashlib.sha1("".join(sorted(q['uri'] for q in questions)).encode("utf8")).hexdigest()
     )
+
+
+def questionCacheKey(dbQn):
+    """Key for caching anything rendered from dbQn"""
+    if '?' in dbQn.plonePath:
+        (plonePath, querystring) = dbQn.plonePath.split('?', 1)
+    else:
+        (plonePath, querystring) = (dbQn.plonePath, '')
+    return (plonePath, querystring, dbQn.lastUpdate)
+
+
+def invalidateQuestionData(plonePaths=None):
+    """Forget cached @@data JSON for the questions at plonePaths, or everything"""
+    if plonePaths is None:
+        questionJsonCache.invalidate()
+        return
+    plonePaths = set(p.split('?', 1)[0] for p in plonePaths)
+    questionJsonCache.invalidate(lambda k: k[0] in plonePaths)
@@ -1,4 +1,6 @@
+import logging
 import random
+import sys
 
 try:
     import numpy.random
@@ -12,6 +14,9 @@ from sqlalchemy.orm.exc import NoResultFound
 from z3c.saconfig import Session
 
 from tutorweb.quizdb import db
+from tutorweb.quizdb.cache import LRUCache
+
+logger = logging.getLogger(__package__)
 
 # Randomly-chosen questions that should result in an integer value
 INTEGER_SETTINGS = set((
@@ -35,6 +40,15 @@ SERVERSIDE_SETTINGS = [
     'award_lecture_answered',
 ]
 
+# Seconds to keep cached settings, so changes made by other Zope instances
+# (which can't invalidate our cache) are picked up eventually
+SETTINGS_CACHE_AGE = 300
+
+# (lectureId, currentVersion, studentId) -> settings dict
+settingsCache = LRUCache(maxSize=10000, maxAge=SETTINGS_CACHE_AGE)
+# (studentId, variant) -> True iff variant applies to student
+variantCache = LRUCache(maxSize=10000, maxAge=SETTINGS_CACHE_AGE)
+
 
 def _chooseSettingValue(lgs):
     """Return a new value according to restrictions in the lgs object"""
@@ -73,43 +87,179 @@ def _chooseSettingValue(lgs):
     return None
 
 
+def _chooseSettingValues(lgs, count):
+    """Return list of count new values according to restrictions in the lgs object"""
+    if lgs.shape is None or lgs.key in STRING_SETTINGS or lgs.value is None:
+        # Nothing to vectorise, let _chooseSettingValue sort it out (or complain)
+        return [_chooseSettingValue(lgs) for i in xrange(count)]
+
+    # Draw all values at once, re-drawing any outside min/max
+    out = numpy.empty(0)
+    for i in xrange(10):
+        draws = numpy.random.gamma(shape=float(lgs.shape), scale=float(lgs.value), size=count - len(out))
+        if lgs.max is not None:
+            draws = draws[((lgs.min or 0) <= draws) & (draws < lgs.max)]
+        out = numpy.concatenate((out, draws))
+        if len(out) >= count:
+            break
+    else:
+        raise ValueError("Cannot pick value that satisfies shape %f / value %f / min %f / max %f" % (
+            lgs.shape,
+            lgs.value,
+            lgs.min,
+            lgs.max,
+        ))
+
+    if lgs.key in INTEGER_SETTINGS:
+        return [str(int(round(x))) for x in out]
+    return [str(float(x)) for x in out]
+
+
 def _variantApplicable(variant, dbStudent):
     """Is this variant applicable to this student?"""
     if not variant:
         return True
 
+    out = variantCache.get((dbStudent.studentId, variant), None)
+    if out is not None:
+        return out
+
     if variant == "registered":
         # Is the student subscribed to a course?
-        return bool(Session.query(db.Subscription)
-                       .filter_by(student=dbStudent)
-                       .filter(db.Subscription.plonePath.like('/%/schools-and-classes/%'))
+        out = bool(Session.query(db.Subscription.plonePath)
+                       .filter_by(studentId=dbStudent.studentId)
+                       .filter_by(registered=True)
                        .first())
+    else:
+        raise ValueError("Unknown variant %s" % variant)
+
+    variantCache.setAfterCommit((dbStudent.studentId, variant), out)
+    return out
+
+
+def _variantStudents(variant, studentIds):
+    """Return the subset of studentIds this variant is applicable to"""
+    if not variant:
+        return set(studentIds)
+
+    if variant == "registered":
+        return set(x[0] for x in (Session.query(db.Subscription.studentId)
+                       .filter(db.Subscription.studentId.in_(studentIds))
+                       .filter_by(registered=True)
+                       .distinct()))
 
     raise ValueError("Unknown variant %s" % variant)
 
 
+def _previousSettings(dbLec, studentIds):
+    """
+    Return dict of (studentId, key, variant) -> (LectureGlobalSetting, LectureStudentSetting)
+    for the most recent version of each setting that the students were given a value for
+    """
+    out = {}
+    for (lgs, lss) in (Session.query(db.LectureGlobalSetting, db.LectureStudentSetting)
+            .join(db.LectureStudentSetting, and_(
+                  db.LectureGlobalSetting.lectureId == db.LectureStudentSetting.lectureId,
+                  db.LectureGlobalSetting.lectureVersion == db.LectureStudentSetting.lectureVersion,
+                  db.LectureGlobalSetting.key == db.LectureStudentSetting.key))
+            .filter(db.LectureGlobalSetting.lectureId == dbLec.lectureId)
+            .filter(db.LectureStudentSetting.studentId.in_(studentIds))
+            .order_by(db.LectureGlobalSetting.lectureVersion.desc())):
+        if (lss.studentId, lgs.key, lgs.variant) not in out:
+            out[(lss.studentId, lgs.key, lgs.variant)] = (lgs, lss)
+    return out
+
+
+def invalidateStudentSettings(lectureId=None, studentId=None):
+    """
+    Forget cached settings for a lecture and/or student, or everything.
+    Forgetting a student's settings also forgets which variants apply to them.
+    """
+    settingsCache.invalidateAfterCommit(None if lectureId is None and studentId is None else lambda k: (
+        (lectureId is None or k[0] == lectureId) and
+        (studentId is None or k[2] == studentId)
+    ))
+    if lectureId is None:
+        variantCache.invalidateAfterCommit(None if studentId is None else lambda k: k[0] == studentId)
+
+
 def getStudentSettings(dbLec, dbStudent):
     """Fetch settings for this lecture, customised for the student"""
-    latestLectureVersion = (Session.query(func.max(db.LectureGlobalSetting.lectureVersion))
-                            .filter_by(lectureId=dbLec.lectureId)
-                           ).one()[0]
+    return getAllStudentSettings([dbLec], dbStudent)[0]
 
-    # Copy any existing student-specific settings in first
-    out = {}
+
+def getAllStudentSettings(dbLecs, dbStudent):
+    """
+    Fetch settings for each of dbLecs, customised for the student. Stored
+    settings for all lectures not already cached are fetched together.
+    Returns a list of settings dicts, in the same order as dbLecs.
+    """
+    out = []
+    missing = []
+    for dbLec in dbLecs:
+        settings = settingsCache.get((dbLec.lectureId, dbLec.currentVersion, dbStudent.studentId), None)
+        out.append(None if settings is None else dict(settings))
+        if settings is None:
+            missing.append(dbLec)
+    if len(missing) == 0:
+        return out
+
+    latestVersions = (Session.query(
+            db.LectureGlobalSetting.lectureId,
+            func.max(db.LectureGlobalSetting.lectureVersion).label('lectureVersion'))
+        .filter(db.LectureGlobalSetting.lectureId.in_(set(l.lectureId for l in missing)))
+        .group_by(db.LectureGlobalSetting.lectureId)
+        .subquery())
+
+    # Any existing student-specific settings for the current versions
+    allLss = dict((l.lectureId, []) for l in missing)
     for lss in (Session.query(db.LectureStudentSetting)
-                .filter_by(lectureId=dbLec.lectureId)
-                .filter_by(lectureVersion=latestLectureVersion)
-                .filter_by(student=dbStudent)
+                .join(latestVersions, and_(
+                    latestVersions.c.lectureId == db.LectureStudentSetting.lectureId,
+                    latestVersions.c.lectureVersion == db.LectureStudentSetting.lectureVersion,
+                ))
+                .filter(db.LectureStudentSetting.studentId == dbStudent.studentId)
                ):
-        out[lss.key] = lss.value
+        allLss[lss.lectureId].append(lss)
 
-    # Check all global settings for the lecture
-    variants_applicable = {}
+    # All global settings for the current versions
+    latestLectureVersions = {}
+    allLgs = dict((l.lectureId, []) for l in missing)
     for lgs in (Session.query(db.LectureGlobalSetting)
-                .filter_by(lectureId=dbLec.lectureId)
-                .filter_by(lectureVersion=latestLectureVersion)
+                .join(latestVersions, and_(
+                    latestVersions.c.lectureId == db.LectureGlobalSetting.lectureId,
+                    latestVersions.c.lectureVersion == db.LectureGlobalSetting.lectureVersion,
+                ))
                 .order_by(db.LectureGlobalSetting.key, db.LectureGlobalSetting.variant.desc())  # i.e we want variants first.
                ):
+        latestLectureVersions[lgs.lectureId] = lgs.lectureVersion
+        allLgs[lgs.lectureId].append(lgs)
+
+    for (i, dbLec) in enumerate(dbLecs):
+        if out[i] is None:
+            out[i] = _studentSettings(
+                dbLec,
+                dbStudent,
+                latestLectureVersions.get(dbLec.lectureId, None),
+                allLss[dbLec.lectureId],
+                allLgs[dbLec.lectureId],
+            )
+            settingsCache.setAfterCommit((dbLec.lectureId, dbLec.currentVersion, dbStudent.studentId), dict(out[i]))
+    Session.flush()
+    return out
+
+
+def _studentSettings(dbLec, dbStudent, latestLectureVersion, allLss, allLgs):
+    """Work out settings for student, given their stored settings and the lecture's"""
+    # Copy any existing student-specific settings in first
+    out = {}
+    for lss in allLss:
+        out[lss.key] = lss.value
+
+    # Check all global settings for the lecture
+    variants_applicable = {}
+    old_sets = None
+    for lgs in allLgs:
         # If this setting variant isn't applicable to the student, ignore it.
         if lgs.variant not in variants_applicable:
             variants_applicable[lgs.variant] = _variantApplicable(lgs.variant, dbStudent)
@@ -122,17 +272,9 @@ def getStudentSettings(dbLec, dbStudent):
             continue
 
         # Find any previous setting, if it was created with the same values copy it
-        old_set = (Session.query(db.LectureGlobalSetting, db.LectureStudentSetting)
-                .join(db.LectureStudentSetting, and_(
-                      db.LectureGlobalSetting.lectureId == db.LectureStudentSetting.lectureId,
-                      db.LectureGlobalSetting.lectureVersion == db.LectureStudentSetting.lectureVersion,
-                      db.LectureGlobalSetting.key == db.LectureStudentSetting.key))
-                .filter_by(lectureId=dbLec.lectureId)
-                .filter_by(key=lgs.key)
-                .filter_by(variant=lgs.variant)
-                .filter(db.LectureStudentSetting.student == dbStudent)
-                .order_by(db.LectureGlobalSetting.lectureVersion.desc())
-                .first())
+        if old_sets is None:
+            old_sets = _previousSettings(dbLec, [dbStudent.studentId])
+        old_set = old_sets.get((dbStudent.studentId, lgs.key, lgs.variant), None)
         if old_set and lgs.equivalent(old_set[0]):
             Session.add(old_set[1].recreate(latestLectureVersion))
             out[lgs.key] = old_set[1].value
@@ -160,7 +302,99 @@ def getStudentSettings(dbLec, dbStudent):
                 value=newValue,
             ))
             out[lgs.key] = newValue
-    Session.flush()
 
     out['lecture_version'] = str(latestLectureVersion)
     return out
+
+
+def provisionStudentSettings(dbLec, studentIds):
+    """
+    Choose settings for many students at once, e.g. when publishing a lecture
+    to a class, so each doesn't pay for it on their first sync. Follows the
+    same rules as getStudentSettings(), students that already have a value
+    for a setting keep it.
+    """
+    studentIds = set(studentIds)
+    if not studentIds:
+        return 0
+
+    latestLectureVersion = (Session.query(func.max(db.LectureGlobalSetting.lectureVersion))
+                            .filter_by(lectureId=dbLec.lectureId)
+                           ).one()[0]
+    if latestLectureVersion is None:
+        return 0
+
+    # studentId -> set of keys that already have a value
+    existing = dict((id, set()) for id in studentIds)
+    for (studentId, key) in (Session.query(db.LectureStudentSetting.studentId, db.LectureStudentSetting.key)
+                             .filter_by(lectureId=dbLec.lectureId)
+                             .filter_by(lectureVersion=latestLectureVersion)
+                             .filter(db.LectureStudentSetting.studentId.in_(studentIds))
+                            ):
+        existing[studentId].add(key)
+
+    newRows = []
+    toChoose = []
+    variantStudents = {}
+    old_sets = None
+    for lgs in (Session.query(db.LectureGlobalSetting)
+                .filter_by(lectureId=dbLec.lectureId)
+                .filter_by(lectureVersion=latestLectureVersion)
+                .order_by(db.LectureGlobalSetting.key, db.LectureGlobalSetting.variant.desc())  # i.e we want variants first.
+               ):
+        if lgs.variant not in variantStudents:
+            variantStudents[lgs.variant] = _variantStudents(lgs.variant, studentIds)
+
+        pending = []
+        for studentId in variantStudents[lgs.variant]:
+            if lgs.key in existing[studentId]:
+                continue
+            existing[studentId].add(lgs.key)
+
+            # Copy any previous setting if created with the same values
+            if old_sets is None:
+                old_sets = _previousSettings(dbLec, studentIds)
+            old_set = old_sets.get((studentId, lgs.key, lgs.variant), None)
+            if old_set and lgs.equivalent(old_set[0]):
+                newRows.append(dict(
+                    studentId=studentId,
+                    variant=old_set[1].variant,
+                    key=old_set[1].key,
+                    value=old_set[1].value,
+                ))
+                continue
+            pending.append(studentId)
+        if pending:
+            toChoose.append((lgs, pending))
+
+    for (lgs, pending) in toChoose:
+        try:
+            newValues = _chooseSettingValues(lgs, len(pending))
+        except Exception as e:
+            # Don't fail whatever triggered provisioning, students will get
+            # the error when they sync instead
+            logger.warn("Cannot provision a value for %s in lecture %d: %s", lgs.key, dbLec.lectureId, e)
+            continue
+        for (studentId, newValue) in zip(pending, newValues):
+            if newValue is None:
+                # We don't need a customised value, just use the global one.
+                continue
+            newRows.append(dict(
+                studentId=studentId,
+                variant=lgs.variant,
+                key=lgs.key,
+                value=newValue,
+            ))
+
+    if newRows:
+        for r in newRows:
+            r['lectureId'] = dbLec.lectureId
+            r['lectureVersion'] = latestLectureVersion
+        Session.flush()
+        # NB: existing isn't locked, so a student's first sync could have
+        # chosen a setting since. Theirs wins, skip ours.
+        Session.execute(db.LectureStudentSetting.__table__.insert()
+            .prefix_with('IGNORE', dialect='mysql')
+            .prefix_with('OR IGNORE', dialect='sqlite'), newRows)
+    invalidateStudentSettings(lectureId=dbLec.lectureId)
+    return len(newRows)
@@ -28,6 +28,9 @@ from tutorweb.content.tests.base import (
 from tutorweb.content.tests.base import TestFixture as ContentTestFixture
 from tutorweb.content.tests.base import FunctionalTestCase as ContentFunctionalTestCase
 from tutorweb.quizdb import ORMBase
+from tutorweb.quizdb.allocation.questionbank import invalidateQuestionBank
+from tutorweb.quizdb.sync.questions import invalidateQuestionData
+from tutorweb.quizdb.sync.student import invalidateStudentSettings
 from tutorweb.quizdb.lzstring.lzstring import LZString
 
 class TestFixture(ContentTestFixture):
@@ -67,6 +70,13 @@ class TestFixture(ContentTestFixture):
         """ % self.dbFileName, context=configurationContext)
 
 
+def clearCaches():
+    """IDs get reused once tables are recreated, so throw away cached data"""
+    invalidateStudentSettings()
+    invalidateQuestionBank()
+    invalidateQuestionData()
+
+
 FIXTURE = TestFixture()
 
 TUTORWEB_QUIZDB_INTEGRATION_TESTING = IntegrationTesting(
@@ -220,6 +230,7 @@ class IntegrationTestCase(TestCase, TestHelpers):
         """Drop all DB tables and recreate"""
         Session().execute("DROP TABLE allocation")
         Session().execute("DROP TABLE lecture")
+        Session().execute("DROP TABLE tutorial")
         Session().execute("DROP TABLE lectureGlobalSetting")
         Session().execute("DROP TABLE lectureStudentSetting")
         Session().execute("DROP TABLE lectureQuestions")
@@ -227,10 +238,12 @@ class IntegrationTestCase(TestCase, TestHelpers):
         Session().execute("DROP TABLE student")
         Session().execute("DROP TABLE answer")
         Session().execute("DROP TABLE answerSummary")
+        Session().execute("DROP TABLE tutorialSummary")
         Session().execute("DROP TABLE userGeneratedQuestions")
         Session().execute("DROP TABLE userGeneratedAnswer")
         Session().execute("DROP TABLE coinAward")
         ORMBase.metadata.create_all(Session().bind)
+        clearCaches()
 
     def assertTrue(self, expr, thing=None, msg=None):
         if thing is not None:
@@ -262,6 +275,7 @@ class FunctionalTestCase(ContentFunctionalTestCase, TestHelpers):
         # Drop all DB tables & recreate
         Session().execute("DROP TABLE allocation")
         Session().execute("DROP TABLE lecture")
+        Session().execute("DROP TABLE tutorial")
         Session().execute("DROP TABLE lectureGlobalSetting")
         Session().execute("DROP TABLE lectureStudentSetting")
         Session().execute("DROP TABLE lectureQuestions")
@@ -269,10 +283,12 @@ class FunctionalTestCase(ContentFunctionalTestCase, TestHelpers):
         Session().execute("DROP TABLE student")
         Session().execute("DROP TABLE answer")
         Session().execute("DROP TABLE answerSummary")
+        Session().execute("DROP TABLE tutorialSummary")
         Session().execute("DROP TABLE userGeneratedQuestions")
         Session().execute("DROP TABLE userGeneratedAnswer")
         Session().execute("DROP TABLE coinAward")
         ORMBase.metadata.create_all(Session().bind)
+        clearCaches()
 
         transaction.commit()
         super(FunctionalTestCase, self).tearDown()
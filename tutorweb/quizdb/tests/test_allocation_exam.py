@@ -1,3 +1,7 @@
+import transaction
+from z3c.saconfig import Session
+
+from tutorweb.quizdb import db
 from .base import FunctionalTestCase
 from .base import USER_A_ID, USER_B_ID, USER_C_ID, USER_D_ID, MANAGER_ID
 
@@ -81,3 +85,31 @@ class ExamAllocationTest(FunctionalTestCase):
             0.4,
             0.5,
         ])
+
+    def test_inactiveQuestions(self):
+        """Questions made inactive behind a stale bank aren't handed out"""
+        lecObj = self.createTestLecture(qnCount=3, lecOpts=lambda i: dict(settings=[
+            dict(key="allocation_method", value="exam"),
+        ]))
+        lecPath = 'http://nohost/' + '/'.join(lecObj.getPhysicalPath())
+        dbLec = lecObj.unrestrictedTraverse('@@quizdb-sync').getDbLecture()
+
+        aAlloc = self.getJson(lecPath + '/@@quizdb-sync', user=USER_A_ID)
+        self.assertEqual(len(aAlloc['questions']), 3)
+
+        # Deactivate a question without bumping the lecture's lastUpdate
+        (Session.query(db.Question)
+            .filter_by(plonePath=dbLec.plonePath + '/qn-1')
+            .one()).active = False
+        transaction.commit()
+
+        aAlloc = self.getJson(lecPath + '/@@quizdb-sync', user=USER_A_ID)
+        self.assertEqual([a['uri'].split('?')[0].rsplit(':', 1)[-1] for a in aAlloc['questions']], [
+            'qn-0',
+            'qn-2',
+        ])
+        allQns = self.getJson(aAlloc['question_uri'], user=USER_A_ID)
+        self.assertEqual(sorted(qn['title'] for qn in allQns.values()), [
+            u'Unittest tw_latexquestion 0',
+            u'Unittest tw_latexquestion 2',
+        ])
@@ -0,0 +1,31 @@
+import unittest
+
+from tutorweb.quizdb.allocation.questionbank import QuestionBank
+
+
+class QuestionBankTest(unittest.TestCase):
+    def test_select(self):
+        """Can filter questions in the bank, get them back in plonePath order"""
+        bank = QuestionBank([
+            (5, 'tw_latexquestion', True, '/plone/dept/tut/lec/qn-5'),
+            (1, 'tw_latexquestion', True, '/plone/dept/tut/lec/qn-1'),
+            (3, 'tw_questiontemplate', True, '/plone/dept/tut/lec/qn-3'),
+            (2, 'tw_latexquestion', False, '/plone/dept/tut/lec/qn-2'),
+        ])
+        self.assertEqual(len(bank), 4)
+
+        self.assertEqual(bank.select(), [1, 3, 5])
+        self.assertEqual(bank.select(active=None), [1, 2, 3, 5])
+        self.assertEqual(bank.select(active=False), [2])
+        self.assertEqual(bank.select(qnType='tw_latexquestion'), [1, 5])
+        self.assertEqual(bank.select(qnType='tw_questiontemplate'), [3])
+        self.assertEqual(bank.select(onlineOnly=False), [1, 5])
+        self.assertEqual(bank.select(onlineOnly=True), [3])
+
+        self.assertEqual(bank.selectPaths([
+            '/plone/dept/tut/lec/qn-3',
+            '/plone/dept/tut/lec/qn-2',
+            '/plone/dept/tut/lec/qn-99',
+            '/plone/dept/tut/lec/qn-1',
+        ]), [3, 1])
+        self.assertEqual(bank.selectPaths(['/plone/dept/tut/lec/qn-2'], active=None), [2])
@@ -0,0 +1,25 @@
+import unittest
+
+from tutorweb.quizdb.allocation.sampling import sampleIds
+
+
+class SampleIdsTest(unittest.TestCase):
+    def test_sampleIds(self):
+        """Get a random selection of IDs, without repeats or excluded IDs"""
+        ids = range(100)
+        self.assertEqual(len(sampleIds(ids, 10)), 10)
+        self.assertEqual(len(set(sampleIds(ids, 100))), 100)
+        self.assertNotEqual(
+            [sampleIds(ids, 10) for i in range(5)],
+            [sampleIds(ids, 10) for i in range(5)],
+        )
+
+        # Not enough to go round, get what there is
+        self.assertEqual(sorted(sampleIds([1, 2, 2, 3], 10)), [1, 2, 3])
+        self.assertEqual(sorted(sampleIds([1, 2, 3, 4], 10, exclude=[2, 4])), [1, 3])
+        self.assertEqual(sampleIds([1, 2], 10, exclude=[1, 2]), [])
+        self.assertEqual(sampleIds([], 10), [])
+
+        # Excluded IDs are never returned
+        for i in range(100):
+            self.assertEqual(set(sampleIds(ids, 10, exclude=range(5, 100))) - set(range(5)), set())
@@ -1,3 +1,6 @@
+import json
+import unittest
+
 from zExceptions import Redirect
 
 from zope.testing.loggingsupport import InstalledHandler
@@ -6,6 +9,7 @@ from plone.app.testing import login
 
 from Products.CMFCore.utils import getToolByName
 
+from ..browser.base import iterJson, JSONBrowserView, STREAM_CHUNK_SIZE
 from .base import IntegrationTestCase
 from .base import MANAGER_ID, USER_A_ID, USER_B_ID, USER_C_ID
 
@@ -136,3 +140,108 @@ class JSONBrowserViewTest(IntegrationTestCase):
         """Look up view for class"""
         lec = self.layer['portal']['dept1']['tut1']['lec1']
         return lec.restrictedTraverse('quizdb-sync')
+
+
+class IterJsonTest(unittest.TestCase):
+    def test_sameAsDumps(self):
+        """Streamed JSON is the same as json.dumps()"""
+        for obj in [
+                None,
+                "camel",
+                [1, 2, 3],
+                dict(a=1, b=[1, 2], c=dict(d=u"\u2603", e=[dict(f=None)]), g=()),
+                [[], {}, [[dict()]]],
+                {1: [2], 2.5: [3], None: [4]},
+                ]:
+            self.assertEqual(''.join(iterJson(obj)), json.dumps(obj))
+
+    def test_generators(self):
+        """Generators are written out as lists, as they are consumed"""
+        consumed = []
+        def gen(n):
+            for i in range(n):
+                consumed.append(i)
+                yield dict(i=i, sq=[i * i])
+
+        chunks = iterJson(dict(rows=gen(3)))
+        self.assertEqual(''.join(next(chunks) for i in range(4)), '{"rows": [')
+        self.assertEqual(consumed, [0])
+        self.assertEqual(
+            json.loads('{"rows": [' + ''.join(chunks)),
+            dict(rows=[dict(i=0, sq=[0]), dict(i=1, sq=[1]), dict(i=2, sq=[4])]),
+        )
+        self.assertEqual(''.join(iterJson(gen(0))), '[]')
+
+
+class MockResponse(object):
+    def __init__(self):
+        self.status = None
+        self.headers = {}
+        self.written = []
+
+    def setStatus(self, status):
+        self.status = status
+
+    def setHeader(self, name, value):
+        self.headers[name] = value
+
+    def write(self, data):
+        self.written.append(data)
+
+
+class MockRequest(dict):
+    def __init__(self):
+        self['URL'] = 'http://nohost/plone/@@streaming-view'
+        self.form = {}
+        self.response = MockResponse()
+
+    def get_header(self, name, default=None):
+        return default
+
+
+class StreamingView(JSONBrowserView):
+    stream_json = True
+
+    def __init__(self, rowCount, failAt=None):
+        super(StreamingView, self).__init__(None, MockRequest())
+        self.rowCount = rowCount
+        self.failAt = failAt
+
+    def asDict(self, data):
+        def rows():
+            for i in range(self.rowCount):
+                if i == self.failAt:
+                    raise ValueError("Row %d is broken" % i)
+                yield 'x' * 1000
+        return dict(rows=rows())
+
+
+class StreamJsonTest(unittest.TestCase):
+    def test_stream(self):
+        """Streamed output is written in chunks"""
+        view = StreamingView(200)
+        self.assertEqual(view(), '')
+        self.assertEqual(view.request.response.status, 200)
+        self.assertTrue(len(view.request.response.written) > 1)
+        self.assertEqual(
+            json.loads(''.join(view.request.response.written)),
+            dict(rows=['x' * 1000] * 200),
+        )
+
+    def test_errorBeforeWriting(self):
+        """Errors before anything is written get an error response"""
+        view = StreamingView(10, failAt=5)
+        out = json.loads(view())
+        self.assertEqual((out['error'], out['message']), ('ValueError', 'Row 5 is broken'))
+        self.assertEqual(view.request.response.status, 500)
+        self.assertEqual(view.request.response.written, [])
+
+    def test_errorAfterWriting(self):
+        """Once streaming has started, errors are re-raised, not appended to the 200"""
+        failAt = STREAM_CHUNK_SIZE / 1000 + 10
+        view = StreamingView(failAt * 2, failAt=failAt)
+        with self.assertRaisesRegexp(ValueError, 'Row %d is broken' % failAt):
+            view()
+        self.assertEqual(view.request.response.status, 200)
+        self.assertTrue(len(view.request.response.written) > 0)
+        self.assertFalse('ValueError' in ''.join(view.request.response.written))
@@ -8,7 +8,7 @@ from Products.CMFCore.utils import getToolByName
 
 from plone.app.testing import login
 
-from ..sync.questions import getAllQuestionPath
+from ..sync.questions import getAllQuestionPath, invalidateQuestionData, questionJsonCache
 from .base import FunctionalTestCase
 from .base import USER_A_ID, USER_B_ID, USER_C_ID, USER_D_ID, MANAGER_ID
 
@@ -532,6 +532,9 @@ class GetLectureQuestionsViewTest(FunctionalTestCase):
         )
         allQns1 = allQns
 
+        # Fetching again (from cache) gives the same thing
+        self.assertEqual(self.getJson(aAlloc['question_uri']), allQns1)
+
         # Change QnTmp a bit
         time.sleep(1)
         self.layer['portal']['dept1']['tut1']['lec1']['qntmp'].title="Unittest D1 T1 L1 QTmpA"
@@ -550,3 +553,101 @@ class GetLectureQuestionsViewTest(FunctionalTestCase):
 
         # The allocations are different
         self.assertNotEquals(sorted(allQns1.keys()), sorted(allQns.keys()))
+
+    def test_questionJsonCache(self):
+        """Questions are stitched together from JSON cached per-question"""
+        portal = self.layer['portal']
+        self.getJson('http://nohost/plone/dept1/tut1/lec1/@@quizdb-sync', user=USER_A_ID)
+        login(portal, USER_A_ID)
+        view = portal.unrestrictedTraverse('dept1/tut1/lec1/@@quizdb-all-questions')
+        dbLec = view.getDbLecture()
+        self.assertEqual(len(questionJsonCache), 0)
+
+        # Output is the same as encoding a dict of all question data
+        expected = json.loads(json.dumps(dict(
+            (questionUri, view.getQuestionData(dbQn, dbLec))
+            for (questionUri, dbQn) in view.allQuestions()
+        )))
+        self.assertEqual(
+            sorted(q['title'] for q in expected.values()),
+            [u'Unittest D1 T1 L1 Q1', u'Unittest D1 T1 L1 Q2'],
+        )
+        # NB: getQuestionData() decodes the same cached JSON, there's only one copy
+        self.assertEqual(len(questionJsonCache), 2)
+        self.assertEqual(json.loads(view.asJson({})), expected)
+        self.assertEqual(len(questionJsonCache), 2)
+
+        # Second time around, question data comes from the cache
+        view.getQuestionData = lambda dbQn, dbLec: self.fail("Question data shouldn't be fetched")
+        self.assertEqual(json.loads(view.asJson({})), expected)
+
+        # Invalidating question data clears the JSON too
+        invalidateQuestionData(['/plone/dept1/tut1/lec1/qn1'])
+        self.assertEqual(len(questionJsonCache), 1)
+        invalidateQuestionData()
+        self.assertEqual(len(questionJsonCache), 0)
+
+    def test_etag(self):
+        """Clients with an up-to-date copy get a 304"""
+        def getAllQuestions(uri, etag=None):
+            browser = self.getBrowser(None, user=USER_A_ID)
+            browser.handleErrors = False
+            browser.raiseHttpErrors = False
+            if etag:
+                browser.addHeader('If-None-Match', etag)
+            browser.open(uri)
+            return (browser.headers['Status'][0:3], browser.headers.get('ETag', None), browser.contents)
+
+        aAlloc = self.getJson('http://nohost/plone/dept1/tut1/lec1/@@quizdb-sync', user=USER_A_ID)
+        (status, etag, contents) = getAllQuestions(aAlloc['question_uri'])
+        self.assertEqual(status, '200')
+        self.assertTrue(etag)
+        self.assertTrue(len(contents) > 0)
+
+        # Same ETag, so no content
+        self.assertEqual(getAllQuestions(aAlloc['question_uri'], etag), ('304', etag, ''))
+
+        # Some other ETag gets everything again
+        (status, etag2, contents) = getAllQuestions(aAlloc['question_uri'], '"parp"')
+        self.assertEqual(status, '200')
+        self.assertEqual(etag2, etag)
+        self.assertTrue(len(contents) > 0)
+
+        # Change a question, ETag changes
+        time.sleep(1)
+        login(self.layer['portal'], MANAGER_ID)
+        self.layer['portal']['dept1']['tut1']['lec1']['qn1'].title = "Unittest D1 T1 L1 Q1A"
+        self.layer['portal']['dept1']['tut1']['lec1']['qn1'].reindexObject()
+        self.notifyModify(self.layer['portal']['dept1']['tut1']['lec1']['qn1'])
+        transaction.commit()
+        (status, etag2, contents) = getAllQuestions(aAlloc['question_uri'], etag)
+        self.assertEqual(status, '200')
+        self.assertNotEqual(etag2, etag)
+
+        # Template questions vary per-request, so there's no ETag
+        portal = self.layer['portal']
+        portal['dept1'].invokeFactory(
+            type_name="tw_tutorial",
+            id="tmpltut",
+            title=u"Tutorial with template questions",
+            settings=[
+                dict(key='prob_template_eval', value='0'),
+            ],
+        )
+        portal['dept1']['tmpltut'].invokeFactory(
+            type_name="tw_lecture",
+            id="tmpllec",
+            title=u"Lecture with a template question",
+        )
+        portal['dept1']['tmpltut']['tmpllec'].invokeFactory(
+            type_name="tw_questiontemplate",
+            id="tmplqn0",
+            title="Unittest tmpllec tmplQ0",
+        )
+        self.objectPublish(portal['dept1']['tmpltut']['tmpllec'])
+        transaction.commit()
+        aAlloc = self.getJson('http://nohost/plone/dept1/tmpltut/tmpllec/@@quizdb-sync', user=USER_A_ID)
+        (status, etag, contents) = getAllQuestions(aAlloc['question_uri'])
+        self.assertEqual(status, '200')
+        self.assertEqual(etag, None)
+        self.assertTrue(len(contents) > 0)
@@ -1,9 +1,18 @@
+import collections
 import datetime
 import calendar
+import gzip
+import json
+import StringIO
 import uuid
 
 from plone.app.testing import login
+from z3c.saconfig import Session
 
+from tutorweb.quizdb import db
+
+from ..replication.dump import iterDumpData, rowsToColumns, writeDump
+from ..replication.ingest import INGEST_SECTIONS, ingestDataStream, readDumpSections
 from .base import IntegrationTestCase, FunctionalTestCase
 from .base import MANAGER_ID
 
@@ -45,6 +54,18 @@ class ReplicationDumpIngestViewTest(FunctionalTestCase):
     def doIngest(self, data, remoteAddr='127.0.0.1'):
         return self.fetchView('ingest', data, remoteAddr)
 
+    def test_gzipBody(self):
+        """Ingest view accepts gzipped dumps, as well as plain JSON"""
+        view = self.layer['portal'].unrestrictedTraverse('@@quizdb-replication-ingest')
+        dump = dict(state=dict(answerId=5), format='columnar', answer=[dict(answerId=[1, 2])])
+        self.assertEqual(view.parseBody(json.dumps(dump)), dump)
+
+        buf = StringIO.StringIO()
+        f = gzip.GzipFile(fileobj=buf, mode='wb')
+        json.dump(dump, f)
+        f.close()
+        self.assertEqual(view.parseBody(buf.getvalue()), dump)
+
     def test_answers(self):
         portal = self.layer['portal']
         login(portal, MANAGER_ID)
@@ -101,6 +122,26 @@ class ReplicationDumpIngestViewTest(FunctionalTestCase):
         # Fetch all of the data with an oversize range
         dump = self.doDump(dict(answerId=1))
         self.assertEqual(dump['state'], dict(answerId=10, coinAwardId=0))
+
+        # Streaming the dump to a file gets the same thing
+        f = StringIO.StringIO()
+        self.assertEqual(
+            writeDump(iterDumpData(dict(answerId=1)), f),
+            sum(len(v) for (k, v) in dump.items() if k not in ['host', 'state']),
+        )
+        self.assertEqual(json.loads(f.getvalue()), dump)
+
+        # Columnar dumps read back in as the same rows
+        f = StringIO.StringIO()
+        writeDump(iterDumpData(dict(answerId=1)), f, format='columnar')
+        self.assertEqual(json.loads(f.getvalue())['format'], 'columnar')
+        self.assertEqual(json.loads(f.getvalue())['answer'][0]['timeStart'], [a['timeStart'] for a in dump['answer']])
+        f.seek(0)
+        self.assertEqual(dict(
+            (k, v if k == 'state' else list(v))
+            for (k, v) in readDumpSections(f, bufSize=100)
+        ), dump)
+
         self.assertEqual(dump['host'], [
             dict(hostId=1, hostKey=dump['host'][0]['hostKey'], fqdn=dump['host'][0]['fqdn'], comment=None),
         ])
@@ -290,6 +331,70 @@ class ReplicationDumpIngestViewTest(FunctionalTestCase):
             ug_answer=1,
         ))
 
+        # Streaming the dump in a chunk at a time finds nothing new either
+        f = StringIO.StringIO(json.dumps(collections.OrderedDict(
+            [('state', dump['state'])] + [(x[0], dump[x[0]]) for x in INGEST_SECTIONS if x[0] in dump]
+        )))
+        checkpoints = []
+        self.assertEqual(ingestDataStream(readDumpSections(f, bufSize=100), chunkSize=2, commit=checkpoints.append), dict(
+            student=0,
+            lecture=0,
+            answer=0,
+            lecture_global_setting=0,
+            lecture_student_setting=0,
+            coin_award=0,
+            ug_question=0,
+            ug_answer=0,
+        ))
+        self.assertEqual(checkpoints[-1], dict(section='answer', rows=11))
+
+        # Can resume from a checkpoint, skipping what's already done
+        f.seek(0)
+        checkpoints = []
+        self.assertEqual(ingestDataStream(readDumpSections(f), chunkSize=2, checkpoint=dict(section='answer', rows=8), commit=checkpoints.append), dict(
+            student=0,
+            lecture=0,
+            answer=0,
+            coin_award=0,
+        ))
+        self.assertEqual(checkpoints[-3:], [
+            dict(section='answer', rows=8),
+            dict(section='answer', rows=10),
+            dict(section='answer', rows=11),
+        ])
+
+        # Checkpoint doesn't have to line up with chunks
+        f.seek(0)
+        checkpoints = []
+        self.assertEqual(ingestDataStream(readDumpSections(f), chunkSize=3, checkpoint=dict(section='answer', rows=8), commit=checkpoints.append), dict(
+            student=0,
+            lecture=0,
+            answer=0,
+            coin_award=0,
+        ))
+        self.assertEqual(checkpoints[-3:], [
+            dict(section='answer', rows=8),
+            dict(section='answer', rows=9),
+            dict(section='answer', rows=11),
+        ])
+
+        # Columnar version of the dump is understood too
+        dump_columnar = dict(
+            (k, v if k == 'state' else list(rowsToColumns(v, blockSize=3)))
+            for (k, v) in dump.items()
+        )
+        dump_columnar['format'] = 'columnar'
+        self.assertEqual(self.doIngest(dump_columnar), dict(
+            student=0,
+            lecture=0,
+            answer=0,
+            lecture_global_setting=0,
+            lecture_student_setting=0,
+            coin_award=0,
+            ug_question=0,
+            ug_answer=0,
+        ))
+
         # Can't upload dump when fqdn/hostKey don't match
         dump_different_fqdn = dump.copy()
         dump_different_fqdn['host'] = [
@@ -327,6 +432,15 @@ class ReplicationDumpIngestViewTest(FunctionalTestCase):
             dict(hostId=2, lectureId=8, currentVersion=0, plonePath='/'.join(lecObjs[2].getPhysicalPath()), lastUpdate=dumpPostIngest['lecture'][4]['lastUpdate']),
             dict(hostId=2, lectureId=9, currentVersion=0, plonePath='/'.join(ugLecObjs[0].getPhysicalPath()), lastUpdate=dumpPostIngest['lecture'][5]['lastUpdate']),
         ])
+        # Ingested lectures are in tutorials of their own host
+        self.assertEqual([
+            (dbLec.lectureId, dbLec.tutorial.hostId, dbLec.tutorial.plonePath, dbLec.ordinal)
+            for dbLec in Session.query(db.Lecture).filter(db.Lecture.lectureId >= 7).order_by(db.Lecture.lectureId)
+        ], [
+            (7, 2, '/'.join(lecObjs[0].aq_parent.getPhysicalPath()), 0),
+            (8, 2, '/'.join(lecObjs[2].aq_parent.getPhysicalPath()), 0),
+            (9, 2, '/'.join(ugLecObjs[0].aq_parent.getPhysicalPath()), 0),
+        ])
         self.assertEqual([(a['studentId'], a['lectureId'], a['timeStart']) for a in dumpPostIngest['answer']], [
             (1, 3, 1271010000),
             (1, 3, 1271020000),
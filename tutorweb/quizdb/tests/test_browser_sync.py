@@ -697,6 +697,78 @@ class SyncViewFunctional(FunctionalTestCase):
             [1379900010],
         )
 
+    def test_syncTutorialBatched(self):
+        """Tutorial sync gives the same as syncing each lecture, and understands cursors"""
+        def aqEntry(qnUri, answer_time, grade_after):
+            return dict(
+                synced=False,
+                uri=qnUri,
+                student_answer=0,
+                correct=True,
+                quiz_time=answer_time - 10,
+                answer_time=answer_time,
+                grade_after=grade_after,
+                practice=False,
+            )
+
+        # Each lecture of the tutorial sync matches the lecture's own sync
+        tutAlloc = self.getJson('http://nohost/plone/dept1/tut1/@@quizdb-sync', user=USER_A_ID)
+        self.assertEqual(
+            [l['uri'] for l in tutAlloc['lectures']],
+            ['http://nohost/plone/dept1/tut1/lec1/quizdb-sync', 'http://nohost/plone/dept1/tut1/lec2/quizdb-sync'],
+        )
+        for tutLec in tutAlloc['lectures']:
+            self.assertEqual(self.getJson(tutLec['uri'], user=USER_A_ID, body=dict()), tutLec)
+        self.assertEqual(
+            [l['next_uri'] for l in tutAlloc['lectures']],
+            ['http://nohost/plone/dept1/tut1/lec2/quizdb-sync', None],
+        )
+
+        # Write an answer to lec1, get a cursor back
+        lecUris = [l['uri'] for l in tutAlloc['lectures']]
+        qnUris = [l['questions'][0]['uri'] for l in tutAlloc['lectures']]
+        tutAlloc = self.getJson('http://nohost/plone/dept1/tut1/@@quizdb-sync', user=USER_A_ID, body=dict(lectures=[
+            dict(uri=lecUris[0], answerQueue=[aqEntry(qnUris[0], 1400000010, 1.5)]),
+        ]))
+        self.assertEqual(
+            [([a['answer_time'] for a in l['answerQueue']], l['answerQueueDelta']) for l in tutAlloc['lectures']],
+            [([1400000010], False), ([], False)],
+        )
+        self.assertTrue(tutAlloc['lectures'][0]['answerQueueCursor'])
+        self.assertEqual(tutAlloc['lectures'][1]['answerQueueCursor'], None)
+        cursor = tutAlloc['lectures'][0]['answerQueueCursor']
+
+        # With the cursor, only new answers come back
+        tutAlloc = self.getJson('http://nohost/plone/dept1/tut1/@@quizdb-sync', user=USER_A_ID, body=dict(lectures=[
+            dict(uri=lecUris[0], answerQueueCursor=cursor, answerQueue=[aqEntry(qnUris[0], 1400000020, 2.5)]),
+            dict(uri=lecUris[1], answerQueue=[aqEntry(qnUris[1], 1400000030, 3.5)]),
+        ]))
+        self.assertEqual(
+            [([a['answer_time'] for a in l['answerQueue']], l['answerQueueDelta']) for l in tutAlloc['lectures']],
+            [([1400000020], True), ([1400000030], False)],
+        )
+        self.assertTrue(tutAlloc['lectures'][0]['answerQueueCursor'] > cursor)
+        cursors = [l['answerQueueCursor'] for l in tutAlloc['lectures']]
+
+        # Nothing new, cursors stay put, whether fetched in one go or not
+        tutAlloc = self.getJson('http://nohost/plone/dept1/tut1/@@quizdb-sync', user=USER_A_ID, body=dict(lectures=[
+            dict(uri=lecUris[0], answerQueueCursor=cursors[0]),
+            dict(uri=lecUris[1], answerQueueCursor=cursors[1]),
+        ]))
+        self.assertEqual(
+            [(l['answerQueue'], l['answerQueueDelta'], l['answerQueueCursor']) for l in tutAlloc['lectures']],
+            [([], True, cursors[0]), ([], True, cursors[1])],
+        )
+        aAlloc = self.getJson(lecUris[0], user=USER_A_ID, body=dict(answerQueueCursor=cursors[0]))
+        self.assertEqual((aAlloc['answerQueue'], aAlloc['answerQueueDelta'], aAlloc['answerQueueCursor']), ([], True, cursors[0]))
+
+        # Without a cursor, everything comes back
+        aAlloc = self.getJson(lecUris[0], user=USER_A_ID, body=dict())
+        self.assertEqual(
+            ([a['answer_time'] for a in aAlloc['answerQueue']], aAlloc['answerQueueDelta'], aAlloc['answerQueueCursor']),
+            ([1400000010, 1400000020], False, cursors[0]),
+        )
+
     def test_answerQueueUgQuestions(self):
         """User generated questions are stored too"""
         def createQuestionTemplates(obj, count):
@@ -0,0 +1,79 @@
+import unittest
+
+import transaction
+
+from tutorweb.quizdb.cache import LRUCache
+
+class LRUCacheTest(unittest.TestCase):
+    def test_eviction(self):
+        """Least recently used entries get thrown away"""
+        c = LRUCache(maxSize=3)
+        c.set('a', 1)
+        c.set('b', 2)
+        c.set('c', 3)
+        self.assertEqual(c.get('a'), 1)  # NB: a is now most recently used
+        c.set('d', 4)
+        self.assertEqual(len(c), 3)
+        self.assertEqual(c.get('b'), None)
+        self.assertEqual(c.get('b', 'gone'), 'gone')
+        self.assertEqual([c.get(k) for k in 'acd'], [1, 3, 4])
+
+    def test_invalidate(self):
+        """Can remove everything, or just some entries"""
+        c = LRUCache()
+        for i in range(10):
+            c.set((i % 2, i), i)
+        c.invalidate(lambda k: k[0] == 1)
+        self.assertEqual(len(c), 5)
+        self.assertEqual(c.get((1, 1)), None)
+        self.assertEqual(c.get((0, 2)), 2)
+        c.invalidate()
+        self.assertEqual(len(c), 0)
+
+    def test_setAfterCommit(self):
+        """Values only appear once the transaction commits"""
+        c = LRUCache()
+        transaction.begin()
+        c.setAfterCommit('a', 1)
+        self.assertEqual(c.get('a'), None)
+        transaction.abort()
+        self.assertEqual(c.get('a'), None)
+
+        transaction.begin()
+        c.setAfterCommit('a', 1)
+        transaction.commit()
+        self.assertEqual(c.get('a'), 1)
+
+    def test_maxAge(self):
+        """Entries older than maxAge are thrown away"""
+        now = [1000]
+        c = LRUCache(maxAge=60)
+        c._time = lambda: now[0]
+        c.set('a', 1)
+        now[0] += 30
+        c.set('b', 2)
+        self.assertEqual([c.get('a'), c.get('b')], [1, 2])
+
+        now[0] += 31
+        self.assertEqual([c.get('a'), c.get('b')], [None, 2])
+        now[0] += 30
+        self.assertEqual([c.get('a'), c.get('b')], [None, None])
+
+    def test_invalidateAfterCommit(self):
+        """Entries are thrown away now, and anything added since when we commit"""
+        c = LRUCache()
+        c.set('a', 1)
+        transaction.begin()
+        c.invalidateAfterCommit()
+        self.assertEqual(c.get('a'), None)
+        c.set('a', 2)  # i.e. another thread caching the old state
+        self.assertEqual(c.get('a'), 2)
+        transaction.commit()
+        self.assertEqual(c.get('a'), None)
+
+        # Aborting leaves the cache alone
+        c.set('a', 3)
+        transaction.begin()
+        c.invalidateAfterCommit(lambda k: k == 'b')
+        transaction.abort()
+        self.assertEqual(c.get('a'), 3)
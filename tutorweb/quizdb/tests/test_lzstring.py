@@ -0,0 +1,35 @@
+import random
+import unittest
+
+from tutorweb.quizdb.lzstring.lzstring import LZString, _compress, _compressFast
+
+
+class CompressFastTest(unittest.TestCase):
+    def assertSameOutput(self, s):
+        for (bitsPerChar, getCharFromInt) in [
+                (15, lambda a: unichr(a + 32)),
+                (6, lambda a: "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/="[a]),
+                ]:
+            self.assertEqual(
+                _compressFast(s, bitsPerChar, getCharFromInt),
+                _compress(s, bitsPerChar, getCharFromInt),
+            )
+
+    def test_identical(self):
+        """Fast compressor gives exactly the same output as the original"""
+        self.assertEqual(_compressFast(None, 15, unichr), "")
+        for s in ["", "a", "aa", "ab", "abababababab", "x" * 1000, "caf\xe9 \xe9t\xe9"]:
+            self.assertSameOutput(s)
+
+        random.seed(1)
+        for i in range(50):
+            self.assertSameOutput("".join(
+                random.choice('abcde{}":, 0123\xe9')
+                for x in range(random.randint(0, 3000))
+            ))
+
+    def test_roundtrip(self):
+        """Output still decompresses"""
+        s = '{"http://nohost/plone/quizdb-get-question/abc": {"title": "Unittest D1 T1 L1 Q1"}}'
+        self.assertEqual(LZString.decompressFromUTF16(LZString.compressToUTF16(s)), s)
+        self.assertEqual(LZString.decompressFromBase64(LZString.compressToBase64(s)), s)
@@ -1,6 +1,18 @@
+import collections
+import gzip
+import json
+import os
+import shutil
+import StringIO
+import tempfile
 import unittest
+import uuid
 
-from ..replication.ingest import findMissingEntries
+from z3c.saconfig import Session
+
+from tutorweb.quizdb import db
+from .base import IntegrationTestCase
+from ..replication.ingest import INGEST_IN_SIZE, INGEST_SECTIONS, findMissingEntries, loadDump, openDump, updateHost
 
 class TestfindMissingEntries(unittest.TestCase):
     maxDiff = None
@@ -95,3 +107,229 @@ class TestfindMissingEntries(unittest.TestCase):
             [dict(a=1,x=2),               dict(a=3,x=9), dict(a=4,x=3), dict(a=5,x=1)],
             [None,                        dict(a=3,x=3), dict(a=3,x=8), None         ],
         ])
+
+
+class TestOpenDump(unittest.TestCase):
+    maxDiff = None
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def test_openDump(self):
+        """Plain and gzipped dumps can both be read, whatever they're called"""
+        dump = dict(state=dict(answerId=5), answer=[dict(answerId=1)])
+
+        with open(os.path.join(self.tempDir, 'plain.json'), 'w') as f:
+            json.dump(dump, f)
+        with openDump(os.path.join(self.tempDir, 'plain.json')) as f:
+            self.assertEqual(json.load(f), dump)
+
+        for fileName in ['gzipped.json.gz', 'gzipped.json']:
+            f = gzip.open(os.path.join(self.tempDir, fileName), 'wb')
+            json.dump(dump, f)
+            f.close()
+            with openDump(os.path.join(self.tempDir, fileName)) as f:
+                self.assertEqual(json.load(f), dump)
+
+    def test_loadDump(self):
+        """Dumps in strings can be gzipped too"""
+        dump = dict(state=dict(answerId=5), answer=[dict(answerId=1)])
+        self.assertEqual(loadDump(json.dumps(dump)), dump)
+
+        buf = StringIO.StringIO()
+        f = gzip.GzipFile(fileobj=buf, mode='wb')
+        json.dump(dump, f)
+        f.close()
+        self.assertEqual(loadDump(buf.getvalue()), dump)
+
+
+class TestIngestIds(IntegrationTestCase):
+    maxDiff = None
+
+    def setUp(self):
+        super(TestIngestIds, self).setUp()
+        self.hosts = [
+            dict(hostId=1, fqdn=u'beef.tutor-web.net', hostKey=u'0123456789012345678900000000beef'),
+            dict(hostId=2, fqdn=u'pork.tutor-web.net', hostKey=u'0123456789012345678900000000pork'),
+        ]
+        for h in self.hosts:
+            updateHost(h['fqdn'], h['hostKey'])
+        self.idMap = collections.defaultdict(dict)
+        self.inserts = {}
+
+    def ingest(self, section, rows):
+        """Ingest rows with section's function, return inserts"""
+        fn = dict((x[0], x[1]) for x in INGEST_SECTIONS)[section]
+        fn(rows, self.idMap, self.inserts)
+        return self.inserts
+
+    def localHostId(self, remoteHostId):
+        return Session.query(db.Host.hostId).filter_by(fqdn=self.hosts[remoteHostId - 1]['fqdn']).one()[0]
+
+    def test_mapIds(self):
+        """Known rows are mapped, unknown rows inserted, across hosts"""
+        beefId, porkId = self.localHostId(1), self.localHostId(2)
+        dbStudent = db.Student(hostId=beefId, userName=u'alfred', eMail=u'alfred@example.com')
+        dbLec = db.Lecture(hostId=porkId, plonePath=u'/plone/dept1/tut1/lec2')
+        Session.add(dbStudent)
+        Session.add(dbLec)
+        Session.flush()
+
+        self.ingest('host', self.hosts)
+        self.assertEqual(dict(self.idMap['hostId']), {1: beefId, 2: porkId})
+
+        # Same user on each host are different students
+        self.assertEqual(self.ingest('student', [
+            dict(studentId=10, hostId=1, userName=u'alfred', eMail=u'alfred@example.com'),
+            dict(studentId=11, hostId=2, userName=u'alfred', eMail=u'alfred@example.com'),
+            dict(studentId=12, hostId=1, userName=u'betty', eMail=u'betty@example.com'),
+        ]), dict(student=2))
+        self.assertEqual(self.idMap['studentId'][10], dbStudent.studentId)
+        self.assertEqual(
+            [(s.hostId, s.userName) for s in Session.query(db.Student).filter(
+                db.Student.studentId.in_([self.idMap['studentId'][x] for x in [11, 12]])
+            ).order_by(db.Student.studentId)],
+            [(porkId, u'alfred'), (beefId, u'betty')],
+        )
+
+        # Same path on each host are different lectures
+        self.assertEqual(self.ingest('lecture', [
+            dict(lectureId=20, hostId=2, plonePath=u'/plone/dept1/tut1/lec2', currentVersion=1, lastUpdate=0),
+            dict(lectureId=21, hostId=1, plonePath=u'/plone/dept1/tut1/lec2', currentVersion=1, lastUpdate=0),
+        ]), dict(student=2, lecture=1))
+        self.assertEqual(self.idMap['lectureId'][20], dbLec.lectureId)
+        self.assertEqual(
+            Session.query(db.Lecture.hostId).filter_by(lectureId=self.idMap['lectureId'][21]).one(),
+            (beefId,),
+        )
+
+        # Ingesting it all again inserts nothing new, maps to the same IDs
+        oldIdMap = dict((k, dict(v)) for (k, v) in self.idMap.items())
+        self.idMap = collections.defaultdict(dict)
+        self.inserts = {}
+        self.ingest('host', self.hosts)
+        self.ingest('student', [
+            dict(studentId=10, hostId=1, userName=u'alfred', eMail=u'alfred@example.com'),
+            dict(studentId=11, hostId=2, userName=u'alfred', eMail=u'alfred@example.com'),
+            dict(studentId=12, hostId=1, userName=u'betty', eMail=u'betty@example.com'),
+        ])
+        self.assertEqual(self.ingest('lecture', [
+            dict(lectureId=20, hostId=2, plonePath=u'/plone/dept1/tut1/lec2', currentVersion=1, lastUpdate=0),
+            dict(lectureId=21, hostId=1, plonePath=u'/plone/dept1/tut1/lec2', currentVersion=1, lastUpdate=0),
+        ]), dict(student=0, lecture=0))
+        self.assertEqual(dict((k, dict(v)) for (k, v) in self.idMap.items()), oldIdMap)
+
+    def test_unknownHostQuestion(self):
+        """Hosts and questions have to exist already"""
+        with self.assertRaisesRegexp(ValueError, "0123456789012345678900000000lamb"):
+            self.ingest('host', self.hosts + [
+                dict(hostId=3, fqdn=u'lamb.tutor-web.net', hostKey=u'0123456789012345678900000000lamb'),
+            ])
+        with self.assertRaisesRegexp(ValueError, "beef.tutor-web.net"):
+            self.ingest('host', [
+                dict(hostId=1, fqdn=u'beef.tutor-web.net', hostKey=u'0123456789012345678900000000pork'),
+            ])
+
+        self.ingest('question', [
+            dict(questionId=30, plonePath=u'/plone/dept1/tut1/lec1/qn1'),
+        ])
+        self.assertEqual(
+            Session.query(db.Question.plonePath).filter_by(questionId=self.idMap['questionId'][30]).one(),
+            (u'/plone/dept1/tut1/lec1/qn1',),
+        )
+        with self.assertRaisesRegexp(ValueError, "/plone/dept1/tut1/lec1/qn99"):
+            self.ingest('question', [
+                dict(questionId=30, plonePath=u'/plone/dept1/tut1/lec1/qn1'),
+                dict(questionId=31, plonePath=u'/plone/dept1/tut1/lec1/qn99'),
+            ])
+
+    def test_manyIds(self):
+        """More rows than fit in one IN (...) query"""
+        studentCount = INGEST_IN_SIZE * 2 + 5
+        students = [
+            dict(studentId=i, hostId=1 + (i % 2), userName=u'student%d' % i, eMail=u'student%d@example.com' % i)
+            for i in range(studentCount)
+        ]
+        self.ingest('host', self.hosts)
+
+        self.assertEqual(self.ingest('student', students), dict(student=studentCount))
+        self.assertEqual(len(self.idMap['studentId']), studentCount)
+        self.assertEqual(len(set(self.idMap['studentId'].values())), studentCount)
+        self.assertEqual(
+            [(s.hostId, s.userName) for s in Session.query(db.Student).filter(
+                db.Student.studentId.in_([self.idMap['studentId'][x] for x in [0, 1, studentCount - 1]])
+            ).order_by(db.Student.studentId)],
+            [
+                (self.localHostId(1), u'student0'),
+                (self.localHostId(2), u'student1'),
+                (self.localHostId(1), u'student%d' % (studentCount - 1)),
+            ],
+        )
+
+        # All found second time around
+        oldStudentIds = dict(self.idMap['studentId'])
+        self.idMap['studentId'] = {}
+        self.inserts = {}
+        self.assertEqual(self.ingest('student', students), dict(student=0))
+        self.assertEqual(self.idMap['studentId'], oldStudentIds)
+
+    def test_findNewEntries(self):
+        """ug_question, ug_answer and coin_award rows are only inserted once"""
+        def dbCounts():
+            return [Session.query(m).count() for m in [db.UserGeneratedQuestion, db.UserGeneratedAnswer, db.CoinAward]]
+
+        self.ingest('host', self.hosts)
+        self.ingest('student', [
+            dict(studentId=10, hostId=1, userName=u'alfred', eMail=u'alfred@example.com'),
+            dict(studentId=11, hostId=1, userName=u'betty', eMail=u'betty@example.com'),
+        ])
+        self.ingest('question', [
+            dict(questionId=30, plonePath=u'/plone/dept1/tut1/lec1/qn1'),
+        ])
+        guids = [uuid.uuid4().hex for i in range(2)]
+        ugQuestions = [
+            dict(ugQuestionId=1, ugQuestionGuid=guids[0], questionId=30, studentId=10, text=u'My question'),
+            dict(ugQuestionId=2, ugQuestionGuid=guids[1], questionId=30, studentId=11, text=u'My other question'),
+        ]
+        ugAnswers = [
+            dict(ugAnswerId=1, studentId=11, ugQuestionGuid=guids[0], chosenAnswer=0, questionRating=50, comments=u'', studentGrade=0),
+            dict(ugAnswerId=2, studentId=10, ugQuestionGuid=guids[1], chosenAnswer=1, questionRating=75, comments=u'', studentGrade=0),
+            # Student wasn't in the dump, so can't be ingested yet
+            dict(ugAnswerId=3, studentId=99, ugQuestionGuid=guids[0], chosenAnswer=0, questionRating=50, comments=u'', studentGrade=0),
+        ]
+        coinAwards = [
+            dict(coinAwardId=1, studentId=10, amount=1000, walletId=u'$$UNITTEST01', txId=u'UNITTESTTX01', awardTime=1400000000),
+            dict(coinAwardId=2, studentId=11, amount=2000, walletId=u'$$UNITTEST02', txId=u'UNITTESTTX02', awardTime=1400000000),
+        ]
+
+        # Rows repeated within a batch only get inserted once
+        self.ingest('ug_question', ugQuestions + [dict(ugQuestions[0], ugQuestionId=3)])
+        self.ingest('ug_answer', ugAnswers + [dict(ugAnswers[0], ugAnswerId=4)])
+        self.assertEqual(self.ingest('coin_award', coinAwards + [dict(coinAwards[1], coinAwardId=3)]), dict(
+            student=2,
+            ug_question=2,
+            ug_answer=2,
+            coin_award=2,
+        ))
+        self.assertEqual(dbCounts(), [2, 2, 2])
+        self.assertEqual(
+            sorted((a.studentId, str(a.ugQuestionGuid)) for a in Session.query(db.UserGeneratedAnswer)),
+            sorted([
+                (self.idMap['studentId'][11], str(uuid.UUID(guids[0]))),
+                (self.idMap['studentId'][10], str(uuid.UUID(guids[1]))),
+            ]),
+        )
+
+        # Ingesting them all again inserts nothing
+        self.inserts = {}
+        self.ingest('ug_question', ugQuestions)
+        self.ingest('ug_answer', ugAnswers)
+        self.assertEqual(self.ingest('coin_award', coinAwards), dict(
+            ug_question=0,
+            ug_answer=0,
+            coin_award=0,
+        ))
+        self.assertEqual(dbCounts(), [2, 2, 2])
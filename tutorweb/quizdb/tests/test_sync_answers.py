@@ -12,7 +12,7 @@ from tutorweb.content.tests.base import setRelations
 
 from tutorweb.quizdb import db
 from ..allocation.base import Allocation
-from ..sync.answers import getCoinAward, getAnswerSummary, parseAnswerQueue
+from ..sync.answers import getAnswerQueues, getCoinAward, getAnswerSummary, parseAnswerQueue, rebuildAnswerSummaries, rebuildTutorialSummaries, removeDuplicateAnswers
 from ..sync.student import getStudentSettings
 from ..utils import getDbLecture, getDbStudent
 
@@ -115,6 +115,77 @@ class GetCoinAwardTest(FunctionalTestCase):
             portal.unrestrictedTraverse('@@quizdb-student-award').asDict()['coin_available'],
             122 * 1000
         )
+        self.assertEqual(
+            [(x.tutorialId, x.lecturesAced) for x in Session.query(db.TutorialSummary).filter_by(studentId=dbStudent.studentId)],
+            [(dbLecs[0].tutorialId, 2)],
+        )
+
+    def test_rebuildTutorialSummaries(self):
+        """lecturesAced is recounted from answerSummary, over the tutorial's current lectures"""
+        dbStudents = [
+            getDbStudent(USER_A_ID, email="%s@example.com" % USER_A_ID),
+            getDbStudent(USER_B_ID, email="%s@example.com" % USER_B_ID),
+        ]
+        dbLecs = [getDbLecture('/plone/dept1/tut1/lec1'), getDbLecture('/plone/dept1/tut1/lec2')]
+        tutorialId = dbLecs[0].tutorialId
+
+        def setHighWaterMark(dbLec, dbStudent, gradeHighWaterMark):
+            dbAnsSummary = getAnswerSummary(dbLec.lectureId, dbStudent)[0]
+            dbAnsSummary.gradeHighWaterMark = gradeHighWaterMark
+            Session.flush()
+
+        def lecturesAced():
+            return sorted(
+                (x.studentId, x.lecturesAced) for x
+                in Session.query(db.TutorialSummary).filter_by(tutorialId=tutorialId)
+            )
+
+        # Nothing aced yet, nothing to write
+        self.assertEqual(rebuildTutorialSummaries(tutorialId), {})
+        self.assertEqual(lecturesAced(), [])
+
+        # A has aced both, B one
+        setHighWaterMark(dbLecs[0], dbStudents[0], 9.9)
+        setHighWaterMark(dbLecs[1], dbStudents[0], 9.75)
+        setHighWaterMark(dbLecs[0], dbStudents[1], 9.9)
+        setHighWaterMark(dbLecs[1], dbStudents[1], 9.7)
+        self.assertEqual(rebuildTutorialSummaries(tutorialId, [dbStudents[0].studentId]), {
+            dbStudents[0].studentId: 2,
+        })
+        self.assertEqual(rebuildTutorialSummaries(tutorialId), {
+            dbStudents[0].studentId: 2,
+            dbStudents[1].studentId: 1,
+        })
+        self.assertEqual(lecturesAced(), [
+            (dbStudents[0].studentId, 2),
+            (dbStudents[1].studentId, 1),
+        ])
+
+        # Drift gets fixed, lectureAced counts one not yet in answerSummary
+        Session.query(db.TutorialSummary).filter_by(tutorialId=tutorialId).update(dict(lecturesAced=7))
+        self.assertEqual(rebuildTutorialSummaries(
+            tutorialId,
+            [dbStudents[1].studentId],
+            acedLectureId=dbLecs[1].lectureId,
+        ), {
+            dbStudents[1].studentId: 2,
+        })
+        self.assertEqual(lecturesAced(), [
+            (dbStudents[0].studentId, 7),
+            (dbStudents[1].studentId, 2),
+        ])
+
+        # Lectures leaving the tutorial stop counting
+        dbLecs[0].tutorialId = None
+        Session.flush()
+        self.assertEqual(rebuildTutorialSummaries(tutorialId), {
+            dbStudents[0].studentId: 1,
+            dbStudents[1].studentId: 0,
+        })
+        self.assertEqual(lecturesAced(), [
+            (dbStudents[0].studentId, 1),
+            (dbStudents[1].studentId, 0),
+        ])
 
     def test_award_templateqn_aced(self):
         portal = self.layer['portal']
@@ -350,6 +421,343 @@ class GetCoinAwardTest(FunctionalTestCase):
             (2, 6.5),
         ])
 
+    def test_answerSummary(self):
+        """answerSummary is kept up to date incrementally, and can be rebuilt"""
+        aqTime = [1400000000]
+        def aqEntry(alloc, qnIndex, correct, grade_after, practice=False, user=USER_A_ID):
+            qnData = self.getJson(alloc[qnIndex]['uri'], user=user)
+            aqTime[0] += 10
+            return dict(
+                uri=qnData.get('uri', alloc[qnIndex]['uri']),
+                type='tw_latexquestion',
+                synced=False,
+                correct=correct,
+                student_answer=self.findAnswer(qnData, correct),
+                quiz_time=aqTime[0] - 5,
+                answer_time=aqTime[0] - 9,
+                grade_after=grade_after,
+                practice=practice,
+            )
+        def summary():
+            s = (Session.query(db.AnswerSummary)
+                .filter_by(lectureId=dbLec.lectureId)
+                .filter_by(studentId=dbStudent.studentId)
+                .one())
+            return (s.lecAnswered, s.lecCorrect, s.practiceAnswered, s.practiceCorrect)
+        def qnCounts(qnIndex):
+            return (Session.query(db.Question.timesAnswered, db.Question.timesCorrect, db.Question.difficultyBucket)
+                .join(db.Allocation, db.Allocation.questionId == db.Question.questionId)
+                .filter(db.Allocation.publicId == aAlloc[qnIndex]['uri'].rsplit('/', 1)[-1])
+                .one())
+
+        portal = self.layer['portal']
+        lecObj = portal['dept1']['tut1']['lec1']
+        self.objectPublish(lecObj)
+
+        dbLec = getDbLecture('/'.join(lecObj.getPhysicalPath()))
+        dbStudent = getDbStudent(USER_A_ID, email="%s@example.com" % USER_A_ID)
+        settings = getStudentSettings(dbLec, dbStudent)
+        aAlloc = [x for x in self.allocGetQuestionAllocation(dbLec, dbStudent, {})]
+        transaction.commit()
+        oldQnCounts = qnCounts(0)
+
+        # Counters updated as answers arrive
+        self.allocParseAnswerQueue(dbLec, dbStudent, [
+            aqEntry(aAlloc, 0, True, 1.5),
+            aqEntry(aAlloc, 0, False, 1.0),
+        ], settings)
+        transaction.commit()
+        self.assertEqual(summary(), (2, 1, 0, 0))
+        self.allocParseAnswerQueue(dbLec, dbStudent, [
+            aqEntry(aAlloc, 0, True, 2.5, practice=True),
+        ], settings)
+        transaction.commit()
+        self.assertEqual(summary(), (3, 2, 1, 1))
+
+        # Question counters were incremented too, difficulty follows
+        newQnCounts = qnCounts(0)
+        self.assertEqual(
+            (newQnCounts[0] - oldQnCounts[0], newQnCounts[1] - oldQnCounts[1]),
+            (3, 2),
+        )
+        self.assertEqual(newQnCounts[2], round(50.0 * newQnCounts[1] / newQnCounts[0]))
+
+        # Nothing to repair
+        self.assertEqual(rebuildAnswerSummaries(), 0)
+
+        # Mangle the summary, rebuilding fixes it
+        dbAnsSummary = getAnswerSummary(dbLec.lectureId, dbStudent)[0]
+        dbAnsSummary.lecAnswered = 99
+        dbAnsSummary.practiceCorrect = 0
+        Session.flush()
+        self.assertEqual(summary(), (99, 2, 1, 0))
+        self.assertEqual(rebuildAnswerSummaries(lectureIds=[dbLec.lectureId]), 1)
+        self.assertEqual(summary(), (3, 2, 1, 1))
+
+    def test_duplicateAnswers(self):
+        """Answers we already have are ignored, without counting them twice"""
+        def aqEntry(alloc, qnIndex, correct, grade_after, answer_time):
+            qnData = self.getJson(alloc[qnIndex]['uri'])
+            return dict(
+                uri=qnData.get('uri', alloc[qnIndex]['uri']),
+                type='tw_latexquestion',
+                synced=False,
+                correct=correct,
+                student_answer=self.findAnswer(qnData, correct),
+                quiz_time=answer_time - 5,
+                answer_time=answer_time,
+                grade_after=grade_after,
+            )
+        def summary():
+            s = (Session.query(db.AnswerSummary)
+                .filter_by(lectureId=dbLec.lectureId)
+                .filter_by(studentId=dbStudent.studentId)
+                .one())
+            return (s.lecAnswered, s.lecCorrect)
+
+        portal = self.layer['portal']
+        lecObj = portal['dept1']['tut1']['lec1']
+        self.objectPublish(lecObj)
+
+        dbLec = getDbLecture('/'.join(lecObj.getPhysicalPath()))
+        dbStudent = getDbStudent(USER_A_ID, email="%s@example.com" % USER_A_ID)
+        settings = getStudentSettings(dbLec, dbStudent)
+        aAlloc = [x for x in self.allocGetQuestionAllocation(dbLec, dbStudent, {})]
+        transaction.commit()
+
+        # Sync an answer, repeated within the same sync
+        aq = self.allocParseAnswerQueue(dbLec, dbStudent, [
+            aqEntry(aAlloc, 0, True, 1.5, 1400000010.5),
+            aqEntry(aAlloc, 0, True, 1.5, 1400000010.5),
+        ], settings)
+        transaction.commit()
+        self.assertEqual([(a['answer_time'], a['grade_after']) for a in aq], [
+            (1400000010, 1.5),
+        ])
+        self.assertEqual(summary(), (1, 1))
+
+        # Sync it again, alongside a new answer. Only the new one is stored
+        aq = self.allocParseAnswerQueue(dbLec, dbStudent, [
+            aqEntry(aAlloc, 0, True, 1.5, 1400000010.5),
+            aqEntry(aAlloc, 0, False, 1.0, 1400000020),
+        ], settings)
+        transaction.commit()
+        self.assertEqual([(a['answer_time'], a['grade_after']) for a in aq], [
+            (1400000010, 1.5),
+            (1400000020, 1.0),
+        ])
+        self.assertEqual(summary(), (2, 1))
+        self.assertEqual(rebuildAnswerSummaries(), 0)
+
+    def test_removeDuplicateAnswers(self):
+        """Can tidy up duplicate answers from before the unique index"""
+        aqTime = [1400000000]
+        def aqEntry(alloc, qnIndex, correct, grade_after):
+            qnData = self.getJson(alloc[qnIndex]['uri'])
+            aqTime[0] += 10
+            return dict(
+                uri=qnData.get('uri', alloc[qnIndex]['uri']),
+                type='tw_latexquestion',
+                synced=False,
+                correct=correct,
+                student_answer=self.findAnswer(qnData, correct),
+                quiz_time=aqTime[0] - 5,
+                answer_time=aqTime[0],
+                grade_after=grade_after,
+            )
+        def summary():
+            s = (Session.query(db.AnswerSummary)
+                .filter_by(lectureId=dbLec.lectureId)
+                .filter_by(studentId=dbStudent.studentId)
+                .one())
+            return (s.lecAnswered, s.lecCorrect)
+        def answers():
+            return [(a.answerId, a.grade) for a in (Session.query(db.Answer)
+                .filter_by(lectureId=dbLec.lectureId)
+                .filter_by(studentId=dbStudent.studentId)
+                .order_by(db.Answer.answerId))]
+
+        portal = self.layer['portal']
+        lecObj = portal['dept1']['tut1']['lec1']
+        self.objectPublish(lecObj)
+
+        dbLec = getDbLecture('/'.join(lecObj.getPhysicalPath()))
+        dbStudent = getDbStudent(USER_A_ID, email="%s@example.com" % USER_A_ID)
+        settings = getStudentSettings(dbLec, dbStudent)
+        aAlloc = [x for x in self.allocGetQuestionAllocation(dbLec, dbStudent, {})]
+        transaction.commit()
+
+        self.allocParseAnswerQueue(dbLec, dbStudent, [
+            aqEntry(aAlloc, 0, True, 1.5),
+            aqEntry(aAlloc, 0, False, 1.0),
+        ], settings)
+        transaction.commit()
+        origAnswers = answers()
+        self.assertEqual(removeDuplicateAnswers(), 0)
+
+        # Pretend we're a database from before the unique index, with every answer stored 3 times
+        Session.execute("DROP INDEX ix_answer_studentId_lectureId_questionId_timeEnd")
+        dbAnswers = Session.query(db.Answer).filter_by(studentId=dbStudent.studentId).all()
+        for i in range(2):
+            for dbAns in dbAnswers:
+                Session.add(db.Answer(**dict(
+                    (c.name, getattr(dbAns, c.name))
+                    for c in db.Answer.__table__.columns
+                    if c.name != 'answerId'
+                )))
+        Session.flush()
+        rebuildAnswerSummaries()
+        self.assertEqual(len(answers()), 6)
+        self.assertEqual(summary(), (6, 3))
+
+        # Only the first of each is kept, the summary is fixed
+        self.assertEqual(removeDuplicateAnswers(), 4)
+        self.assertEqual(answers(), origAnswers)
+        self.assertEqual(summary(), (2, 1))
+        self.assertEqual(removeDuplicateAnswers(), 0)
+
+    def test_answerQueueCursor(self):
+        """Given a cursor, only answers since then are returned"""
+        aqTime = [1400000000]
+        def aqEntry(alloc, qnIndex, correct, grade_after, user=USER_A_ID):
+            qnData = self.getJson(alloc[qnIndex]['uri'], user=user)
+            aqTime[0] += 10
+            return dict(
+                uri=qnData.get('uri', alloc[qnIndex]['uri']),
+                type='tw_latexquestion',
+                synced=False,
+                correct=correct,
+                student_answer=self.findAnswer(qnData, correct),
+                quiz_time=aqTime[0] - 5,
+                answer_time=aqTime[0] - 9,
+                grade_after=grade_after,
+            )
+        def parse(answerQueue, cursor):
+            alloc = Allocation.allocFor(
+                student=dbStudent,
+                dbLec=dbLec,
+                urlBase=self.layer['portal'].absolute_url(),
+            )
+            aAq = parseAnswerQueue(alloc, answerQueue, settings, answerQueueCursor=cursor)
+            transaction.commit()
+            return (
+                [a['grade_after'] for a in aAq],
+                alloc.answerQueueDelta,
+                alloc.answerQueueCursor,
+            )
+
+        portal = self.layer['portal']
+        lecObj = portal['dept1']['tut1']['lec1']
+        self.objectPublish(lecObj)
+
+        dbLec = getDbLecture('/'.join(lecObj.getPhysicalPath()))
+        dbStudent = getDbStudent(USER_A_ID, email="%s@example.com" % USER_A_ID)
+        settings = getStudentSettings(dbLec, dbStudent)
+        aAlloc = [x for x in self.allocGetQuestionAllocation(dbLec, dbStudent, {})]
+        transaction.commit()
+
+        # No answers, no cursor
+        self.assertEqual(parse([], None), ([], False, None))
+
+        # Without a cursor, get everything back
+        (grades, delta, cursor) = parse([
+            aqEntry(aAlloc, 0, True, 1.5),
+            aqEntry(aAlloc, 0, True, 2.5),
+        ], None)
+        self.assertEqual((grades, delta), ([1.5, 2.5], False))
+
+        # With the cursor, only get new answers
+        (grades, delta, cursor) = parse([
+            aqEntry(aAlloc, 0, True, 3.5),
+        ], cursor)
+        self.assertEqual((grades, delta), ([3.5], True))
+        self.assertEqual(parse([], cursor), ([], True, cursor))
+
+        # A cursor we don't recognise replays everything
+        self.assertEqual(parse([], cursor + 100)[0:2], ([1.5, 2.5, 3.5], False))
+        self.assertEqual(parse([], 'camel')[0:2], ([1.5, 2.5, 3.5], False))
+
+    def test_getAnswerQueues(self):
+        """Can fetch answerQueues for several lectures in one go"""
+        def aqEntry(alloc, qnIndex, grade_after, answer_time):
+            qnData = self.getJson(alloc[qnIndex]['uri'])
+            return dict(
+                uri=qnData.get('uri', alloc[qnIndex]['uri']),
+                type='tw_latexquestion',
+                synced=False,
+                correct=True,
+                student_answer=self.findAnswer(qnData, True),
+                quiz_time=answer_time - 5,
+                answer_time=answer_time,
+                grade_after=grade_after,
+            )
+        def allocs():
+            return [Allocation.allocFor(
+                student=dbStudent,
+                dbLec=dbLec,
+                urlBase=self.layer['portal'].absolute_url(),
+            ) for dbLec in dbLecs]
+
+        portal = self.layer['portal']
+        lecObjs = [portal['dept1']['tut1']['lec1'], portal['dept1']['tut1']['lec2']]
+        for lecObj in lecObjs:
+            self.objectPublish(lecObj)
+        dbLecs = [getDbLecture('/'.join(lecObj.getPhysicalPath())) for lecObj in lecObjs]
+        dbStudent = getDbStudent(USER_A_ID, email="%s@example.com" % USER_A_ID)
+        allSettings = [getStudentSettings(dbLec, dbStudent) for dbLec in dbLecs]
+        aAllocs = [[x for x in self.allocGetQuestionAllocation(dbLec, dbStudent, {})] for dbLec in dbLecs]
+        transaction.commit()
+
+        # Nothing answered yet
+        self.assertEqual(getAnswerQueues(allocs()), {
+            dbLecs[0].lectureId: [],
+            dbLecs[1].lectureId: [],
+        })
+
+        # 9 answers to lec1, the last 2 at the same time. 2 out-of-order answers to lec2
+        parseAnswerQueue(allocs()[0], [
+            aqEntry(aAllocs[0], 0, float(i), 1400000000 + i * 10) for i in range(7)
+        ] + [
+            aqEntry(aAllocs[0], 0, 4.5, 1400000100),
+            aqEntry(aAllocs[0], 1, 6.5, 1400000100),
+        ], allSettings[0])
+        parseAnswerQueue(allocs()[1], [
+            aqEntry(aAllocs[1], 0, 2.0, 1400000020),
+            aqEntry(aAllocs[1], 1, 1.0, 1400000010),
+        ], allSettings[1])
+        transaction.commit()
+
+        # Each lecture gets its own answers, in time order
+        lecAllocs = allocs()
+        aqs = getAnswerQueues(lecAllocs)
+        self.assertEqual(
+            [a['grade_after'] for a in aqs[dbLecs[0].lectureId]],
+            [0.0, 1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 4.5, 6.5],
+        )
+        self.assertEqual(
+            [(a['answer_time'], a['grade_after']) for a in aqs[dbLecs[1].lectureId]],
+            [(1400000010, 1.0), (1400000020, 2.0)],
+        )
+        self.assertEqual([a.answerQueueDelta for a in lecAllocs], [False, False])
+        self.assertEqual([a.targetDifficulty for a in lecAllocs], [6.5, None])
+
+        # With cursors, nothing new, but still know the last grade of the tied answers
+        cursors = dict((a.dbLec.lectureId, a.answerQueueCursor) for a in lecAllocs)
+        lecAllocs = allocs()
+        self.assertEqual(getAnswerQueues(lecAllocs, answerQueueCursors=cursors), {
+            dbLecs[0].lectureId: [],
+            dbLecs[1].lectureId: [],
+        })
+        self.assertEqual([a.answerQueueDelta for a in lecAllocs], [True, True])
+        self.assertEqual([a.targetDifficulty for a in lecAllocs], [6.5, None])
+
+        # A cursor for one lecture only gets everything for the other
+        lecAllocs = allocs()
+        aqs = getAnswerQueues(lecAllocs, answerQueueCursors={dbLecs[0].lectureId: cursors[dbLecs[0].lectureId]})
+        self.assertEqual(aqs[dbLecs[0].lectureId], [])
+        self.assertEqual([a['grade_after'] for a in aqs[dbLecs[1].lectureId]], [1.0, 2.0])
+        self.assertEqual([a.answerQueueDelta for a in lecAllocs], [True, False])
+
     def test_targetDifficulty(self):
         """We set target difficulty as part of parsing the answer queue"""
         aqTime = [1400000000]
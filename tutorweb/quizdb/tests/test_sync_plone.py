@@ -0,0 +1,139 @@
+from z3c.saconfig import Session
+
+from tutorweb.quizdb import db
+from .base import IntegrationTestCase, USER_A_ID
+
+from ..sync.answers import getAnswerSummary, rebuildTutorialSummaries
+from ..sync.plone import _placeLecture, movePloneLecture, removePloneLecture
+from ..utils import getDbHost, getDbLecture, getDbStudent, getDbTutorial, renumberTutorial
+
+
+class PlaceLectureTest(IntegrationTestCase):
+    maxDiff = None
+
+    def lectures(self, tutorialPath):
+        """Return (plonePath, ordinal) for each lecture in the tutorial"""
+        return [(l.plonePath, l.ordinal) for l in (Session.query(db.Lecture)
+            .filter_by(tutorialId=getDbTutorial(tutorialPath).tutorialId)
+            .order_by(db.Lecture.ordinal))]
+
+    def createDbLecture(self, plonePath, hostId=None):
+        dbLec = db.Lecture(
+            hostId=hostId or getDbHost().hostId,
+            plonePath=plonePath,
+        )
+        Session.add(dbLec)
+        Session.flush()
+        return dbLec
+
+    def test_getDbTutorial(self):
+        """Tutorials are created on demand, per-host"""
+        dbTut = getDbTutorial('/plone/dept1/tut1')
+        self.assertEqual(dbTut.hostId, getDbHost().hostId)
+        self.assertEqual(getDbTutorial('/plone/dept1/tut1').tutorialId, dbTut.tutorialId)
+
+        dbTut2 = getDbTutorial('/plone/dept1/tut2')
+        self.assertNotEqual(dbTut2.tutorialId, dbTut.tutorialId)
+
+        dbOtherHost = db.Host(fqdn='beef.tutor-web.net', hostKey='0123456789012345678900000000beef')
+        Session.add(dbOtherHost)
+        Session.flush()
+        dbTutOther = getDbTutorial('/plone/dept1/tut1', hostId=dbOtherHost.hostId)
+        self.assertEqual(dbTutOther.hostId, dbOtherHost.hostId)
+        self.assertNotEqual(dbTutOther.tutorialId, dbTut.tutorialId)
+        self.assertEqual(getDbTutorial('/plone/dept1/tut1', hostId=dbOtherHost.hostId).tutorialId, dbTutOther.tutorialId)
+
+    def test_newLecture(self):
+        """New lectures are put in their tutorial, in plonePath order"""
+        self.assertEqual(self.lectures('/plone/dept1/tut1'), [
+            ('/plone/dept1/tut1/lec1', 0),
+            ('/plone/dept1/tut1/lec2', 1),
+        ])
+
+        _placeLecture(self.createDbLecture('/plone/dept1/tut1/lec0'))
+        _placeLecture(self.createDbLecture('/plone/dept1/tut1/lec3'))
+        self.assertEqual(self.lectures('/plone/dept1/tut1'), [
+            ('/plone/dept1/tut1/lec0', 0),
+            ('/plone/dept1/tut1/lec1', 1),
+            ('/plone/dept1/tut1/lec2', 2),
+            ('/plone/dept1/tut1/lec3', 3),
+        ])
+
+        # Placing again doesn't change anything
+        _placeLecture(getDbLecture('/plone/dept1/tut1/lec1'))
+        self.assertEqual([x[1] for x in self.lectures('/plone/dept1/tut1')], [0, 1, 2, 3])
+
+    def test_moveLecture(self):
+        """Moving a lecture renumbers old and new tutorial"""
+        _placeLecture(self.createDbLecture('/plone/dept1/tut2/lec1'))
+        _placeLecture(self.createDbLecture('/plone/dept1/tut2/lec3'))
+
+        movePloneLecture('/plone/dept1/tut1/lec1', '/plone/dept1/tut2/lec2')
+        self.assertEqual(self.lectures('/plone/dept1/tut1'), [
+            ('/plone/dept1/tut1/lec2', 0),
+        ])
+        self.assertEqual(self.lectures('/plone/dept1/tut2'), [
+            ('/plone/dept1/tut2/lec1', 0),
+            ('/plone/dept1/tut2/lec2', 1),
+            ('/plone/dept1/tut2/lec3', 2),
+        ])
+
+        # Moving within a tutorial reorders
+        movePloneLecture('/plone/dept1/tut2/lec1', '/plone/dept1/tut2/lec4')
+        self.assertEqual(self.lectures('/plone/dept1/tut2'), [
+            ('/plone/dept1/tut2/lec2', 0),
+            ('/plone/dept1/tut2/lec3', 1),
+            ('/plone/dept1/tut2/lec4', 2),
+        ])
+
+    def test_removeLecture(self):
+        """Removed lectures leave their tutorial"""
+        dbLec = getDbLecture('/plone/dept1/tut1/lec1')
+        removePloneLecture(self.layer['portal']['dept1']['tut1']['lec1'])
+        self.assertEqual(dbLec.tutorialId, None)
+        self.assertEqual(dbLec.ordinal, None)
+        self.assertTrue(dbLec.plonePath.startswith('/deleted-'))
+        self.assertEqual(self.lectures('/plone/dept1/tut1'), [
+            ('/plone/dept1/tut1/lec2', 0),
+        ])
+
+    def test_tutorialSummary(self):
+        """Aced lectures count toward the tutorial they're currently in"""
+        dbStudent = getDbStudent(USER_A_ID, email="%s@example.com" % USER_A_ID)
+        dbAnsSummary = getAnswerSummary(getDbLecture('/plone/dept1/tut1/lec1').lectureId, dbStudent)[0]
+        dbAnsSummary.gradeHighWaterMark = 9.9
+        Session.flush()
+        tut1Id = getDbTutorial('/plone/dept1/tut1').tutorialId
+        tut2Id = getDbTutorial('/plone/dept1/tut2').tutorialId
+        rebuildTutorialSummaries(tut1Id)
+
+        def lecturesAced():
+            return dict(
+                (x.tutorialId, x.lecturesAced) for x
+                in Session.query(db.TutorialSummary).filter_by(studentId=dbStudent.studentId)
+            )
+        self.assertEqual(lecturesAced(), {tut1Id: 1})
+
+        # Moving takes the ace with it
+        movePloneLecture('/plone/dept1/tut1/lec1', '/plone/dept1/tut2/lec1')
+        self.assertEqual(lecturesAced(), {tut1Id: 0, tut2Id: 1})
+
+        movePloneLecture('/plone/dept1/tut2/lec1', '/plone/dept1/tut1/lec1')
+        self.assertEqual(lecturesAced(), {tut1Id: 1, tut2Id: 0})
+
+        # Removing takes it away
+        removePloneLecture(self.layer['portal']['dept1']['tut1']['lec1'])
+        self.assertEqual(lecturesAced(), {tut1Id: 0, tut2Id: 0})
+
+    def test_renumberTutorial(self):
+        """Ordinals are rebuilt from plonePath"""
+        dbLecs = [getDbLecture('/plone/dept1/tut1/lec1'), getDbLecture('/plone/dept1/tut1/lec2')]
+        dbLecs[0].ordinal = 5
+        dbLecs[1].ordinal = None
+        Session.flush()
+
+        renumberTutorial(dbLecs[0].tutorialId)
+        self.assertEqual(self.lectures('/plone/dept1/tut1'), [
+            ('/plone/dept1/tut1/lec1', 0),
+            ('/plone/dept1/tut1/lec2', 1),
+        ])
@@ -8,6 +8,9 @@ from zope.component import getUtility
 from Products.CMFCore.utils import getToolByName
 from plone.app.testing import login
 from plone.namedfile.file import NamedBlobFile
+from z3c.saconfig import Session
+
+from tutorweb.quizdb import db
 
 from .base import FunctionalTestCase, IntegrationTestCase
 from .base import USER_A_ID, USER_B_ID, USER_C_ID, MANAGER_ID
@@ -152,6 +155,16 @@ class GetQuestionAllocationTest(FunctionalTestCase):
         dbLec = lectureObj.restrictedTraverse('@@quizdb-sync').getDbLecture()
         syncPloneQuestions(dbLec, lectureObj)
 
+        # Questions are put in difficulty buckets, apart from unanswered ones
+        buckets = dict(
+            (qn.plonePath.rsplit('/', 1)[-1], qn.difficultyBucket)
+            for qn in Session.query(db.Question).filter(db.Question.lectures.contains(dbLec))
+        )
+        self.assertEqual(
+            [buckets['qn-%d' % i] for i in [0, 41, 200, 201, 204]],
+            [50, 40, None, 0, 25],
+        )
+
         # A should get an even spread, B focuses on easy, C focuses on hard
         statsA = getAllocStats(dbLec, self.studentA, None)
         statsB = getAllocStats(dbLec, self.studentB, 0.175)
@@ -1,7 +1,11 @@
+import transaction
+
 from plone.app.testing import login
+from z3c.saconfig import Session
 
 from tutorweb.quizdb import db
-from tutorweb.quizdb.sync.student import _chooseSettingValue, getStudentSettings
+from tutorweb.quizdb.sync.student import _chooseSettingValue, _chooseSettingValues, _variantApplicable, getStudentSettings, provisionStudentSettings
+from tutorweb.quizdb.sync.student import invalidateStudentSettings, variantCache
 from tutorweb.quizdb.utils import getDbStudent, getDbLecture
 
 from tutorweb.content.tests.base import setRelations
@@ -51,6 +55,19 @@ class SyncStudentIntegration(IntegrationTestCase):
         for x in xrange(LOTS_OF_TESTS):
             self.assertIn(csv(key="grade_nmin", max=9), '0 1 2 3 4 5 6 7 8 9'.split())
 
+        # Bulk gamma values are within bounds, hit the mean
+        out = [float(x) for x in _chooseSettingValues(db.LectureGlobalSetting(value=1000000, shape=2), LOTS_OF_TESTS)]
+        self.assertEqual(len(out), LOTS_OF_TESTS)
+        self.assertTrue(abs(sum(out) / LOTS_OF_TESTS - 2000000) < 5000)
+        out = [float(x) for x in _chooseSettingValues(db.LectureGlobalSetting(value=10, shape=2, min=5, max=30), LOTS_OF_TESTS)]
+        self.assertEqual(len(out), LOTS_OF_TESTS)
+        self.assertTrue(all(5 <= x < 30 for x in out))
+        for x in _chooseSettingValues(db.LectureGlobalSetting(key="grade_nmin", value=2, shape=2, max=9), 1000):
+            self.assertIn(x, '0 1 2 3 4 5 6 7 8 9'.split())
+
+        # Bulk fixed values are also None
+        self.assertEqual(_chooseSettingValues(db.LectureGlobalSetting(value=4), 3), [None, None, None])
+
     def test_getStudentSettings(self):
         # Create lecture with lots of different forms of setting
         lecObj = self.createTestLecture(qnCount=5, lecOpts=lambda i: dict(settings=[
@@ -231,3 +248,100 @@ class SyncStudentIntegration(IntegrationTestCase):
             [float(s['ut_uniform']) > 10 for s in settings],
             [True, True, True],  # NB: Random values are kept again.
         )
+
+    def test_variantApplicable(self):
+        """Which variants apply is remembered, until settings are invalidated"""
+        dbStudent = getDbStudent('andrew', email="andrew@example.com")
+        studentId = dbStudent.studentId
+        transaction.commit()
+
+        # Not cached until the transaction commits
+        self.assertEqual(_variantApplicable('registered', dbStudent), False)
+        self.assertEqual(variantCache.get((studentId, 'registered')), None)
+        transaction.commit()
+        self.assertEqual(variantCache.get((studentId, 'registered')), False)
+        self.assertEqual(_variantApplicable('', dbStudent), True)
+
+        # Joining a class doesn't make a difference until we invalidate
+        dbStudent = getDbStudent('andrew', email="andrew@example.com")
+        Session.add(db.Subscription(
+            student=dbStudent,
+            plonePath='/plone/schools-and-classes/ut_class',
+        ))
+        Session.flush()
+        self.assertEqual(_variantApplicable('registered', dbStudent), False)
+        invalidateStudentSettings(studentId=studentId)
+        self.assertEqual(_variantApplicable('registered', dbStudent), True)
+
+        # A stale value cached elsewhere before the subscription commits is thrown away
+        variantCache.set((studentId, 'registered'), False)
+        transaction.commit()
+        self.assertEqual(variantCache.get((studentId, 'registered')), True)
+        dbStudent = getDbStudent('andrew', email="andrew@example.com")
+        self.assertEqual(_variantApplicable('registered', dbStudent), True)
+
+    def test_provisionStudentSettings(self):
+        # Create lecture that uses all sorts of settings
+        lecObj = self.createTestLecture(qnCount=5, lecOpts=lambda i: dict(settings=[
+            dict(key="ut_static", value="0.9"),
+            dict(key="ut_static:registered", value="1.9"),
+            dict(key="ut_uniform:max", value="10"),
+            dict(key="ut_gamma", value="10"),
+            dict(key="ut_gamma:shape", value="2"),
+            dict(key="ut_gamma:max", value="30"),
+        ]))
+        self.objectPublish(lecObj)
+        dbLec = getDbLecture('/'.join(lecObj.getPhysicalPath()))
+        dbStudents = [getDbStudent(u, email="%s@example.com" % u) for u in ['andrew', 'betty', 'clara']]
+        Session.add(db.Subscription(
+            student=dbStudents[0],
+            plonePath='/plone/schools-and-classes/ut_class',
+        ))
+        Session.flush()
+
+        # Betty already has some settings, which she keeps
+        settingsBetty = getStudentSettings(dbLec, dbStudents[1])
+        self.assertEqual(Session.query(db.LectureStudentSetting).count(), 2)
+
+        # Provision everyone, andrew gets registered variant, clara also gets some random settings
+        self.assertEqual(provisionStudentSettings(dbLec, [s.studentId for s in dbStudents]), 5)
+        self.assertEqual(provisionStudentSettings(dbLec, [s.studentId for s in dbStudents]), 0)
+        self.assertEqual(
+            sorted((lss.student.userName, lss.key, lss.variant) for lss in Session.query(db.LectureStudentSetting)),
+            [
+                ('andrew', 'ut_gamma', ''),
+                ('andrew', 'ut_static', 'registered'),
+                ('andrew', 'ut_uniform', ''),
+                ('betty', 'ut_gamma', ''),
+                ('betty', 'ut_uniform', ''),
+                ('clara', 'ut_gamma', ''),
+                ('clara', 'ut_uniform', ''),
+            ],
+        )
+
+        # getStudentSettings uses what was chosen without adding any more
+        settings = [getStudentSettings(dbLec, s) for s in dbStudents]
+        self.assertEqual(Session.query(db.LectureStudentSetting).count(), 7)
+        self.assertEqual(settings[1], settingsBetty)
+        self.assertEqual([s['ut_static'] for s in settings], ['1.9', '0.9', '0.9'])
+        for s in settings:
+            self.assertTrue(0 <= float(s['ut_uniform']) < 10)
+            self.assertTrue(0 <= float(s['ut_gamma']) < 30)
+
+    def test_provisionStudentSettingsBadSetting(self):
+        """Settings we can't choose a value for are left for the student's sync to fail on"""
+        lecObj = self.createTestLecture(qnCount=5, lecOpts=lambda i: dict(settings=[
+            dict(key="ut_uniform:max", value="10"),
+            dict(key="ut_broken:shape", value="2"),
+        ]))
+        self.objectPublish(lecObj)
+        dbLec = getDbLecture('/'.join(lecObj.getPhysicalPath()))
+        dbStudents = [getDbStudent(u, email="%s@example.com" % u) for u in ['andrew', 'betty']]
+
+        self.assertEqual(provisionStudentSettings(dbLec, [s.studentId for s in dbStudents]), 2)
+        self.assertEqual(
+            sorted((lss.student.userName, lss.key) for lss in Session.query(db.LectureStudentSetting)),
+            [('andrew', 'ut_uniform'), ('betty', 'ut_uniform')],
+        )
+        with self.assertRaisesRegexp(ValueError, 'ut_broken'):
+            getStudentSettings(dbLec, dbStudents[0])
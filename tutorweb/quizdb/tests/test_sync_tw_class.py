@@ -78,3 +78,36 @@ class SyncClassSubscriptionsTest(IntegrationTestCase):
         # Student C's e-mail address is set (which had to happen in syncSubscriptions)
         dbS = Session.query(db.Student).filter_by(userName=USER_C_ID).one()
         self.assertEqual(dbS.eMail, USER_C_ID + '@example.com')
+
+    def test_provisionSettings(self):
+        """Class members get settings chosen when a lecture in the class changes"""
+        portal = self.layer['portal']
+        login(portal, MANAGER_ID)
+        lecObj = portal['dept1']['tut1']['lec2']
+
+        # Add class with A and C in it
+        classObj = portal[portal.invokeFactory(
+            type_name="tw_class",
+            id="hard_knocks",
+            title="Unittest Hard Knocks class",
+            lectures=[lecObj],
+            students=[USER_A_ID, USER_C_ID],
+        )]
+        setRelations(portal['hard_knocks'], 'lectures', [lecObj])
+        self.notifyModify(classObj)
+        dbStudentIds = dict(
+            (s.userName, s.studentId)
+            for s in Session.query(db.Student).filter(db.Student.userName.in_([USER_A_ID, USER_C_ID]))
+        )
+        self.assertEqual(len(dbStudentIds), 2)
+
+        # Give lec2 a random setting, everyone in the class gets a value up front
+        lecObj.settings = [dict(key='ut_uniform:max', value='10')]
+        self.notifyModify(lecObj)
+        dbLec = Session.query(db.Lecture).filter_by(plonePath='/'.join(lecObj.getPhysicalPath())).one()
+        self.assertEqual(
+            sorted((lss.studentId, lss.key) for lss in (Session.query(db.LectureStudentSetting)
+                .filter_by(lectureId=dbLec.lectureId)
+                .filter_by(lectureVersion=dbLec.currentVersion))),
+            sorted((id, u'ut_uniform') for id in dbStudentIds.values()),
+        )
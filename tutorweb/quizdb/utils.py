@@ -67,3 +67,34 @@ def getDbLecture(plonePath):
         return dbLec
     except NoResultFound:
         raise ValueError("lecture %s does not exist" % plonePath)
+
+
+def getDbTutorial(plonePath, hostId=None):
+    """
+    Find / create a tutorial object corresponding to plonePath, on hostId
+    (default the current host)
+    """
+    if hostId is None:
+        hostId = getDbHost().hostId
+    try:
+        dbTut = Session.query(db.Tutorial) \
+            .filter_by(hostId=hostId) \
+            .filter_by(plonePath=plonePath) \
+            .one()
+    except NoResultFound:
+        dbTut = db.Tutorial(
+            hostId=hostId,
+            plonePath=plonePath,
+        )
+        Session.add(dbTut)
+        Session.flush()
+    return dbTut
+
+
+def renumberTutorial(tutorialId):
+    """Set ordinals of all lectures within tutorial, in plonePath order"""
+    for (i, dbLec) in enumerate(Session.query(db.Lecture)
+            .filter(db.Lecture.tutorialId == tutorialId)
+            .order_by(db.Lecture.plonePath)):
+        dbLec.ordinal = i
+    Session.flush()